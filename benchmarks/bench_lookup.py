@@ -0,0 +1,125 @@
+"""
+Benchmark gene and scatter plot lookups as the number of buckets grows.
+
+Loads synthetic buckets into a scratch database, then times the
+(bucket_id, type, slug) and (bucket_id, type) lookups made by the API,
+with and without the composite indexes.  The scratch database is reset on
+each run;  set LUNA_BENCH_DB_CONNECT to choose it (default:  a SQLite file
+in /tmp).
+
+Usage:  python benchmarks/bench_lookup.py [num_buckets ...]
+"""
+import os
+import sys
+import time
+import random
+import numpy as np
+from sqlalchemy import text
+
+DEFAULT_BENCH_DB_CONNECT = "sqlite:////tmp/luna_bench.db"
+os.environ["LUNA_DB_CONNECT"] = os.getenv(
+    "LUNA_BENCH_DB_CONNECT", DEFAULT_BENCH_DB_CONNECT
+)
+
+from luna.db.db_util import DbConnection  # noqa: E402
+from luna.db.bulk_insert import BulkInsert  # noqa: E402
+from luna.db.bucket import Bucket  # noqa: E402
+from luna.db import cellular_annotation as ann  # noqa: E402
+from luna.db import scatter_plot as sca  # noqa: E402
+
+DEFAULT_BUCKET_COUNTS = [1, 10, 50]
+NUM_GENES = 200
+NUM_CELLS = 2000
+NUM_LOOKUPS = 200
+
+
+def main(bucket_count_list):
+    """Run the benchmark for each number of buckets."""
+    print("buckets  rows     indexed   gene_ms   plot_ms")
+    for num_buckets in bucket_count_list:
+        db_connection = load_buckets(num_buckets)
+        for indexed in [True, False]:
+            if not indexed:
+                drop_indexes(db_connection.engine)
+            gene_ms, plot_ms = time_lookups(db_connection, num_buckets)
+            num_rows = num_buckets * NUM_GENES
+            print(
+                f"{num_buckets:<8} {num_rows:<8} {str(indexed):<9} "
+                f"{gene_ms:<9.3f} {plot_ms:<9.3f}"
+            )
+
+
+def load_buckets(num_buckets):
+    """Reset the scratch database, and load synthetic buckets."""
+    db_connection = DbConnection()
+    db_connection.reset_database()
+    session = db_connection.session
+    values = np.random.default_rng(0).random(NUM_CELLS)
+    coordinates = np.random.default_rng(1).random((NUM_CELLS, 2))
+    bulk_insert = BulkInsert(
+        db_connection.engine, ann.CellularAnnotation.__table__
+    )
+    target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+    for index in range(num_buckets):
+        bucket = Bucket(f"bucket{index}", f"bucket{index}")
+        session.add(bucket)
+        session.commit()
+        annotation_list = [
+            ann.CellularAnnotation(f"gene{i}", target_type, values, bucket.id)
+            for i in range(NUM_GENES)
+        ]
+        bulk_insert.insert(annotation_list)
+        for plot_type in sca.ScatterPlotType:
+            session.add(sca.ScatterPlot(plot_type, coordinates, bucket.id))
+        session.commit()
+    return db_connection
+
+
+def drop_indexes(engine):
+    """Drop the composite indexes, to measure lookups without them."""
+    with engine.begin() as connection:
+        for table in [ann.CellularAnnotation, sca.ScatterPlot]:
+            for index in table.__table__.indexes:
+                connection.execute(text(f"DROP INDEX {index.name}"))
+
+
+def time_lookups(db_connection, num_buckets):
+    """Get the mean gene and scatter plot lookup times, in milliseconds."""
+    session = db_connection.session
+    rng = random.Random(0)
+    target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+    bucket_id_list = [b.id for b in session.query(Bucket.id)]
+
+    start = time.perf_counter()
+    for _ in range(NUM_LOOKUPS):
+        record = (
+            session.query(ann.CellularAnnotation.value_blob)
+            .filter_by(
+                bucket_id=rng.choice(bucket_id_list),
+                type=target_type,
+                slug=f"gene{rng.randrange(NUM_GENES)}",
+            )
+            .first()
+        )
+        assert record is not None
+    gene_ms = (time.perf_counter() - start) * 1000 / NUM_LOOKUPS
+
+    start = time.perf_counter()
+    for _ in range(NUM_LOOKUPS):
+        record = (
+            session.query(sca.ScatterPlot.lod_order)
+            .filter_by(
+                bucket_id=rng.choice(bucket_id_list),
+                type=sca.ScatterPlotType.UMAP,
+            )
+            .first()
+        )
+        assert record is not None
+    plot_ms = (time.perf_counter() - start) * 1000 / NUM_LOOKUPS
+    session.close()
+    return gene_ms, plot_ms
+
+
+if __name__ == "__main__":
+    bucket_count_list = [int(arg) for arg in sys.argv[1:]]
+    main(bucket_count_list or DEFAULT_BUCKET_COUNTS)
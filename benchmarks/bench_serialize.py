@@ -0,0 +1,69 @@
+"""
+Benchmark JSON serialization of scatter plot coordinates.
+
+Compares the per-cell pydantic path, where each cell becomes a Coordinate
+object that is then encoded and dumped via the standard json module, with
+the orjson paths used by the API, in both the row and columnar layouts.
+No database is needed.
+
+Usage:  python benchmarks/bench_serialize.py [num_cells ...]
+"""
+import json
+import sys
+import time
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from luna.api import api
+
+DEFAULT_CELL_COUNTS = [10000, 100000, 200000]
+NUM_REPEATS = 3
+
+
+def main(cell_count_list):
+    """Run the benchmark for each number of cells."""
+    print("cells    path       ms        bytes")
+    for num_cells in cell_count_list:
+        coordinates = np.random.default_rng(0).normal(size=(num_cells, 2))
+        for name, serialize in [
+            ("pydantic", serialize_pydantic),
+            ("rows", serialize_rows),
+            ("columns", serialize_columns),
+        ]:
+            ms, num_bytes = time_serialize(serialize, coordinates)
+            print(f"{num_cells:<8} {name:<10} {ms:<9.1f} {num_bytes}")
+
+
+def serialize_pydantic(coordinates):
+    """Serialize one pydantic Coordinate object per cell."""
+    coordinate_list = [
+        api.Coordinate(x=x, y=y) for x, y in coordinates.tolist()
+    ]
+    return json.dumps(jsonable_encoder(coordinate_list)).encode("utf-8")
+
+
+def serialize_rows(coordinates):
+    """Serialize a list of {x, y} objects via orjson."""
+    content = api._get_coordinate_content(coordinates, api.LAYOUT_ROWS)
+    return api._json_body(content)[0]
+
+
+def serialize_columns(coordinates):
+    """Serialize one list per axis via orjson."""
+    content = api._get_coordinate_content(coordinates, api.LAYOUT_COLUMNS)
+    return api._json_body(content)[0]
+
+
+def time_serialize(serialize, coordinates):
+    """Get the best time in milliseconds, and the size of the body."""
+    best_ms = None
+    for _ in range(NUM_REPEATS):
+        start = time.perf_counter()
+        body = serialize(coordinates)
+        ms = (time.perf_counter() - start) * 1000
+        best_ms = ms if best_ms is None else min(best_ms, ms)
+    return best_ms, len(body)
+
+
+if __name__ == "__main__":
+    cell_count_list = [int(arg) for arg in sys.argv[1:]]
+    main(cell_count_list or DEFAULT_CELL_COUNTS)
@@ -0,0 +1,349 @@
+"""
+Benchmark ingest, downsampling and every API endpoint on synthetic data.
+
+For each combination of cell count, gene count and matrix layout, writes a
+synthetic h5ad file (see synthetic.py), then times H5adDb ingest,
+H5adDownSample, and each GET endpoint of the API via the FastAPI test
+client, both cold (empty response cache) and warm.  Results are printed,
+and written as JSON tagged with the current git commit, so that runs can
+be compared across commits with compare.py.  The scratch database is reset
+for each combination;  set LUNA_BENCH_DB_CONNECT to choose it (default:  a
+SQLite file in /tmp).
+
+Usage:  python benchmarks/bench_suite.py [--cells N ...] [--genes N ...]
+            [--layout sparse|dense ...] [--mode orm|bulk] [--repeats N]
+            [--output FILE]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+
+DEFAULT_BENCH_DB_CONNECT = "sqlite:////tmp/luna_bench.db"
+os.environ["LUNA_DB_CONNECT"] = os.getenv(
+    "LUNA_BENCH_DB_CONNECT", DEFAULT_BENCH_DB_CONNECT
+)
+
+from fastapi.testclient import TestClient  # noqa: E402
+from luna.api import api  # noqa: E402
+from luna.db.db_util import DbConnection  # noqa: E402
+from luna.h5ad.h5ad_persist import H5adDb  # noqa: E402
+from luna.h5ad.h5ad_downsample import H5adDownSample  # noqa: E402
+from luna.vignette.vignette_persist import VignetteDb  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic import make_h5ad  # noqa: E402
+
+DEFAULT_CELL_COUNTS = [10000]
+DEFAULT_GENE_COUNTS = [1000]
+LAYOUT_LIST = ["sparse", "dense"]
+DEFAULT_REPEATS = 5
+DEFAULT_OUTPUT = "/tmp/luna_bench_suite.json"
+
+BUCKET_SLUG = "synthetic"
+ANNOTATION_SLUG = "cell_type"
+CELL_FILTER = "cell_type:type 0|type 1;sex:F"
+GENE_QUERY = "gene"
+NUM_MATRIX_GENES = 10
+NUM_DOWNSAMPLE_GENES = 100
+DOWNSAMPLE_FRACTION = 10
+BINARY_HEADERS = {"Accept": api.BINARY_MEDIA_TYPE}
+
+# Routes served by FastAPI itself, rather than by Luna.
+EXCLUDED_ROUTES = ["/openapi.json", "/docs", "/docs/oauth2-redirect", "/redoc"]
+
+
+def main(args):
+    """Run the benchmark for each combination of sizes and layouts."""
+    result_list = []
+    for num_cells in args.cells:
+        for num_genes in args.genes:
+            for layout in args.layout:
+                config = {
+                    "cells": num_cells,
+                    "genes": num_genes,
+                    "layout": layout,
+                }
+                print(f"# {num_cells} cells, {num_genes} genes, {layout}")
+                result_list.extend(run_config(config, args))
+
+    uncovered_list = get_uncovered_routes()
+    for route in uncovered_list:
+        print(f"Warning:  route not benchmarked:  {route}")
+    report = {
+        "commit": get_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "db_connect": os.environ["LUNA_DB_CONNECT"].split(":")[0],
+        "ingest_mode": args.mode,
+        "repeats": args.repeats,
+        "uncovered_routes": uncovered_list,
+        "results": result_list,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to:  {args.output}")
+
+
+def run_config(config, args):
+    """Run all benchmarks for one combination of sizes and layout."""
+    result_list = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, "synthetic.h5ad")
+        start = time.perf_counter()
+        gene_list = make_h5ad(
+            file_name,
+            config["cells"],
+            config["genes"],
+            dense=config["layout"] == "dense",
+        )
+        result_list.append(_step_result(config, "generate", start))
+
+        DbConnection().reset_database()
+        start = time.perf_counter()
+        h5ad = H5adDb(
+            BUCKET_SLUG,
+            file_name,
+            "Synthetic h5ad file",
+            "http://example.com",
+            ingest_mode=args.mode,
+            correlation=True,
+        )
+        h5ad.persist_to_database()
+        h5ad.session.close()
+        result_list.append(_step_result(config, "ingest", start))
+
+        start = time.perf_counter()
+        downsample = H5adDownSample(
+            file_name,
+            max(config["cells"] // DOWNSAMPLE_FRACTION, 1),
+            gene_list[:NUM_DOWNSAMPLE_GENES],
+        )
+        downsample.save(os.path.join(tmp_dir, "downsampled.h5ad"))
+        result_list.append(_step_result(config, "downsample", start))
+
+        persist_vignettes(tmp_dir, gene_list[0].lower())
+        api.metadata_cache.invalidate()
+        client = TestClient(api.app)
+        gene_slug_list = client.get(
+            f"/genes/{BUCKET_SLUG}",
+            params={"q": GENE_QUERY, "limit": NUM_MATRIX_GENES},
+        ).json()
+        request_list = get_request_list(gene_slug_list[0], gene_slug_list)
+        for request in request_list:
+            result_list.extend(time_request(client, request, config, args))
+    return result_list
+
+
+def persist_vignettes(tmp_dir, gene):
+    """Persist a single vignette for the synthetic bucket."""
+    vignette_file = os.path.join(tmp_dir, "vignettes.json")
+    vignette_json = {
+        "bucket_slug": BUCKET_SLUG,
+        "vignettes": [
+            {
+                "slug": "synthetic",
+                "label": "Synthetic",
+                "description": "Synthetic vignette",
+                "gene": gene,
+            }
+        ],
+    }
+    with open(vignette_file, "w") as f:
+        json.dump(vignette_json, f)
+    vignette_db = VignetteDb(vignette_file)
+    vignette_db.persist_to_database()
+    vignette_db.session.close()
+
+
+def get_request_list(gene, matrix_gene_list):
+    """Get the (route, path, params, headers) of each request to time."""
+    b = BUCKET_SLUG
+    genes = ",".join(matrix_gene_list)
+    filter_params = {"filter": CELL_FILTER}
+    annotation = f"/annotation/{b}/{ANNOTATION_SLUG}"
+    expression = f"/expression/{b}/{gene}"
+    return [
+        ("/buckets", "/buckets", {}, {}),
+        ("/annotation_list/{bucket_slug}", f"/annotation_list/{b}", {}, {}),
+        ("/annotation/{bucket_slug}/{annotation_slug}", annotation, {}, {}),
+        (
+            "/annotation/{bucket_slug}/{annotation_slug}",
+            annotation,
+            {"format": "codes"},
+            {},
+        ),
+        (
+            "/annotation/{bucket_slug}/{annotation_slug}",
+            annotation,
+            filter_params,
+            {},
+        ),
+        ("/expression/{bucket_slug}/{gene}", expression, {}, {}),
+        ("/expression/{bucket_slug}/{gene}", expression, {}, BINARY_HEADERS),
+        ("/expression/{bucket_slug}/{gene}", expression, filter_params, {}),
+        (
+            "/expression/{bucket_slug}/{gene}/stats",
+            f"{expression}/stats",
+            {},
+            {},
+        ),
+        (
+            "/expression/{bucket_slug}/{gene}/correlated",
+            f"{expression}/correlated",
+            {"method": "pearson"},
+            {},
+        ),
+        (
+            "/expression/{bucket_slug}/{gene}/correlated",
+            f"{expression}/correlated",
+            {"method": "spearman"},
+            {},
+        ),
+        (
+            "/expression/{bucket_slug}/{gene}/by/{annotation_slug}",
+            f"{expression}/by/{ANNOTATION_SLUG}",
+            {},
+            {},
+        ),
+        (
+            "/expression_matrix/{bucket_slug}",
+            f"/expression_matrix/{b}",
+            {"genes": genes},
+            {},
+        ),
+        (
+            "/expression_matrix/{bucket_slug}",
+            f"/expression_matrix/{b}",
+            {"genes": genes},
+            BINARY_HEADERS,
+        ),
+        (
+            "/dot_plot/{bucket_slug}/{annotation_slug}",
+            f"/dot_plot/{b}/{ANNOTATION_SLUG}",
+            {"genes": genes},
+            {},
+        ),
+        ("/genes/{bucket_slug}", f"/genes/{b}", {"q": GENE_QUERY}, {}),
+        *_get_scatter_plot_requests("umap"),
+        *_get_scatter_plot_requests("tsne"),
+        ("/vignettes/{bucket_slug}", f"/vignettes/{b}", {}, {}),
+        ("/metrics", "/metrics", {}, {}),
+    ]
+
+
+def _get_scatter_plot_requests(plot):
+    b = BUCKET_SLUG
+    route = f"/{plot}/{{bucket_slug}}"
+    return [
+        (route, f"/{plot}/{b}", {}, {}),
+        (route, f"/{plot}/{b}", {}, BINARY_HEADERS),
+        (route, f"/{plot}/{b}", {"layout": "columns"}, {}),
+        (route, f"/{plot}/{b}", {"filter": CELL_FILTER}, {}),
+        (f"{route}/view", f"/{plot}/{b}/view", {}, {}),
+        (f"{route}/view", f"/{plot}/{b}/view", {"layout": "columns"}, {}),
+    ]
+
+
+def time_request(client, request, config, args):
+    """Time one request cold and warm, and get the two results."""
+    route, path, params, headers = request
+    variant = "&".join(
+        f"{k}={len(v.split(','))}" if k == "genes" else f"{k}={v}"
+        for k, v in params.items()
+    )
+    if headers:
+        variant = " ".join(filter(None, [variant, "binary"]))
+
+    result_list = []
+    for cache in ["cold", "warm"]:
+        ms_list = []
+        for _ in range(args.repeats):
+            if cache == "cold":
+                api.response_cache.clear()
+            start = time.perf_counter()
+            response = client.get(path, params=params, headers=headers)
+            ms_list.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f"{path} {variant}:  status {response.status_code}."
+                )
+        result = dict(
+            config,
+            benchmark="endpoint",
+            route=route,
+            variant=variant,
+            cache=cache,
+            first_ms=ms_list[0],
+            min_ms=min(ms_list),
+            median_ms=statistics.median(ms_list),
+            bytes=len(response.content),
+        )
+        print(
+            f"{route:<56} {variant:<40} {cache:<5} "
+            f"{result['median_ms']:>10.2f} ms {result['bytes']:>12} bytes"
+        )
+        result_list.append(result)
+    return result_list
+
+
+def get_uncovered_routes():
+    """Get the GET routes of the API that the suite does not request."""
+    covered = {request[0] for request in get_request_list("gene", ["gene"])}
+    uncovered_list = []
+    for route in api.app.routes:
+        methods = getattr(route, "methods", None) or set()
+        if "GET" not in methods or route.path in EXCLUDED_ROUTES:
+            continue
+        if route.path not in covered:
+            uncovered_list.append(route.path)
+    return uncovered_list
+
+
+def get_commit():
+    """Get the current git commit, or None outside a git checkout."""
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def _step_result(config, benchmark, start):
+    seconds = time.perf_counter() - start
+    print(f"{benchmark:<56} {seconds:>10.2f} s")
+    return dict(config, benchmark=benchmark, seconds=seconds)
+
+
+def parse_args(arg_list):
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--cells", type=int, nargs="+")
+    parser.add_argument("--genes", type=int, nargs="+")
+    parser.add_argument("--layout", choices=LAYOUT_LIST, nargs="+")
+    parser.add_argument(
+        "--mode", choices=H5adDb.INGEST_MODES, default=H5adDb.ORM_MODE
+    )
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    args = parser.parse_args(arg_list)
+    args.cells = args.cells or DEFAULT_CELL_COUNTS
+    args.genes = args.genes or DEFAULT_GENE_COUNTS
+    args.layout = args.layout or LAYOUT_LIST
+    return args
+
+
+if __name__ == "__main__":
+    main(parse_args(sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""
+Compare two result files written by bench_suite.py.
+
+Matches results by sizes, layout, benchmark, route, variant and cache, and
+prints the old and new timings (median milliseconds for endpoints, seconds
+for other steps) with their ratio, flagging ratios above the threshold.
+Exits with status 1 if any result regressed.
+
+Usage:  python benchmarks/compare.py old.json new.json [threshold]
+"""
+import sys
+import json
+
+DEFAULT_THRESHOLD = 1.2
+KEY_LIST = ["cells", "genes", "layout", "benchmark", "route", "variant"]
+
+
+def main(old_file_name, new_file_name, threshold):
+    """Print the comparison, and get the number of regressions."""
+    old_map = load_results(old_file_name)
+    new_map = load_results(new_file_name)
+    num_regressions = 0
+    for key, new_value in new_map.items():
+        if key not in old_map:
+            continue
+        old_value = old_map[key]
+        ratio = new_value / old_value if old_value > 0 else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = "REGRESSION"
+            num_regressions += 1
+        label = " ".join(str(k) for k in key if k)
+        print(
+            f"{label:<100} {old_value:>10.2f} {new_value:>10.2f} "
+            f"{ratio:>6.2f}x {flag}"
+        )
+    return num_regressions
+
+
+def load_results(file_name):
+    """Map each result key to its timing."""
+    with open(file_name) as f:
+        report = json.load(f)
+    print(f"{file_name}:  commit {report['commit']}")
+    result_map = {}
+    for result in report["results"]:
+        key = tuple(result.get(k) for k in KEY_LIST) + (result.get("cache"),)
+        result_map[key] = result.get("median_ms", result.get("seconds"))
+    return result_map
+
+
+if __name__ == "__main__":
+    threshold = DEFAULT_THRESHOLD
+    if len(sys.argv) > 3:
+        threshold = float(sys.argv[3])
+    sys.exit(1 if main(sys.argv[1], sys.argv[2], threshold) > 0 else 0)
@@ -0,0 +1,129 @@
+"""
+Generate synthetic h5ad files, for benchmarks.
+
+Cells are drawn from a fixed number of clusters, each with its own cell
+type, tissue, expression profile and UMAP / TSNE position, so that
+annotations, scatter plots and expression are realistically correlated.
+Expression is log-normalized, with roughly 90% zeros.  X is stored as a
+sparse CSR matrix, or as a dense matrix, and is generated and written
+through h5py one block of BLOCK_SIZE cells at a time, so that memory is
+bounded by the block, not the matrix.
+
+Usage:  python benchmarks/synthetic.py num_cells num_genes file_name
+            [--dense]
+"""
+import sys
+import warnings
+import anndata
+import h5py
+import numpy as np
+import pandas as pd
+
+NUM_CLUSTERS = 20
+NUM_TISSUES = 10
+BLOCK_SIZE = 10000
+NONZERO_FRACTION = 0.1
+
+
+def make_h5ad(file_name, num_cells, num_genes, dense=False, seed=0):
+    """Write a synthetic h5ad file, and return its list of gene names."""
+    warnings.simplefilter(action="ignore", category=FutureWarning)
+    rng = np.random.default_rng(seed)
+    clusters = rng.integers(0, NUM_CLUSTERS, size=num_cells)
+    gene_list = [f"Gene{i:05d}" for i in range(num_genes)]
+
+    # X is added below, one block at a time.
+    adata = anndata.AnnData(
+        obs=_make_obs(rng, clusters),
+        var=pd.DataFrame(index=gene_list),
+        obsm={
+            "X_umap": _make_embedding(rng, clusters, 10.0),
+            "X_tsne": _make_embedding(rng, clusters, 50.0),
+        },
+    )
+    adata.write_h5ad(file_name)
+
+    # Each cluster expresses each gene at its own rate.
+    rates = rng.gamma(0.5, 2.0, size=(NUM_CLUSTERS, num_genes))
+    with h5py.File(file_name, "a") as h5ad_file:
+        if dense:
+            _write_dense(h5ad_file, rng, rates, clusters)
+        else:
+            _write_csr(h5ad_file, rng, rates, clusters)
+    return gene_list
+
+
+def _write_dense(h5ad_file, rng, rates, clusters):
+    shape = (len(clusters), rates.shape[1])
+    x = h5ad_file.create_dataset("X", shape=shape, dtype=np.float32)
+    x.attrs["encoding-type"] = "array"
+    x.attrs["encoding-version"] = "0.2.0"
+    for start in range(0, len(clusters), BLOCK_SIZE):
+        end = min(start + BLOCK_SIZE, len(clusters))
+        x[start:end] = _make_block(rng, rates[clusters[start:end]])
+
+
+def _write_csr(h5ad_file, rng, rates, clusters):
+    # Data and indices grow as each block is appended;  indptr is int64, as
+    # large files hold more than 2^31 nonzero values.
+    x = h5ad_file.create_group("X")
+    x.attrs["encoding-type"] = "csr_matrix"
+    x.attrs["encoding-version"] = "0.1.0"
+    x.attrs["shape"] = np.array([len(clusters), rates.shape[1]])
+    data = x.create_dataset(
+        "data", shape=(0,), maxshape=(None,), dtype=np.float32, chunks=True
+    )
+    indices = x.create_dataset(
+        "indices", shape=(0,), maxshape=(None,), dtype=np.int32, chunks=True
+    )
+    indptr = x.create_dataset(
+        "indptr", shape=(len(clusters) + 1,), dtype=np.int64
+    )
+    indptr[0] = 0
+    num_values = 0
+    for start in range(0, len(clusters), BLOCK_SIZE):
+        end = min(start + BLOCK_SIZE, len(clusters))
+        block = _make_block(rng, rates[clusters[start:end]])
+        rows, columns = np.nonzero(block)
+        block_end = num_values + len(rows)
+        data.resize((block_end,))
+        indices.resize((block_end,))
+        data[num_values:block_end] = block[rows, columns]
+        indices[num_values:block_end] = columns
+        row_counts = np.bincount(rows, minlength=end - start)
+        first_row = start + 1
+        indptr[first_row:end + 1] = num_values + np.cumsum(row_counts)
+        num_values = block_end
+
+
+def _make_block(rng, rates):
+    counts = rng.poisson(rates)
+    counts[rng.random(counts.shape) > NONZERO_FRACTION * 2] = 0
+    return np.log1p(counts).astype(np.float32)
+
+
+def _make_obs(rng, clusters):
+    cell_names = [f"cell{i}" for i in range(len(clusters))]
+    tissues = clusters % NUM_TISSUES
+    sexes = rng.integers(0, 2, size=len(clusters))
+    return pd.DataFrame(
+        {
+            "cell_type": pd.Categorical([f"type {c}" for c in clusters]),
+            "tissue": pd.Categorical([f"Tissue{t}" for t in tissues]),
+            "sex": pd.Categorical(np.array(["F", "M"])[sexes]),
+            "n_counts": rng.integers(1000, 100000, size=len(clusters)),
+        },
+        index=cell_names,
+    )
+
+
+def _make_embedding(rng, clusters, spread):
+    centers = rng.uniform(-spread, spread, size=(NUM_CLUSTERS, 2))
+    noise = rng.normal(scale=spread / 10, size=(len(clusters), 2))
+    return (centers[clusters] + noise).astype(np.float32)
+
+
+if __name__ == "__main__":
+    num_cells, num_genes, file_name = sys.argv[1:4]
+    dense = "--dense" in sys.argv[4:]
+    make_h5ad(file_name, int(num_cells), int(num_genes), dense=dense)
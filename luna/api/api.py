@@ -3,18 +3,47 @@ Luna API.
 
 API is written via FastAPI.
 """
-from fastapi import FastAPI, HTTPException, Response
+import asyncio
+import hashlib
+import os
+import weakref
+import numpy as np
+import orjson
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from pydantic import BaseModel
-from typing import List, Optional
-from natsort import natsorted, ns
-from luna.db.db_util import DbConnection
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+from typing import List, Optional, Union
+from luna.db.db_util import DbPool
 from luna.db import bucket
 from luna.db import vignette
 from luna.db import cellular_annotation as ann
 from luna.db import scatter_plot as sca
+from luna.db.gene_statistics import GeneStatistics
+from luna.db.group_statistics import get_group_statistics, get_group_means
+from luna.db.correlation import PEARSON, SPEARMAN
+from luna.db.correlation import decode_scores, get_scores
 from luna.db.base import DB_DELIM
+from luna.db.vector import decode_vector, VECTOR_DTYPE
+from luna.db.categorical import encode_categories, decode_codes
+from luna.db.bitmap import build_bitmaps, decode_bitmaps
+from luna.db import spatial_index
+from luna.api.metadata_cache import MetadataCache
+from luna.api.correlation_index import CorrelationIndex
+from luna.api.correlation_index import CorrelationIndexCache
+from luna.api.correlation_index import CorrelationIndexWriter
+from luna.api.cell_filter import CellFilter
+from luna.api.lod_index_cache import LodIndexCache
+from luna.api.response_cache import ResponseCache, get_num_bytes
+from luna.api.metrics import Metrics, MetricsMiddleware, stage
+from luna.api.metrics import CONTENT_TYPE, DECODE, SERIALIZE
 from starlette.middleware.cors import CORSMiddleware
 
+# Process-wide request metrics, served by /metrics.
+metrics = Metrics()
+
 app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
@@ -22,9 +51,110 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Binary responses describe their payload in headers, which browsers
+    # only let cross-origin scripts read if exposed.
+    expose_headers=[
+        "ETag",
+        "X-Luna-Shape",
+        "X-Luna-Dtype",
+        "X-Luna-Max-Expression",
+        "X-Luna-Genes",
+        "X-Luna-Missing",
+    ],
+)
+
+# Process-wide engine and connection pool, shared by all requests.
+db_pool = None
+
+# Process-wide cache of bucket and annotation metadata.
+metadata_cache = MetadataCache()
+
+# Process-wide cache of serialized bodies for immutable bucket data.
+response_cache = ResponseCache()
+
+# Semaphores bounding concurrent large transfers, one per event loop.
+transfer_semaphore_map = weakref.WeakKeyDictionary()
+
+# Process-wide cache of memory-mapped correlation indexes, by bucket version.
+correlation_index_cache = CorrelationIndexCache()
+
+# Process-wide cache of decoded scatter plot LOD indexes, by bucket version.
+lod_index_cache = LodIndexCache()
+
+app.add_middleware(
+    MetricsMiddleware,
+    metrics=metrics,
+    router=app.router,
+    metadata_cache=metadata_cache,
+)
+
+# Bucket data is immutable for a given version, but the same URL may serve
+# a new version after re-ingest, so clients revalidate via ETag by default.
+HTTP_MAX_AGE = int(os.getenv("LUNA_HTTP_MAX_AGE", "0"))
+CACHE_CONTROL = f"public, max-age={HTTP_MAX_AGE}, must-revalidate"
+JSON_MEDIA_TYPE = "application/json"
+
+# Compact binary form of numeric vectors:  raw little-endian float32,
+# with the array shape in the X-Luna-Shape header.
+BINARY_MEDIA_TYPE = "application/octet-stream"
+BINARY_DTYPE = "float32-le"
+
+# Default and maximum number of points returned by scatter plot views.
+DEFAULT_VIEW_LIMIT = 10000
+MAX_VIEW_LIMIT = 1000000
+
+# Scatter plot layouts:  a list of {x, y} objects, or one list per axis.
+LAYOUT_ROWS = "rows"
+LAYOUT_COLUMNS = "columns"
+LAYOUT_REGEX = f"^({LAYOUT_ROWS}|{LAYOUT_COLUMNS})$"
+
+# Default and maximum number of results returned by gene search.
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 1000
+
+# Correlation methods supported by the correlated genes endpoint.
+CORRELATION_REGEX = f"^({PEARSON}|{SPEARMAN})$"
+
+# Genes whose scores are loaded at once when building a correlation index.
+CORRELATION_BATCH_SIZE = 256
+
+# Upper bound on genes requested at once from multi-gene endpoints.
+MAX_GENES_PER_REQUEST = int(os.getenv("LUNA_MAX_GENES_PER_REQUEST", "1000"))
+
+# Upper bound on genes in binary multi-gene responses, which list the genes
+# and their maximum values in headers;  this keeps the headers within common
+# proxy limits (often 8 KB).
+MAX_BINARY_GENES = int(os.getenv("LUNA_MAX_BINARY_GENES", "100"))
+
+# Upper bound on multi-gene vector fetches running at once.  Each holds the
+# interpreter while it copies and serializes vectors, so further fetches wait
+# their turn, rather than stalling small requests on the event loop.
+MAX_CONCURRENT_TRANSFERS = int(
+    os.getenv("LUNA_MAX_CONCURRENT_TRANSFERS", "1")
 )
 
 
+@app.on_event("startup")
+def startup():
+    """Create the shared engine and prepare the database, once."""
+    _get_db_pool()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Close all pooled connections."""
+    global db_pool
+    if db_pool is not None:
+        await db_pool.dispose()
+        db_pool = None
+
+
+async def get_session():
+    """Get an AsyncSession from the shared pool, closed after the request."""
+    async with _get_db_pool().create_session() as session:
+        yield session
+
+
 class Bucket(BaseModel):
     """Bucket Object."""
 
@@ -52,6 +182,16 @@ class AnnotationBundle(Annotation):
 
     values_distinct: List[str]
     values_ordered: List[str]
+    indices: Optional[List[int]] = None
+
+
+class AnnotationCodes(Annotation):
+    """Annotation Codes Object, dictionary encoded values."""
+
+    categories: List[str]
+    dtype: str
+    codes: List[int]
+    indices: Optional[List[int]] = None
 
 
 class ExpressionBundle(BaseModel):
@@ -60,6 +200,69 @@ class ExpressionBundle(BaseModel):
     gene: str
     max_expression: float
     values_ordered: List[float]
+    indices: Optional[List[int]] = None
+
+
+class GeneStats(BaseModel):
+    """Gene Statistics Object."""
+
+    gene: str
+    num_cells: int
+    min: float
+    max: float
+    mean: float
+    fraction_nonzero: float
+    q25: float
+    q50: float
+    q75: float
+    q99: float
+
+
+class GroupedGeneStats(BaseModel):
+    """Grouped Gene Statistics Object, one element per category."""
+
+    gene: str
+    annotation: str
+    categories: List[str]
+    num_cells: List[int]
+    min: List[float]
+    max: List[float]
+    mean: List[float]
+    fraction_nonzero: List[float]
+    q25: List[float]
+    q50: List[float]
+    q75: List[float]
+    q99: List[float]
+
+
+class CorrelatedGenes(BaseModel):
+    """Correlated Genes Object, most correlated first."""
+
+    gene: str
+    method: str
+    genes: List[str]
+    correlations: List[float]
+
+
+class DotPlot(BaseModel):
+    """Dot Plot Object, genes x categories."""
+
+    annotation: str
+    categories: List[str]
+    num_cells: List[int]
+    genes: List[str]
+    mean: List[List[float]]
+    fraction_nonzero: List[List[float]]
+    missing: List[str]
+
+
+class ExpressionMatrix(BaseModel):
+    """Expression Matrix Object, genes x cells."""
+
+    genes: List[str]
+    max_expression: List[float]
+    values: List[List[float]]
+    missing: List[str]
 
 
 class Coordinate(BaseModel):
@@ -69,189 +272,1271 @@ class Coordinate(BaseModel):
     y: float
 
 
+class CoordinateColumns(BaseModel):
+    """Coordinate Columns Object, one list per axis."""
+
+    x: List[float]
+    y: List[float]
+    indices: Optional[List[int]] = None
+
+
+class FilteredCoordinates(BaseModel):
+    """Filtered Coordinates Object, the cells matching a filter."""
+
+    indices: List[int]
+    coordinates: List[Coordinate]
+
+
+class ScatterPlotView(BaseModel):
+    """Scatter Plot View Object, a representative subset of cells."""
+
+    total: int
+    indices: List[int]
+    coordinates: List[Coordinate]
+
+
+class ScatterPlotViewColumns(CoordinateColumns):
+    """Scatter Plot View Object, with one list of coordinates per axis."""
+
+    total: int
+    indices: List[int]
+
+
 @app.get("/buckets", response_model=List[Bucket])
-def get_buckets():
+async def get_buckets(session: AsyncSession = Depends(get_session)):
     """Get list of all data buckets."""
-    session = _init_db_connection()
-    try:
-        sql_bucket_list = session.query(bucket.Bucket).all()
-        api_bucket_list = []
-        for sql_bucket in sql_bucket_list:
-            api_bucket = Bucket(
-                name=sql_bucket.name,
-                description=sql_bucket.description,
-                url=sql_bucket.url,
-                slug=sql_bucket.slug,
-            )
-            api_bucket_list.append(api_bucket)
-        return api_bucket_list
-    finally:
-        session.close()
+    result = await session.execute(
+        select(bucket.Bucket).filter_by(status=bucket.Bucket.READY)
+    )
+    sql_bucket_list = result.scalars().all()
+    api_bucket_list = []
+    for sql_bucket in sql_bucket_list:
+        api_bucket = Bucket(
+            name=sql_bucket.name,
+            description=sql_bucket.description,
+            url=sql_bucket.url,
+            slug=sql_bucket.slug,
+        )
+        api_bucket_list.append(api_bucket)
+    return api_bucket_list
 
 
 @app.get("/annotation_list/{bucket_slug}", response_model=List[Annotation])
-def get_annotation_list(bucket_slug: str):
+async def get_annotation_list(
+    bucket_slug: str, session: AsyncSession = Depends(get_session)
+):
     """Get the list of annotations for the specified bucket."""
-    session = _init_db_connection()
-    target_type = ann.CellularAnnotationType.OTHER
-    try:
-        bucket_id = _get_bucket_id(session, bucket_slug)
-        record_list = (
-            session.query(ann.CellularAnnotation)
-            .filter_by(bucket_id=bucket_id, type=target_type)
-            .order_by(ann.CellularAnnotation.slug)
-            .all()
-        )
+    bucket_id = await _get_bucket_id(session, bucket_slug)
+    record_list = await session.run_sync(
+        metadata_cache.get_annotation_list, bucket_id
+    )
 
-        if len(record_list) == 0:
-            raise HTTPException(status_code=404, detail="No annotations.")
+    if len(record_list) == 0:
+        raise HTTPException(status_code=404, detail="No annotations.")
 
-        annotation_list = []
-        for r in record_list:
-            current_annotation = Annotation(label=r.label, slug=r.slug)
-            annotation_list.append(current_annotation)
-        return annotation_list
-    finally:
-        session.close()
+    annotation_list = []
+    for slug, label in record_list:
+        current_annotation = Annotation(label=label, slug=slug)
+        annotation_list.append(current_annotation)
+    return annotation_list
 
 
 @app.get(
     "/annotation/{bucket_slug}/{annotation_slug}",
-    response_model=AnnotationBundle,
+    response_model=Union[AnnotationBundle, AnnotationCodes],
 )
-def get_annotation_values(bucket_slug: str, annotation_slug: str):
-    """Get the list of all values for the specified annotation."""
-    session = _init_db_connection()
-    try:
-        bucket_id = _get_bucket_id(session, bucket_slug)
-        record = session.query(ann.CellularAnnotation)
-        record = record.filter_by(
-            bucket_id=bucket_id, slug=annotation_slug
-        ).first()
+async def get_annotation_values(
+    bucket_slug: str,
+    annotation_slug: str,
+    request: Request,
+    format: str = Query("values", regex="^(values|codes)$"),
+    filter: Optional[str] = None,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get the list of all values for the specified annotation.
 
-        if record is None:
-            raise HTTPException(status_code=404, detail="ID not found.")
+    By default, returns every value, in cell order.  Use format=codes to
+    receive the naturally sorted categories plus one integer code per cell
+    instead, which is far more compact.  Use filter to receive only the
+    matching cells, together with their indices.
+    """
+    bucket_id, bucket_version = await _get_bucket(session, bucket_slug)
 
-        value_list = record.value_list.split(DB_DELIM)
-        distinct_list = list({value.strip() for value in value_list})
-        distinct_list = natsorted(distinct_list, alg=ns.IGNORECASE)
+    async def build_annotation_bundle(media_type):
+        indices = await _get_cell_indices(session, bucket_id, filter)
+        record = await _get_first(
+            session,
+            select(
+                ann.CellularAnnotation.slug,
+                ann.CellularAnnotation.label,
+                ann.CellularAnnotation.value_list,
+                ann.CellularAnnotation.category_list,
+                ann.CellularAnnotation.code_blob,
+            ).filter_by(bucket_id=bucket_id, slug=annotation_slug),
+        )
 
-        current_annotation = AnnotationBundle(
-            label=record.label,
-            slug=record.slug,
-            values_distinct=distinct_list,
-            values_ordered=value_list,
+        if record is None or (
+            record.code_blob is None and record.value_list is None
+        ):
+            raise HTTPException(status_code=404, detail="ID not found.")
+        return await run_in_threadpool(
+            _build_annotation_bundle, record, format, indices
         )
-        return current_annotation
-    finally:
-        session.close()
+
+    return await _cached_response(
+        request, bucket_version, build_annotation_bundle
+    )
 
 
 @app.get("/expression/{bucket_slug}/{gene}", response_model=ExpressionBundle)
-def get_expression_values(bucket_slug: str, gene: str):
-    """Get the expression data for the specified gene."""
+async def get_expression_values(
+    bucket_slug: str,
+    gene: str,
+    request: Request,
+    filter: Optional[str] = None,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get the expression data for the specified gene.
+
+    Send "Accept: application/octet-stream" to receive the values as raw
+    little-endian float32 instead of JSON.  Use filter to receive only the
+    matching cells, together with their indices, as JSON.
+    """
     gene = gene.lower()
-    session = _init_db_connection()
-    try:
-        bucket_id = _get_bucket_id(session, bucket_slug)
-        record = (
-            session.query(ann.CellularAnnotation.value_list)
-            .filter_by(bucket_id=bucket_id, slug=gene)
-            .first()
+    bucket_id, bucket_version = await _get_bucket(session, bucket_slug)
+    await _verify_gene(session, bucket_id, gene)
+
+    async def build_expression_bundle(media_type):
+        indices = await _get_cell_indices(session, bucket_id, filter)
+        record = await _get_first(
+            session,
+            _join_statistics(
+                select(
+                    ann.CellularAnnotation.value_blob,
+                    ann.CellularAnnotation.value_encoding,
+                    GeneStatistics.max_value,
+                ).filter_by(bucket_id=bucket_id, slug=gene)
+            ),
         )
 
-        if record is None:
+        if record is None or record.value_blob is None:
             raise HTTPException(status_code=404, detail="No data found.")
-
-        value_list = record.value_list.split(DB_DELIM)
-        expression_bundle = ExpressionBundle(
-            gene=gene,
-            max_expression=max(value_list),
-            values_ordered=value_list,
+        return await run_in_threadpool(
+            _build_expression_bundle, gene, record, media_type, indices
         )
-        return expression_bundle
-    finally:
-        session.close()
 
+    return await _cached_response(
+        request,
+        bucket_version,
+        build_expression_bundle,
+        binary=filter is None,
+    )
 
-@app.get("/umap/{bucket_slug}", response_model=List[Coordinate])
-def get_umap_coordinates(bucket_slug: str):
-    """Get the UMAP coordinates for the specified bucket."""
-    session = _init_db_connection()
-    try:
-        bucket_id = _get_bucket_id(session, bucket_slug)
-        record = (
-            session.query(sca.ScatterPlot.coordinate_list)
-            .filter_by(bucket_id=bucket_id, type=sca.ScatterPlotType.UMAP)
-            .first()
+
+@app.get("/expression/{bucket_slug}/{gene}/stats", response_model=GeneStats)
+async def get_expression_stats(
+    bucket_slug: str,
+    gene: str,
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get summary statistics for the specified gene.
+
+    Statistics are computed once at ingest, so this does not read the
+    expression vector itself.
+    """
+    gene = gene.lower()
+    bucket_id, bucket_version = await _get_bucket(session, bucket_slug)
+    await _verify_gene(session, bucket_id, gene)
+
+    async def build_gene_stats(media_type):
+        record = await _get_first(
+            session,
+            select(
+                GeneStatistics.num_cells,
+                GeneStatistics.min_value,
+                GeneStatistics.max_value,
+                GeneStatistics.mean,
+                GeneStatistics.fraction_nonzero,
+                *GeneStatistics.get_quantile_columns(),
+            ).filter_by(bucket_id=bucket_id, slug=gene),
         )
 
         if record is None:
             raise HTTPException(status_code=404, detail="No data found.")
+        gene_stats = GeneStats(
+            gene=gene,
+            num_cells=record.num_cells,
+            min=record.min_value,
+            max=record.max_value,
+            mean=record.mean,
+            fraction_nonzero=record.fraction_nonzero,
+            q25=record.q25,
+            q50=record.q50,
+            q75=record.q75,
+            q99=record.q99,
+        )
+        return _json_body(gene_stats)
 
-        return _extract_coordinates(record)
-    finally:
-        session.close()
+    return await _cached_response(request, bucket_version, build_gene_stats)
 
 
-@app.get("/tsne/{bucket_slug}", response_model=List[Coordinate])
-def get_tsne_coordinates(bucket_slug: str):
-    """Get the TSNE coordinates for the specified bucket."""
-    session = _init_db_connection()
-    try:
-        bucket_id = _get_bucket_id(session, bucket_slug)
-        record = (
-            session.query(sca.ScatterPlot.coordinate_list)
-            .filter_by(bucket_id=bucket_id, type=sca.ScatterPlotType.TSNE)
-            .first()
+@app.get(
+    "/expression/{bucket_slug}/{gene}/correlated",
+    response_model=CorrelatedGenes,
+)
+async def get_correlated_genes(
+    bucket_slug: str,
+    gene: str,
+    request: Request,
+    method: str = Query(PEARSON, regex=CORRELATION_REGEX),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get the genes whose expression is most correlated with the specified gene.
+
+    Use method=spearman for rank correlation, instead of pearson.  Pearson
+    scores are standardized at ingest, and stored at half precision, so
+    that correlations are accurate to about three decimal places;  spearman
+    scores are ranked from the expression values.
+    """
+    gene = gene.lower()
+    bucket_id, bucket_version = await _get_bucket(session, bucket_slug)
+    await _verify_gene(session, bucket_id, gene)
+
+    async def build_correlated_genes(media_type):
+        correlation_index = await _get_correlation_index(
+            session, bucket_id, bucket_version, method
+        )
+        if len(correlation_index) == 0:
+            detail = "No correlation scores;  load with --correlation."
+            raise HTTPException(status_code=404, detail=detail)
+        if gene not in correlation_index:
+            raise HTTPException(status_code=404, detail="No data found.")
+        gene_list, correlations = await run_in_threadpool(
+            correlation_index.search, gene, limit
         )
+        correlated_genes = {
+            "gene": gene,
+            "method": method,
+            "genes": gene_list,
+            "correlations": correlations,
+        }
+        return _json_body(correlated_genes)
 
-        if record is None:
+    return await _cached_response(
+        request, bucket_version, build_correlated_genes
+    )
+
+
+@app.get(
+    "/expression/{bucket_slug}/{gene}/by/{annotation_slug}",
+    response_model=GroupedGeneStats,
+)
+async def get_grouped_expression_stats(
+    bucket_slug: str,
+    gene: str,
+    annotation_slug: str,
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get statistics for the specified gene, split by a categorical annotation.
+
+    Returns one element per category, in natural sort order, for each of
+    num_cells, min, max, mean, fraction_nonzero and the q25, q50 (median),
+    q75 and q99 quantiles.
+    """
+    gene = gene.lower()
+    bucket_id, bucket_version = await _get_bucket(session, bucket_slug)
+    await _verify_gene(session, bucket_id, gene)
+
+    async def build_grouped_stats(media_type):
+        annotation_record = await _get_first(
+            session,
+            select(
+                ann.CellularAnnotation.value_list,
+                ann.CellularAnnotation.category_list,
+                ann.CellularAnnotation.code_blob,
+            ).filter_by(
+                bucket_id=bucket_id,
+                type=ann.CellularAnnotationType.OTHER,
+                slug=annotation_slug,
+            ),
+        )
+        if annotation_record is None:
+            raise HTTPException(status_code=404, detail="ID not found.")
+
+        record = await _get_first(
+            session,
+            select(
+                ann.CellularAnnotation.value_blob,
+                ann.CellularAnnotation.value_encoding,
+            ).filter_by(
+                bucket_id=bucket_id,
+                type=ann.CellularAnnotationType.GENE_EXPRESSION,
+                slug=gene,
+            ),
+        )
+        if record is None or record.value_blob is None:
             raise HTTPException(status_code=404, detail="No data found.")
+        return await run_in_threadpool(
+            _build_grouped_stats,
+            gene,
+            annotation_slug,
+            record,
+            annotation_record,
+        )
+
+    return await _cached_response(
+        request, bucket_version, build_grouped_stats
+    )
+
+
+@app.get(
+    "/expression_matrix/{bucket_slug}", response_model=ExpressionMatrix
+)
+async def get_expression_matrix(
+    bucket_slug: str,
+    request: Request,
+    genes: str = Query(..., description="Comma-separated list of genes."),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get the expression data for multiple genes, as a genes x cells matrix.
+
+    Genes not found in the bucket are reported in missing.  Send
+    "Accept: application/octet-stream" to receive the matrix as raw
+    little-endian float32, with found and missing genes in the X-Luna-Genes
+    and X-Luna-Missing headers;  binary requests are limited to
+    MAX_BINARY_GENES genes.
+    """
+    gene_list = _parse_gene_list(genes)
+    bucket_id, bucket_version = await _get_bucket(session, bucket_slug)
+    gene_index = await session.run_sync(
+        metadata_cache.get_gene_index, bucket_id
+    )
+    known_list = [gene for gene in gene_list if gene in gene_index]
+
+    async def build_expression_matrix(media_type):
+        binary = media_type == BINARY_MEDIA_TYPE
+        if binary and len(gene_list) > MAX_BINARY_GENES:
+            detail = (
+                f"At most {MAX_BINARY_GENES} genes per binary request;  "
+                "request JSON for more."
+            )
+            raise HTTPException(status_code=400, detail=detail)
+        if len(known_list) == 0:
+            return _build_expression_matrix(gene_list, {}, media_type)
+
+        target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+        async with _get_transfer_semaphore():
+            result = await session.execute(
+                _join_statistics(
+                    select(
+                        ann.CellularAnnotation.slug,
+                        ann.CellularAnnotation.value_blob,
+                        ann.CellularAnnotation.value_encoding,
+                        GeneStatistics.max_value,
+                    )
+                    .filter_by(bucket_id=bucket_id, type=target_type)
+                    .filter(ann.CellularAnnotation.slug.in_(known_list))
+                )
+            )
+            record_map = {r.slug: r for r in result.all()}
+            return await run_in_threadpool(
+                _build_expression_matrix, gene_list, record_map, media_type
+            )
+
+    return await _cached_response(
+        request, bucket_version, build_expression_matrix, binary=True
+    )
+
+
+@app.get("/dot_plot/{bucket_slug}/{annotation_slug}", response_model=DotPlot)
+async def get_dot_plot(
+    bucket_slug: str,
+    annotation_slug: str,
+    request: Request,
+    genes: str = Query(..., description="Comma-separated list of genes."),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get dot plot data for multiple genes, across the annotation categories.
+
+    Returns genes x categories matrices of mean expression and of the
+    fraction of cells with nonzero expression, plus the number of cells in
+    each category.  Genes not found in the bucket are reported in missing.
+    """
+    gene_list = _parse_gene_list(genes)
+    bucket_id, bucket_version = await _get_bucket(session, bucket_slug)
+    gene_index = await session.run_sync(
+        metadata_cache.get_gene_index, bucket_id
+    )
+    known_list = [gene for gene in gene_list if gene in gene_index]
+
+    async def build_dot_plot(media_type):
+        annotation_record = await _get_first(
+            session,
+            select(
+                ann.CellularAnnotation.value_list,
+                ann.CellularAnnotation.category_list,
+                ann.CellularAnnotation.code_blob,
+            ).filter_by(
+                bucket_id=bucket_id,
+                type=ann.CellularAnnotationType.OTHER,
+                slug=annotation_slug,
+            ),
+        )
+        if annotation_record is None:
+            raise HTTPException(status_code=404, detail="ID not found.")
+
+        record_map = {}
+        if len(known_list) > 0:
+            target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+            result = await session.execute(
+                select(
+                    ann.CellularAnnotation.slug,
+                    ann.CellularAnnotation.value_blob,
+                    ann.CellularAnnotation.value_encoding,
+                )
+                .filter_by(bucket_id=bucket_id, type=target_type)
+                .filter(ann.CellularAnnotation.slug.in_(known_list))
+            )
+            record_map = {r.slug: r for r in result.all()}
+        return await run_in_threadpool(
+            _build_dot_plot,
+            gene_list,
+            annotation_slug,
+            record_map,
+            annotation_record,
+        )
+
+    return await _cached_response(request, bucket_version, build_dot_plot)
+
+
+@app.get("/genes/{bucket_slug}", response_model=List[str])
+async def search_genes(
+    bucket_slug: str,
+    q: str = Query(..., min_length=1, description="Gene prefix or substring."),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Search for genes in the specified bucket.
+
+    Returns gene slugs matching q:  an exact match first, then genes
+    starting with q, then genes containing q.
+    """
+    bucket_id = await _get_bucket_id(session, bucket_slug)
+    gene_index = await session.run_sync(
+        metadata_cache.get_gene_index, bucket_id
+    )
+    return gene_index.search(q, limit)
+
+
+@app.get(
+    "/umap/{bucket_slug}",
+    response_model=Union[
+        List[Coordinate], CoordinateColumns, FilteredCoordinates
+    ],
+)
+async def get_umap_coordinates(
+    bucket_slug: str,
+    request: Request,
+    layout: str = Query(LAYOUT_ROWS, regex=LAYOUT_REGEX),
+    filter: Optional[str] = None,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get the UMAP coordinates for the specified bucket.
+
+    Use layout=columns to receive one list of x and one list of y values,
+    which is more compact than one object per cell.  Send
+    "Accept: application/octet-stream" to receive an N x 2 array of raw
+    little-endian float32 (x, y) pairs instead of JSON.  Use filter to
+    receive only the matching cells, together with their indices, as JSON.
+    """
+    return await _get_coordinates(
+        request,
+        session,
+        bucket_slug,
+        sca.ScatterPlotType.UMAP,
+        layout,
+        filter,
+    )
+
 
-        return _extract_coordinates(record)
-    finally:
-        session.close()
+@app.get(
+    "/tsne/{bucket_slug}",
+    response_model=Union[
+        List[Coordinate], CoordinateColumns, FilteredCoordinates
+    ],
+)
+async def get_tsne_coordinates(
+    bucket_slug: str,
+    request: Request,
+    layout: str = Query(LAYOUT_ROWS, regex=LAYOUT_REGEX),
+    filter: Optional[str] = None,
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get the TSNE coordinates for the specified bucket.
+
+    Use layout=columns to receive one list of x and one list of y values,
+    which is more compact than one object per cell.  Send
+    "Accept: application/octet-stream" to receive an N x 2 array of raw
+    little-endian float32 (x, y) pairs instead of JSON.  Use filter to
+    receive only the matching cells, together with their indices, as JSON.
+    """
+    return await _get_coordinates(
+        request,
+        session,
+        bucket_slug,
+        sca.ScatterPlotType.TSNE,
+        layout,
+        filter,
+    )
+
+
+@app.get(
+    "/umap/{bucket_slug}/view",
+    response_model=Union[ScatterPlotView, ScatterPlotViewColumns],
+)
+async def get_umap_view(
+    bucket_slug: str,
+    request: Request,
+    x_min: Optional[float] = None,
+    x_max: Optional[float] = None,
+    y_min: Optional[float] = None,
+    y_max: Optional[float] = None,
+    limit: int = Query(DEFAULT_VIEW_LIMIT, ge=1, le=MAX_VIEW_LIMIT),
+    layout: str = Query(LAYOUT_ROWS, regex=LAYOUT_REGEX),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get a representative subset of UMAP coordinates within a viewport.
+
+    Returns at most limit cells within the bounding box, chosen coarse to
+    fine, together with their cell indices and the total number of cells
+    within the viewport.  Use layout=columns for one list per axis.
+    """
+    bbox = (x_min, x_max, y_min, y_max)
+    return await _get_scatter_plot_view(
+        request,
+        session,
+        bucket_slug,
+        sca.ScatterPlotType.UMAP,
+        bbox,
+        limit,
+        layout,
+    )
+
+
+@app.get(
+    "/tsne/{bucket_slug}/view",
+    response_model=Union[ScatterPlotView, ScatterPlotViewColumns],
+)
+async def get_tsne_view(
+    bucket_slug: str,
+    request: Request,
+    x_min: Optional[float] = None,
+    x_max: Optional[float] = None,
+    y_min: Optional[float] = None,
+    y_max: Optional[float] = None,
+    limit: int = Query(DEFAULT_VIEW_LIMIT, ge=1, le=MAX_VIEW_LIMIT),
+    layout: str = Query(LAYOUT_ROWS, regex=LAYOUT_REGEX),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Get a representative subset of TSNE coordinates within a viewport.
+
+    Returns at most limit cells within the bounding box, chosen coarse to
+    fine, together with their cell indices and the total number of cells
+    within the viewport.  Use layout=columns for one list per axis.
+    """
+    bbox = (x_min, x_max, y_min, y_max)
+    return await _get_scatter_plot_view(
+        request,
+        session,
+        bucket_slug,
+        sca.ScatterPlotType.TSNE,
+        bbox,
+        limit,
+        layout,
+    )
 
 
 @app.get("/vignettes/{bucket_slug}")
-def get_vignettes(bucket_slug: str):
+async def get_vignettes(
+    bucket_slug: str, session: AsyncSession = Depends(get_session)
+):
     """Get all Vignettes for the specified bucket."""
-    session = _init_db_connection()
+    bucket_id = await _get_bucket_id(session, bucket_slug)
+    record = await _get_first(
+        session,
+        select(vignette.Vignette.json).filter_by(bucket_id=bucket_id),
+    )
+
+    if record is None:
+        raise HTTPException(status_code=404, detail="No data found.")
+    return Response(content=record.json, media_type="application/json")
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Get request metrics, in the Prometheus text exposition format.
+
+    Includes request counts, latency and response size histograms per
+    route and bucket, and the time spent per request in each stage:  db,
+    decode and serialize.
+    """
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+
+async def _get_bucket_id(session, bucket_slug):
+    bucket_id, _ = await _get_bucket(session, bucket_slug)
+    return bucket_id
+
+
+async def _get_bucket(session, bucket_slug):
+    bucket_info = await session.run_sync(
+        metadata_cache.get_bucket, bucket_slug
+    )
+    if bucket_info is not None:
+        return bucket_info
+    else:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+
+
+async def _verify_gene(session, bucket_id, gene):
+    # Unknown genes are rejected from the in-memory index, before any
+    # vector query runs.
+    gene_index = await session.run_sync(
+        metadata_cache.get_gene_index, bucket_id
+    )
+    if gene not in gene_index:
+        raise HTTPException(status_code=404, detail="No data found.")
+
+
+async def _get_first(session, statement):
+    result = await session.execute(statement.limit(1))
+    return result.first()
+
+
+def _parse_gene_list(genes):
+    gene_list = []
+    for gene in genes.split(","):
+        gene = gene.strip().lower()
+        if len(gene) > 0:
+            gene_list.append(gene)
+    gene_list = list(dict.fromkeys(gene_list))
+    if len(gene_list) == 0:
+        raise HTTPException(status_code=400, detail="No genes specified.")
+    if len(gene_list) > MAX_GENES_PER_REQUEST:
+        detail = f"At most {MAX_GENES_PER_REQUEST} genes per request."
+        raise HTTPException(status_code=400, detail=detail)
+    return gene_list
+
+
+async def _get_correlation_index(session, bucket_id, bucket_version, method):
+    # The index is opened once per bucket version, from a memory-mapped score
+    # file, which is written on first use a batch of genes at a time, off the
+    # event loop.
+    correlation_index = correlation_index_cache.get(
+        bucket_id, bucket_version, method
+    )
+    if correlation_index is not None:
+        return correlation_index
+    result = await session.execute(
+        select(GeneStatistics.slug)
+        .filter_by(bucket_id=bucket_id)
+        .filter(GeneStatistics.pearson_blob.isnot(None))
+        .order_by(GeneStatistics.slug)
+    )
+    gene_list = result.scalars().all()
+    file_name = correlation_index_cache.get_file_name(
+        bucket_id, bucket_version, method
+    )
     try:
-        bucket_id = _get_bucket_id(session, bucket_slug)
-        record = (
-            session.query(vignette.Vignette)
+        correlation_index = await run_in_threadpool(
+            CorrelationIndex, file_name, gene_list
+        )
+    except (FileNotFoundError, ValueError):
+        await _write_correlation_index(
+            session, bucket_id, gene_list, file_name, method
+        )
+        correlation_index = await run_in_threadpool(
+            CorrelationIndex, file_name, gene_list
+        )
+        correlation_index_cache.remove_stale_files(
+            bucket_id, bucket_version, method
+        )
+    correlation_index_cache.put(
+        bucket_id, bucket_version, method, correlation_index
+    )
+    return correlation_index
+
+
+async def _write_correlation_index(
+    session, bucket_id, gene_list, file_name, method
+):
+    writer = CorrelationIndexWriter(file_name, len(gene_list))
+    try:
+        for start in range(0, len(gene_list), CORRELATION_BATCH_SIZE):
+            end = start + CORRELATION_BATCH_SIZE
+            batch = gene_list[start:end]
+            result = await session.execute(
+                _get_score_statement(bucket_id, batch, method)
+            )
+            score_list = await run_in_threadpool(
+                _get_index_scores, result.all(), method
+            )
+            await run_in_threadpool(writer.append, score_list)
+        await run_in_threadpool(writer.close)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def _get_score_statement(bucket_id, gene_list, method):
+    # Pearson scores are stored at ingest;  spearman scores are ranked from
+    # the expression values, rather than from the rounded pearson scores.
+    if method == PEARSON:
+        return (
+            select(GeneStatistics.pearson_blob)
             .filter_by(bucket_id=bucket_id)
-            .first()
+            .filter(GeneStatistics.slug.in_(gene_list))
+            .order_by(GeneStatistics.slug)
+        )
+    target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+    return (
+        select(
+            ann.CellularAnnotation.value_blob,
+            ann.CellularAnnotation.value_encoding,
+        )
+        .filter_by(bucket_id=bucket_id, type=target_type)
+        .filter(ann.CellularAnnotation.slug.in_(gene_list))
+        .order_by(ann.CellularAnnotation.slug)
+    )
+
+
+def _get_index_scores(record_list, method):
+    if method == PEARSON:
+        return [decode_scores(record.pearson_blob) for record in record_list]
+    return [
+        get_scores(_decode_values(record), method) for record in record_list
+    ]
+
+
+async def _get_cell_indices(session, bucket_id, filter):
+    # Resolve a filter to the indices of the matching cells, or None if
+    # there is no filter.
+    if filter is None:
+        return None
+    try:
+        cell_filter = CellFilter(filter)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+    result = await session.execute(
+        select(
+            ann.CellularAnnotation.slug,
+            ann.CellularAnnotation.value_list,
+            ann.CellularAnnotation.category_list,
+            ann.CellularAnnotation.code_blob,
+            ann.CellularAnnotation.bitmap_blob,
+        )
+        .filter_by(bucket_id=bucket_id, type=ann.CellularAnnotationType.OTHER)
+        .filter(ann.CellularAnnotation.slug.in_(cell_filter.get_slug_list()))
+    )
+    record_list = result.all()
+    try:
+        return await run_in_threadpool(
+            _evaluate_filter, cell_filter, record_list
+        )
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+def _evaluate_filter(cell_filter, record_list):
+    bitmap_map = {}
+    for record in record_list:
+        if record.bitmap_blob is not None:
+            category_list = ann.get_category_list(record.category_list)
+            with stage(DECODE):
+                bitmaps = decode_bitmaps(
+                    record.bitmap_blob, len(category_list)
+                )
+        else:
+            # Annotations not yet migrated have no bitmap index.
+            category_list, codes = _get_categories_and_codes(record)
+            bitmaps = build_bitmaps(codes, len(category_list))
+        bitmap_map[record.slug] = (category_list, bitmaps)
+    return cell_filter.get_indices(bitmap_map)
+
+
+def _filter_cells(values, indices):
+    # Restrict a per-cell array to the cells matched by a filter.
+    if indices is None:
+        return values
+    if len(indices) > 0 and indices[-1] >= len(values):
+        detail = "Filter and data have different numbers of cells."
+        raise HTTPException(status_code=409, detail=detail)
+    return values[indices]
+
+
+def _add_indices(content, indices):
+    if indices is not None:
+        content["indices"] = indices
+
+
+def _get_categories_and_codes(record):
+    with stage(DECODE):
+        if record.code_blob is not None:
+            category_list = ann.get_category_list(record.category_list)
+            codes = decode_codes(record.code_blob, len(category_list))
+        else:
+            # Annotations not yet migrated are stored as delimited text.
+            value_list = record.value_list.split(DB_DELIM)
+            category_list, codes = encode_categories(value_list)
+    return category_list, codes
+
+
+def _build_annotation_bundle(record, format, indices):
+    category_list, codes = _get_categories_and_codes(record)
+    codes = _filter_cells(codes, indices)
+
+    if format == "codes":
+        annotation_codes = {
+            "slug": record.slug,
+            "label": record.label,
+            "categories": category_list,
+            "dtype": codes.dtype.name,
+            "codes": np.ascontiguousarray(codes),
+        }
+        _add_indices(annotation_codes, indices)
+        return _json_body(annotation_codes)
+
+    # Categories are distinct and naturally sorted once, at ingest.
+    value_list = np.array(category_list, dtype=object)[codes].tolist()
+    annotation_bundle = {
+        "slug": record.slug,
+        "label": record.label,
+        "values_distinct": category_list,
+        "values_ordered": value_list,
+    }
+    _add_indices(annotation_bundle, indices)
+    return _json_body(annotation_bundle)
+
+
+def _build_expression_bundle(gene, record, media_type, indices):
+    # The max expression is over all cells, so that filtered and unfiltered
+    # plots share the same color scale.
+    values = _decode_values(record)
+    max_expression = _get_max_expression(record, values)
+    if media_type == BINARY_MEDIA_TYPE:
+        headers = {"X-Luna-Max-Expression": repr(max_expression)}
+        return _binary_body(values, headers)
+
+    expression_bundle = {
+        "gene": gene,
+        "max_expression": max_expression,
+        "values_ordered": _to_json_floats(_filter_cells(values, indices)),
+    }
+    _add_indices(expression_bundle, indices)
+    return _json_body(expression_bundle)
+
+
+def _build_grouped_stats(gene, annotation_slug, record, annotation_record):
+    category_list, codes = _get_categories_and_codes(annotation_record)
+    values = _decode_values(record)
+    if len(values) != len(codes):
+        detail = "Gene and annotation have different numbers of cells."
+        raise HTTPException(status_code=409, detail=detail)
+
+    grouped_stats = {
+        "gene": gene,
+        "annotation": annotation_slug,
+        "categories": category_list,
+    }
+    grouped_stats.update(
+        get_group_statistics(values, codes, len(category_list))
+    )
+    return _json_body(grouped_stats)
+
+
+def _build_dot_plot(gene_list, annotation_slug, record_map, annotation_record):
+    found_list = [gene for gene in gene_list if gene in record_map]
+    missing_list = [gene for gene in gene_list if gene not in record_map]
+    category_list, codes = _get_categories_and_codes(annotation_record)
+    matrix = np.zeros((len(found_list), len(codes)), dtype=VECTOR_DTYPE)
+    for position, gene in enumerate(found_list):
+        values = _decode_values(record_map[gene])
+        if len(values) != len(codes):
+            detail = "Gene and annotation have different numbers of cells."
+            raise HTTPException(status_code=409, detail=detail)
+        matrix[position] = values
+
+    num_cells, mean, fraction_nonzero = get_group_means(
+        matrix, codes, len(category_list)
+    )
+    dot_plot = {
+        "annotation": annotation_slug,
+        "categories": category_list,
+        "num_cells": num_cells,
+        "genes": found_list,
+        "mean": mean,
+        "fraction_nonzero": fraction_nonzero,
+        "missing": missing_list,
+    }
+    return _json_body(dot_plot)
+
+
+def _build_expression_matrix(gene_list, record_map, media_type):
+    found_list = [gene for gene in gene_list if gene in record_map]
+    missing_list = [gene for gene in gene_list if gene not in record_map]
+    record_list = [record_map[gene] for gene in found_list]
+
+    if media_type == BINARY_MEDIA_TYPE:
+        # Vectors stored as raw little-endian float32 are streamed as is,
+        # one chunk per gene, without decoding or joining them into one
+        # copy;  only other encodings are decoded.
+        max_list = [_get_max_expression(r) for r in record_list]
+        body = [
+            record.value_blob
+            if record.value_encoding is None
+            else _decode_values(record).tobytes()
+            for record in record_list
+        ]
+        num_cells = 0
+        if len(body) > 0:
+            num_cells = len(body[0]) // VECTOR_DTYPE.itemsize
+        content_headers = {
+            "X-Luna-Shape": f"{len(found_list)},{num_cells}",
+            "X-Luna-Dtype": BINARY_DTYPE,
+            "X-Luna-Genes": ",".join(found_list),
+            "X-Luna-Missing": ",".join(missing_list),
+            "X-Luna-Max-Expression": ",".join(map(repr, max_list)),
+        }
+        return body, content_headers
+
+    # The JSON body is serialized gene by gene, and streamed as a list of
+    # chunks, so that no single call holds the interpreter for the whole
+    # matrix.
+    matrix = [_decode_values(record) for record in record_list]
+    max_list = [
+        _get_max_expression(record, values)
+        for record, values in zip(record_list, matrix)
+    ]
+    with stage(SERIALIZE):
+        body = [
+            b'{"genes":'
+            + _json_dumps(found_list)
+            + b',"max_expression":'
+            + _json_dumps(max_list)
+            + b',"values":['
+        ]
+        for index, values in enumerate(matrix):
+            if index > 0:
+                body.append(b",")
+            body.append(_json_dumps(_to_json_floats(values)))
+        body.append(b'],"missing":' + _json_dumps(missing_list) + b"}")
+    return body, {}
+
+
+def _join_statistics(statement):
+    # Join each gene to its precomputed statistics, if any.
+    return statement.outerjoin(
+        GeneStatistics,
+        and_(
+            GeneStatistics.bucket_id == ann.CellularAnnotation.bucket_id,
+            GeneStatistics.slug == ann.CellularAnnotation.slug,
+        ),
+    )
+
+
+def _decode_values(record):
+    with stage(DECODE):
+        return decode_vector(record.value_blob, record.value_encoding)
+
+
+def _get_max_expression(record, values=None):
+    # Genes loaded by earlier versions have no statistics.
+    if record.max_value is not None:
+        return record.max_value
+    if values is None:
+        values = _decode_values(record)
+    return float(values.max()) if len(values) > 0 else 0.0
+
+
+async def _get_coordinates(
+    request, session, bucket_slug, scatter_plot_type, layout, filter
+):
+    bucket_id, bucket_version = await _get_bucket(session, bucket_slug)
+
+    async def build_coordinates(media_type):
+        indices = await _get_cell_indices(session, bucket_id, filter)
+        record = await _get_first(
+            session,
+            select(sca.ScatterPlot.coordinate_list).filter_by(
+                bucket_id=bucket_id, type=scatter_plot_type
+            ),
         )
 
         if record is None:
             raise HTTPException(status_code=404, detail="No data found.")
-        return Response(content=record.json, media_type="application/json")
-    finally:
-        session.close()
+        return await run_in_threadpool(
+            _build_coordinates, record, media_type, layout, indices
+        )
+
+    return await _cached_response(
+        request, bucket_version, build_coordinates, binary=filter is None
+    )
 
 
-def _get_bucket_id(session, bucket_slug):
-    record = session.query(bucket.Bucket).filter_by(slug=bucket_slug).first()
-    if record:
-        return record.id
+def _build_coordinates(record, media_type, layout, indices):
+    with stage(DECODE):
+        coordinates = sca.decode_coordinate_list(record.coordinate_list)
+    if media_type == BINARY_MEDIA_TYPE:
+        return _binary_body(coordinates)
+    if indices is None:
+        return _json_body(_get_coordinate_content(coordinates, layout))
+
+    coordinates = _filter_cells(coordinates, indices)
+    filtered_coordinates = {"indices": indices}
+    coordinate_content = _get_coordinate_content(coordinates, layout)
+    if layout == LAYOUT_COLUMNS:
+        filtered_coordinates.update(coordinate_content)
     else:
-        raise HTTPException(status_code=404, detail="Bucket not found")
+        filtered_coordinates["coordinates"] = coordinate_content
+    return _json_body(filtered_coordinates)
+
+
+async def _get_scatter_plot_view(
+    request, session, bucket_slug, scatter_plot_type, bbox, limit, layout
+):
+    bucket_id, bucket_version = await _get_bucket(session, bucket_slug)
+
+    async def build_view(media_type):
+        lod_index = await _get_lod_index(
+            session, bucket_id, bucket_version, scatter_plot_type
+        )
+        return await run_in_threadpool(
+            _build_view, lod_index, bbox, limit, layout
+        )
+
+    return await _cached_response(request, bucket_version, build_view)
+
+
+async def _get_lod_index(
+    session, bucket_id, bucket_version, scatter_plot_type
+):
+    # The LOD index is decoded once per bucket version, off the event loop.
+    lod_index = lod_index_cache.get(
+        bucket_id, bucket_version, scatter_plot_type
+    )
+    if lod_index is not None:
+        return lod_index
+    record = await _get_first(
+        session,
+        select(sca.ScatterPlot.lod_order, sca.ScatterPlot.lod_coordinates)
+        .filter_by(bucket_id=bucket_id, type=scatter_plot_type),
+    )
+    if record is None:
+        raise HTTPException(status_code=404, detail="No data found.")
+    if record.lod_order is None:
+        # Scatter plots not yet migrated have no LOD index;  build it from
+        # the coordinate list.
+        record = await _get_first(
+            session,
+            select(sca.ScatterPlot.coordinate_list).filter_by(
+                bucket_id=bucket_id, type=scatter_plot_type
+            ),
+        )
+        lod_index = await run_in_threadpool(_build_lod_index, record)
+    else:
+        lod_index = await run_in_threadpool(_decode_lod_index, record)
+    lod_index_cache.put(
+        bucket_id, bucket_version, scatter_plot_type, lod_index
+    )
+    return lod_index
+
+
+def _build_view(lod_index, bbox, limit, layout):
+    index_list, coordinates, total = lod_index.query(bbox, limit)
+    view = {"total": total, "indices": np.ascontiguousarray(index_list)}
+    coordinate_content = _get_coordinate_content(coordinates, layout)
+    if layout == LAYOUT_COLUMNS:
+        view.update(coordinate_content)
+    else:
+        view["coordinates"] = coordinate_content
+    return _json_body(view)
+
+
+def _decode_lod_index(record):
+    with stage(DECODE):
+        lod_order = np.frombuffer(
+            record.lod_order, dtype=spatial_index.INDEX_DTYPE
+        )
+        lod_coordinates = np.frombuffer(
+            record.lod_coordinates, dtype=spatial_index.COORDINATE_DTYPE
+        ).reshape(-1, 2)
+        return spatial_index.LodIndex(lod_order, lod_coordinates)
+
+
+def _build_lod_index(record):
+    with stage(DECODE):
+        coordinates = sca.decode_coordinate_list(record.coordinate_list)
+    lod_order = spatial_index.build_lod_order(coordinates)
+    lod_coordinates = coordinates[lod_order].astype(
+        spatial_index.COORDINATE_DTYPE
+    )
+    return spatial_index.LodIndex(lod_order, lod_coordinates)
+
+
+async def _cached_response(
+    request, bucket_version, build_content, binary=False
+):
+    # Serve immutable bucket data with a strong ETag, a 304 for matching
+    # If-None-Match requests, and an in-process cache of serialized bodies.
+    # build_content is awaited with the negotiated media type, and returns
+    # a (body, headers) pair;  bodies that are lists of chunks are streamed.
+    media_type = JSON_MEDIA_TYPE
+    if binary:
+        media_type = _negotiate_media_type(request.headers.get("accept"))
+    etag = _get_etag(request, bucket_version, media_type)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if binary:
+        headers["Vary"] = "Accept"
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    entry = response_cache.get(etag)
+    if entry is None:
+        body, content_headers = await build_content(media_type)
+        entry = (media_type, body, content_headers)
+        response_cache.put(etag, *entry)
+    media_type, body, content_headers = entry
+    headers.update(content_headers)
+    if isinstance(body, bytes):
+        return Response(content=body, media_type=media_type, headers=headers)
+    headers["Content-Length"] = str(get_num_bytes(body))
+    return StreamingResponse(
+        _iterate_chunks(body), media_type=media_type, headers=headers
+    )
+
+
+async def _iterate_chunks(chunk_list):
+    # Iterate on the event loop;  a plain iterator would be stepped through
+    # the threadpool, one chunk at a time.
+    for chunk in chunk_list:
+        yield chunk
+
+
+def _json_body(content):
+    # Large-array builders pass plain dicts of NumPy arrays, which orjson
+    # serializes directly, without one pydantic object per cell.
+    with stage(SERIALIZE):
+        if isinstance(content, BaseModel):
+            content = content.dict()
+        body = _json_dumps(content)
+    return body, {}
+
+
+def _json_dumps(content):
+    return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def _to_json_floats(values):
+    # Serialize as float32, which orjson writes as the shortest repr that
+    # round-trips to the stored float32 value, at half the size of float64.
+    return np.ascontiguousarray(values, dtype=VECTOR_DTYPE)
+
+
+def _get_coordinate_content(coordinates, layout):
+    with stage(SERIALIZE):
+        x_values = _to_json_floats(coordinates[:, 0])
+        y_values = _to_json_floats(coordinates[:, 1])
+        if layout == LAYOUT_COLUMNS:
+            return {"x": x_values, "y": y_values}
+        return [{"x": x, "y": y} for x, y in zip(x_values, y_values)]
+
+
+def _binary_body(values, headers=None):
+    with stage(SERIALIZE):
+        values = np.ascontiguousarray(values, dtype=VECTOR_DTYPE)
+        body = values.tobytes()
+    content_headers = {
+        "X-Luna-Shape": ",".join(str(n) for n in values.shape),
+        "X-Luna-Dtype": BINARY_DTYPE,
+    }
+    if headers is not None:
+        content_headers.update(headers)
+    return body, content_headers
+
+
+def _negotiate_media_type(accept):
+    # JSON is the default;  binary only when preferred over JSON.  At equal
+    # quality, the first media range listed wins.
+    if accept is None:
+        return JSON_MEDIA_TYPE
+    best_media_type = JSON_MEDIA_TYPE
+    best_quality = 0.0
+    for media_range in accept.split(","):
+        parts = media_range.strip().split(";")
+        name = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name == BINARY_MEDIA_TYPE and quality > best_quality:
+            best_media_type, best_quality = BINARY_MEDIA_TYPE, quality
+        elif name in [JSON_MEDIA_TYPE, "*/*"] and quality > best_quality:
+            best_media_type, best_quality = JSON_MEDIA_TYPE, quality
+    return best_media_type
+
+
+def _get_etag(request, bucket_version, media_type):
+    key = f"{bucket_version}|{request.url.path}|{request.url.query}"
+    key += f"|{media_type}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def _etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidate_list = [c.strip() for c in if_none_match.split(",")]
+    return etag in candidate_list
 
 
-def _extract_coordinates(record):
-    response_list = []
-    value_list = record.coordinate_list.split(DB_DELIM)
-    for pair_str in value_list:
-        if len(pair_str) > 0:
-            parts = pair_str.split(",")
-            current_value = Coordinate(x=float(parts[0]), y=float(parts[1]))
-            response_list.append(current_value)
-    return response_list
+def _get_transfer_semaphore():
+    # asyncio primitives are bound to an event loop, so each loop, such as
+    # that of each test client, gets its own semaphore.
+    loop = asyncio.get_running_loop()
+    semaphore = transfer_semaphore_map.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_TRANSFERS)
+        transfer_semaphore_map[loop] = semaphore
+    return semaphore
 
 
-def _init_db_connection():
-    db_connection = DbConnection()
-    return db_connection.session
+def _get_db_pool():
+    global db_pool
+    if db_pool is None:
+        db_pool = DbPool()
+        db_pool.prepare_database()
+        metrics.instrument_engine(db_pool.engine)
+    return db_pool
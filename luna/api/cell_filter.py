@@ -0,0 +1,58 @@
+"""Cell filters over categorical annotations, evaluated on bitmaps."""
+import numpy as np
+from luna.db.bitmap import get_indices
+
+
+class CellFilter:
+    """
+    Filter on the categories of one or more annotations.
+
+    A filter is a list of clauses separated by ";", each of the form
+    annotation_slug:category1|category2, e.g.
+    "tissue:Lung|Liver;cell_ontology_class:B cell".  A cell matches a
+    clause if it is in any of the listed categories, and matches the
+    filter if it matches every clause.  Clauses are evaluated as bitwise
+    OR and AND over the packed bitmaps built at ingest.
+    """
+
+    AND_DELIM = ";"
+    OR_DELIM = "|"
+    KEY_DELIM = ":"
+
+    def __init__(self, filter_str):
+        """Create new CellFilter;  raises ValueError if malformed."""
+        self.clause_list = []
+        for clause in filter_str.split(CellFilter.AND_DELIM):
+            slug, delim, category_str = clause.partition(CellFilter.KEY_DELIM)
+            slug = slug.strip().lower()
+            category_list = category_str.split(CellFilter.OR_DELIM)
+            if len(slug) == 0 or len(delim) == 0 or "" in category_list:
+                raise ValueError(f"Malformed filter clause:  {clause}.")
+            self.clause_list.append((slug, category_list))
+
+    def get_slug_list(self):
+        """Get the distinct annotation slugs used by the filter."""
+        return list(dict.fromkeys(slug for slug, _ in self.clause_list))
+
+    def get_indices(self, bitmap_map):
+        """
+        Get the indices of all matching cells.
+
+        bitmap_map maps each annotation slug to its (category_list,
+        bitmaps) pair.  Raises ValueError for unknown annotations or
+        categories.
+        """
+        match = None
+        for slug, category_list in self.clause_list:
+            if slug not in bitmap_map:
+                raise ValueError(f"Unknown annotation:  {slug}.")
+            all_category_list, bitmaps = bitmap_map[slug]
+            position_map = {c: i for i, c in enumerate(all_category_list)}
+            position_list = []
+            for category in category_list:
+                if category not in position_map:
+                    raise ValueError(f"Unknown category:  {slug}:{category}.")
+                position_list.append(position_map[category])
+            clause_match = np.bitwise_or.reduce(bitmaps[position_list])
+            match = clause_match if match is None else match & clause_match
+        return get_indices(match)
@@ -0,0 +1,174 @@
+"""Memory-mapped matrix of standardized scores, for gene-gene correlation."""
+import glob
+import os
+import tempfile
+import threading
+import numpy as np
+
+# Raw float32, so that each query is a single matrix-vector product over the
+# mapped file, without widening the scores first.
+INDEX_DTYPE = np.dtype("<f4")
+
+
+class CorrelationIndex:
+    """
+    Memory-mapped matrix of standardized scores for a bucket, genes x cells.
+
+    Scores are kept as float32 in a .npy file, which is memory-mapped
+    read-only, so that it is paged in on demand and shared by all API
+    processes via the page cache, rather than held in memory by each.  Each
+    query is a single BLAS matrix-vector product over the mapped file.
+    """
+
+    def __init__(self, file_name, gene_list):
+        """
+        Open the CorrelationIndex in the specified file.
+
+        gene_list holds the gene slug of each row.  Raises ValueError if the
+        file does not have one float32 row per gene, e.g. if it was written
+        before more genes were scored.
+        """
+        self.gene_list = list(gene_list)
+        self.position_map = {g: i for i, g in enumerate(self.gene_list)}
+        self.matrix = np.load(file_name, mmap_mode="r")
+        stale = self.matrix.ndim != 2 or self.matrix.dtype != INDEX_DTYPE
+        if stale or len(self.matrix) != len(self.gene_list):
+            raise ValueError(f"Stale correlation index:  {file_name}.")
+
+    def __len__(self):
+        """Get the number of genes in the index."""
+        return len(self.gene_list)
+
+    def __contains__(self, gene):
+        """Check if the specified gene slug is in the index."""
+        return gene in self.position_map
+
+    def search(self, gene, limit):
+        """
+        Get the genes most correlated with the specified gene.
+
+        Returns (gene_list, correlations), most correlated first, excluding
+        the gene itself.  Ties keep the order of gene_list.
+        """
+        position = self.position_map[gene]
+        num_cells = self.matrix.shape[1]
+        matrix = np.asarray(self.matrix)
+        correlations = matrix @ np.array(matrix[position])
+        correlations /= max(num_cells, 1)
+        correlations[position] = -np.inf
+
+        limit = min(limit, len(self.gene_list) - 1)
+        if limit <= 0:
+            return [], np.zeros(0)
+        top = np.argpartition(-correlations, limit - 1)[:limit]
+        top = top[np.lexsort((top, -correlations[top]))]
+        top_list = [self.gene_list[i] for i in top]
+        return top_list, np.clip(correlations[top].astype(np.float64), -1, 1)
+
+
+class CorrelationIndexWriter:
+    """
+    Write the score file of a CorrelationIndex, a batch of genes at a time.
+
+    Rows are written to a temporary file, which replaces file_name on
+    close, so that other processes never open a partial file.
+    """
+
+    def __init__(self, file_name, num_genes):
+        """Create new CorrelationIndexWriter for num_genes genes."""
+        self.file_name = file_name
+        self.num_genes = num_genes
+        directory = os.path.dirname(file_name)
+        os.makedirs(directory, exist_ok=True)
+        fd, self.tmp_file_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        os.close(fd)
+        self.matrix = None
+        self.position = 0
+
+    def append(self, score_list):
+        """Append one row of standardized scores per gene."""
+        for scores in score_list:
+            if self.matrix is None:
+                self._open(len(scores))
+            self.matrix[self.position] = scores
+            self.position += 1
+
+    def close(self):
+        """Flush all rows, and move the file into place."""
+        if self.matrix is None:
+            self._open(0)
+        if self.position != self.num_genes:
+            self.abort()
+            raise ValueError("Number of genes changed while writing.")
+        self.matrix.flush()
+        self.matrix = None
+        os.replace(self.tmp_file_name, self.file_name)
+
+    def abort(self):
+        """Remove the partial file."""
+        self.matrix = None
+        if os.path.exists(self.tmp_file_name):
+            os.remove(self.tmp_file_name)
+
+    def _open(self, num_cells):
+        self.matrix = np.lib.format.open_memmap(
+            self.tmp_file_name,
+            mode="w+",
+            dtype=INDEX_DTYPE,
+            shape=(self.num_genes, num_cells),
+        )
+
+
+class CorrelationIndexCache:
+    """
+    In-process cache of open CorrelationIndexes, by bucket version.
+
+    Score files are written once per bucket version and method, to
+    directory, and shared by all API processes on the host.  Entries and
+    files for earlier versions of a bucket are dropped when a new version
+    is cached, so the cache is never cleared by the metadata cache.
+
+    The directory may be over-ridden with the LUNA_CORRELATION_DIR
+    environment variable (default: luna_correlation, in the system
+    temporary directory).
+    """
+
+    def __init__(self, directory=None):
+        """Create new, empty CorrelationIndexCache."""
+        if directory is None:
+            default = os.path.join(tempfile.gettempdir(), "luna_correlation")
+            directory = os.getenv("LUNA_CORRELATION_DIR", default)
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.index_map = {}
+
+    def get_file_name(self, bucket_id, bucket_version, method):
+        """Get the score file of the specified bucket version and method."""
+        base_name = f"{bucket_id}-{bucket_version}-{method}.npy"
+        return os.path.join(self.directory, base_name)
+
+    def get(self, bucket_id, bucket_version, method):
+        """Get the CorrelationIndex, or None if not yet opened."""
+        return self.index_map.get((bucket_id, bucket_version, method))
+
+    def put(self, bucket_id, bucket_version, method, correlation_index):
+        """Cache the CorrelationIndex, dropping earlier bucket versions."""
+        with self.lock:
+            for key in list(self.index_map):
+                if key[0] == bucket_id and key[1] != bucket_version:
+                    del self.index_map[key]
+            self.index_map[(bucket_id, bucket_version, method)] = (
+                correlation_index
+            )
+
+    def remove_stale_files(self, bucket_id, bucket_version, method):
+        """Remove the score files of earlier versions of the bucket."""
+        current = self.get_file_name(bucket_id, bucket_version, method)
+        pattern = self.get_file_name(bucket_id, "*", method)
+        for file_name in glob.glob(pattern):
+            if file_name != current:
+                try:
+                    os.remove(file_name)
+                except FileNotFoundError:
+                    # Removed by another process.
+                    pass
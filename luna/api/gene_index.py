@@ -0,0 +1,57 @@
+"""In-memory search index over the gene slugs of a bucket."""
+import bisect
+
+
+class GeneIndex:
+    """
+    In-memory search index over the gene slugs of a bucket.
+
+    Genes are held in a sorted list, so that membership checks and prefix
+    searches are binary searches.  Substring matches fall back to a scan,
+    which takes well under a millisecond for a 20k gene bucket.
+    """
+
+    def __init__(self, gene_list):
+        """Create new GeneIndex from a list of gene slugs."""
+        self.gene_list = sorted(gene_list)
+
+    def __len__(self):
+        """Get the number of genes in the index."""
+        return len(self.gene_list)
+
+    def __contains__(self, gene):
+        """Check if the specified gene slug is in the index."""
+        position = bisect.bisect_left(self.gene_list, gene)
+        return (
+            position < len(self.gene_list)
+            and self.gene_list[position] == gene
+        )
+
+    def search(self, query, limit=None):
+        """
+        Search for genes matching the specified query.
+
+        Results are ranked as follows:  an exact match first, then genes
+        starting with the query, shortest first, then genes containing the
+        query, by the position of the match, then by length.
+        """
+        query = query.strip().lower()
+        if len(query) == 0:
+            return []
+
+        start = bisect.bisect_left(self.gene_list, query)
+        end = bisect.bisect_left(self.gene_list, query + "\uffff", lo=start)
+        prefix_list = sorted(self.gene_list[start:end], key=len)
+        match_list = prefix_list
+        if limit is None or len(match_list) < limit:
+            substring_list = [
+                (gene.find(query, 1), len(gene), gene)
+                for gene in self.gene_list
+                if query in gene[1:] and not gene.startswith(query)
+            ]
+            substring_list.sort()
+            match_list = prefix_list + [item[2] for item in substring_list]
+
+        if limit is not None:
+            match_list = match_list[:limit]
+        return match_list
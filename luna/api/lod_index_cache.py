@@ -0,0 +1,32 @@
+"""In-process cache of decoded LOD indexes, by bucket version."""
+import threading
+
+
+class LodIndexCache:
+    """
+    In-process cache of decoded LOD indexes, by bucket version.
+
+    Scatter plots never change for a given bucket version, so entries are
+    never expired;  caching a new version of a bucket drops the entries of
+    earlier versions.
+    """
+
+    def __init__(self):
+        """Create new, empty LodIndexCache."""
+        self.lock = threading.Lock()
+        self.index_map = {}
+
+    def get(self, bucket_id, bucket_version, scatter_plot_type):
+        """Get the LodIndex, or None if not yet decoded."""
+        key = (bucket_id, bucket_version, scatter_plot_type)
+        return self.index_map.get(key)
+
+    def put(self, bucket_id, bucket_version, scatter_plot_type, lod_index):
+        """Cache the LodIndex, dropping earlier bucket versions."""
+        with self.lock:
+            for key in list(self.index_map):
+                if key[0] == bucket_id and key[1] != bucket_version:
+                    del self.index_map[key]
+            self.index_map[(bucket_id, bucket_version, scatter_plot_type)] = (
+                lod_index
+            )
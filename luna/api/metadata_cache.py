@@ -0,0 +1,134 @@
+"""In-process cache of bucket and annotation metadata."""
+import os
+import time
+import threading
+from luna.db import bucket
+from luna.db import cellular_annotation as ann
+from luna.db.generation import Generation
+from luna.api.gene_index import GeneIndex
+
+
+class MetadataCache:
+    """
+    In-process cache of bucket and annotation metadata.
+
+    Caches the slug to bucket (id, version) map, plus the annotation list,
+    gene slug list and gene search index for each bucket.  This metadata
+    only changes when data is ingested, and ingest bumps the generation
+    counter in the database.  The cache therefore checks the generation at
+    most once every check_interval seconds, and is cleared when the
+    generation changes, when ttl seconds have passed, or when invalidate()
+    is called.
+
+    Settings may be over-ridden with the following environment variables:
+
+    LUNA_CACHE_TTL:  maximum age of cached metadata, in seconds (default: 300).
+    LUNA_CACHE_CHECK_INTERVAL:  seconds between generation checks
+        (default: 5).
+    """
+
+    def __init__(self, ttl=None, check_interval=None):
+        """Create new, empty MetadataCache."""
+        if ttl is None:
+            ttl = float(os.getenv("LUNA_CACHE_TTL", "300"))
+        if check_interval is None:
+            check_interval = float(os.getenv("LUNA_CACHE_CHECK_INTERVAL", "5"))
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.invalidate()
+
+    def invalidate(self):
+        """Clear all cached metadata."""
+        with self.lock:
+            self.generation = None
+            self.loaded_at = 0.0
+            self.checked_at = 0.0
+            self.bucket_map = None
+            self.annotation_map = {}
+            self.gene_map = {}
+            self.gene_index_map = {}
+
+    def get_bucket_id(self, session, bucket_slug):
+        """Get the bucket id for the specified slug, or None if not found."""
+        bucket_info = self.get_bucket(session, bucket_slug)
+        return bucket_info[0] if bucket_info is not None else None
+
+    def get_bucket(self, session, bucket_slug):
+        """Get the bucket (id, version) pair, or None if not found."""
+        self._refresh(session)
+        bucket_map = self.bucket_map
+        if bucket_map is None:
+            record_list = session.query(
+                bucket.Bucket.slug, bucket.Bucket.id, bucket.Bucket.version
+            ).filter_by(status=bucket.Bucket.READY)
+            bucket_map = {r.slug: (r.id, r.version) for r in record_list}
+            with self.lock:
+                self.bucket_map = bucket_map
+        return bucket_map.get(bucket_slug)
+
+    def has_bucket(self, bucket_slug):
+        """Check if the slug is a cached, ready bucket, without querying."""
+        bucket_map = self.bucket_map
+        return bucket_map is not None and bucket_slug in bucket_map
+
+    def get_annotation_list(self, session, bucket_id):
+        """Get the ordered list of (slug, label) annotations for a bucket."""
+        self._refresh(session)
+        annotation_list = self.annotation_map.get(bucket_id)
+        if annotation_list is None:
+            record_list = (
+                session.query(
+                    ann.CellularAnnotation.slug, ann.CellularAnnotation.label
+                )
+                .filter_by(
+                    bucket_id=bucket_id, type=ann.CellularAnnotationType.OTHER
+                )
+                .order_by(ann.CellularAnnotation.slug)
+                .all()
+            )
+            annotation_list = [(r.slug, r.label) for r in record_list]
+            with self.lock:
+                self.annotation_map[bucket_id] = annotation_list
+        return annotation_list
+
+    def get_gene_list(self, session, bucket_id):
+        """Get the sorted list of gene slugs for the specified bucket."""
+        self._refresh(session)
+        gene_list = self.gene_map.get(bucket_id)
+        if gene_list is None:
+            target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+            record_list = (
+                session.query(ann.CellularAnnotation.slug)
+                .filter_by(bucket_id=bucket_id, type=target_type)
+                .order_by(ann.CellularAnnotation.slug)
+                .all()
+            )
+            gene_list = [r.slug for r in record_list]
+            with self.lock:
+                self.gene_map[bucket_id] = gene_list
+        return gene_list
+
+    def get_gene_index(self, session, bucket_id):
+        """Get the GeneIndex over all gene slugs for the specified bucket."""
+        gene_list = self.get_gene_list(session, bucket_id)
+        gene_index = self.gene_index_map.get(bucket_id)
+        if gene_index is None:
+            gene_index = GeneIndex(gene_list)
+            with self.lock:
+                self.gene_index_map[bucket_id] = gene_index
+        return gene_index
+
+    def _refresh(self, session):
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return
+        generation = Generation.get_current(session)
+        expired = now - self.loaded_at > self.ttl
+        if expired or generation != self.generation:
+            self.invalidate()
+            with self.lock:
+                self.generation = generation
+                self.loaded_at = now
+        with self.lock:
+            self.checked_at = now
@@ -0,0 +1,286 @@
+"""Request metrics, in the Prometheus text exposition format."""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+
+# Request stages timed within each request.
+DB = "db"
+DECODE = "decode"
+SERIALIZE = "serialize"
+
+# Histogram bucket upper bounds, in seconds and bytes.
+LATENCY_BUCKETS = [
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+]
+SIZE_BUCKETS = [10 ** i for i in range(2, 9)]
+
+# Route label of requests which match no route.
+UNMATCHED_ROUTE = "unmatched"
+
+# Starlette appends the charset to text media types.
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Seconds spent in each stage by the current request, or None outside a
+# request.  Holds a mutable dict, so that stages timed in the threadpool,
+# which runs with a copy of the context, add to the same totals.
+_stage_seconds = ContextVar("stage_seconds", default=None)
+
+
+class Counter:
+    """Prometheus counter, with one value per combination of labels."""
+
+    TYPE = "counter"
+
+    def __init__(self, name, help, label_names):
+        """Create new Counter."""
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.value_map = {}
+
+    def inc(self, label_values, amount=1):
+        """Increment the counter for the specified label values."""
+        self.value_map[label_values] = (
+            self.value_map.get(label_values, 0) + amount
+        )
+
+    def collect(self):
+        """Get the sample lines of the counter."""
+        for label_values, value in sorted(self.value_map.items()):
+            labels = _format_labels(self.label_names, label_values)
+            yield f"{self.name}{{{labels}}} {_format_value(value)}"
+
+
+class Histogram:
+    """Prometheus histogram, with one series per combination of labels."""
+
+    TYPE = "histogram"
+
+    def __init__(self, name, help, label_names, buckets):
+        """Create new Histogram with the specified bucket upper bounds."""
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = sorted(buckets)
+        self.series_map = {}
+
+    def observe(self, label_values, value):
+        """Record a value for the specified label values."""
+        series = self.series_map.get(label_values)
+        if series is None:
+            series = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            self.series_map[label_values] = series
+        position = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                position = i
+                break
+        series["counts"][position] += 1
+        series["sum"] += value
+
+    def collect(self):
+        """Get the sample lines of the histogram, with cumulative buckets."""
+        for label_values, series in sorted(self.series_map.items()):
+            labels = _format_labels(self.label_names, label_values)
+            bound_list = [_format_value(b) for b in self.buckets] + ["+Inf"]
+            cumulative = 0
+            for bound, count in zip(bound_list, series["counts"]):
+                cumulative += count
+                bucket_labels = f'{labels},le="{bound}"'
+                yield f"{self.name}_bucket{{{bucket_labels}}} {cumulative}"
+            total = _format_value(series["sum"])
+            yield f"{self.name}_sum{{{labels}}} {total}"
+            yield f"{self.name}_count{{{labels}}} {cumulative}"
+
+
+class Metrics:
+    """
+    Process-wide registry of request metrics.
+
+    Records the number, latency and response size of requests, per route
+    template and bucket, and the time each request spends in each stage:
+    database queries, decoding of stored vectors, and serialization of
+    response bodies.  Metrics are kept per process, as are the caches, so
+    each API worker process reports its own.
+    """
+
+    def __init__(self):
+        """Create new, empty Metrics."""
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Remove all recorded values."""
+        with self.lock:
+            self.request_count = Counter(
+                "luna_requests_total",
+                "Total number of requests.",
+                ["route", "bucket", "method", "status"],
+            )
+            self.request_latency = Histogram(
+                "luna_request_duration_seconds",
+                "Request latency, in seconds.",
+                ["route", "bucket"],
+                LATENCY_BUCKETS,
+            )
+            self.response_size = Histogram(
+                "luna_response_size_bytes",
+                "Response body size, in bytes.",
+                ["route", "bucket"],
+                SIZE_BUCKETS,
+            )
+            self.stage_latency = Histogram(
+                "luna_stage_duration_seconds",
+                "Time spent by each request in each stage, in seconds.",
+                ["route", "stage"],
+                LATENCY_BUCKETS,
+            )
+
+    def observe_request(
+        self, route, bucket, method, status, seconds, num_bytes, stage_map
+    ):
+        """Record a completed request, and the seconds in each stage."""
+        with self.lock:
+            status = str(status)
+            self.request_count.inc((route, bucket, method, status))
+            self.request_latency.observe((route, bucket), seconds)
+            self.response_size.observe((route, bucket), num_bytes)
+            for stage, stage_seconds in stage_map.items():
+                self.stage_latency.observe((route, stage), stage_seconds)
+
+    def render(self):
+        """Get all metrics in the Prometheus text exposition format."""
+        line_list = []
+        with self.lock:
+            for metric in [
+                self.request_count,
+                self.request_latency,
+                self.response_size,
+                self.stage_latency,
+            ]:
+                line_list.append(f"# HELP {metric.name} {metric.help}")
+                line_list.append(f"# TYPE {metric.name} {metric.TYPE}")
+                line_list.extend(metric.collect())
+        return "\n".join(line_list) + "\n"
+
+    def instrument_engine(self, engine):
+        """Time all queries run via the specified engine as the db stage."""
+        sync_engine = getattr(engine, "sync_engine", engine)
+        event.listen(sync_engine, "before_cursor_execute", _before_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_execute)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records each HTTP request in Metrics.
+
+    Requests are labeled by route template, rather than by path, so that
+    the number of series stays bounded.  Likewise, the bucket label is the
+    bucket_slug path parameter only for successful requests, or for
+    errors on a bucket known to metadata_cache;  otherwise it is empty, so
+    that requests for arbitrary slugs do not create new series.
+    """
+
+    def __init__(self, app, metrics, router, metadata_cache):
+        """Create new MetricsMiddleware, recording into metrics."""
+        self.app = app
+        self.metrics = metrics
+        self.router = router
+        self.metadata_cache = metadata_cache
+        self.route_map = None
+
+    async def __call__(self, scope, receive, send):
+        """Handle an ASGI request, timing it and counting body bytes."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        stage_map = {}
+        token = _stage_seconds.set(stage_map)
+        response = {"status": 500, "num_bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["num_bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _stage_seconds.reset(token)
+            seconds = time.perf_counter() - start
+            self.metrics.observe_request(
+                self._get_route(scope),
+                self._get_bucket(scope, response["status"]),
+                scope["method"],
+                response["status"],
+                seconds,
+                response["num_bytes"],
+                stage_map,
+            )
+
+    def _get_bucket(self, scope, status):
+        # Successful requests have resolved their bucket;  errors may be for
+        # any slug at all, such as a 422 before the bucket is looked up.
+        bucket = scope.get("path_params", {}).get("bucket_slug", "")
+        if status >= 400 and not self.metadata_cache.has_bucket(bucket):
+            return ""
+        return bucket
+
+    def _get_route(self, scope):
+        # The router records the matched endpoint in the scope;  map it back
+        # to its route template.
+        if self.route_map is None:
+            self.route_map = {
+                route.endpoint: route.path
+                for route in self.router.routes
+                if hasattr(route, "endpoint")
+            }
+        return self.route_map.get(scope.get("endpoint"), UNMATCHED_ROUTE)
+
+
+@contextmanager
+def stage(name):
+    """Add the time spent within the block to the current request's stage."""
+    stage_map = _stage_seconds.get()
+    if stage_map is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stage_map[name] = stage_map.get(name, 0.0) + seconds
+
+
+def _before_execute(conn, cursor, statement, parameters, context, many):
+    conn.info["query_start"] = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, many):
+    stage_map = _stage_seconds.get()
+    if stage_map is not None:
+        seconds = time.perf_counter() - conn.info.pop("query_start")
+        stage_map[DB] = stage_map.get(DB, 0.0) + seconds
+
+
+def _format_labels(label_names, label_values):
+    return ",".join(
+        f'{name}="{_escape(value)}"'
+        for name, value in zip(label_names, label_values)
+    )
+
+
+def _escape(value):
+    value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
@@ -0,0 +1,67 @@
+"""Byte-budgeted LRU cache of serialized response bodies."""
+import os
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Byte-budgeted LRU cache of serialized response bodies.
+
+    Entries are keyed by strong ETag, which already includes the bucket
+    version, so entries never need to be invalidated;  stale entries are
+    simply evicted once the byte budget is exceeded.  Bodies are either
+    bytes, or lists of bytes chunks, which are streamed without being joined.
+
+    The budget may be over-ridden with the LUNA_RESPONSE_CACHE_BYTES
+    environment variable (default: 256 MB).  A budget of 0 disables caching.
+    """
+
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, max_bytes=None):
+        """Create new, empty ResponseCache."""
+        if max_bytes is None:
+            default = str(ResponseCache.DEFAULT_MAX_BYTES)
+            max_bytes = int(os.getenv("LUNA_RESPONSE_CACHE_BYTES", default))
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Remove all entries."""
+        with self.lock:
+            self.entry_map = OrderedDict()
+            self.num_bytes = 0
+
+    def get(self, key):
+        """Get the (media_type, body, headers) entry, or None if missing."""
+        with self.lock:
+            entry = self.entry_map.get(key)
+            if entry is not None:
+                self.entry_map.move_to_end(key)
+            return entry
+
+    def put(self, key, media_type, body, headers=None):
+        """Add an entry, evicting least recently used entries as needed."""
+        if headers is None:
+            headers = {}
+        num_bytes = get_num_bytes(body)
+        if num_bytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entry_map:
+                return
+            self.entry_map[key] = (media_type, body, headers)
+            self.num_bytes += num_bytes
+            while self.num_bytes > self.max_bytes:
+                _, evicted_entry = self.entry_map.popitem(last=False)
+                evicted_body = evicted_entry[1]
+                self.num_bytes -= get_num_bytes(evicted_body)
+
+
+def get_num_bytes(body):
+    """Get the length of a body of bytes, or of a list of bytes chunks."""
+    if isinstance(body, bytes):
+        return len(body)
+    return sum(len(chunk) for chunk in body)
@@ -13,7 +13,10 @@ from luna.h5ad.h5ad_persist import H5adDb
 from luna.vignette.vignette_validator import VignetteValidator
 from luna.vignette.vignette_persist import VignetteDb
 from luna.h5ad.h5ad_downsample import H5adDownSample
+from luna.h5ad.column_reader import ColumnReader
 from luna.db.db_util import DbConnection
+from luna.db.db_migrate import DbMigration
+from luna.db import vector
 
 
 @click.group()
@@ -28,7 +31,61 @@ def cli(verbose):
 
 @cli.command()
 @click.argument("config_file_name", type=click.Path(exists=True))
-def add(config_file_name):
+@click.option(
+    "--mode",
+    type=click.Choice(H5adDb.INGEST_MODES),
+    default=H5adDb.ORM_MODE,
+    help="Ingest mode.",
+)
+@click.option(
+    "--batch_size",
+    type=click.INT,
+    default=H5adDb.DEFAULT_BATCH_SIZE,
+    help="N genes per batch (bulk mode).",
+)
+@click.option(
+    "--backed", is_flag=True, help="Read the h5ad file from disk, in chunks."
+)
+@click.option(
+    "--chunk_size",
+    type=click.INT,
+    default=ColumnReader.DEFAULT_CHUNK_SIZE,
+    help="N genes per chunk (backed mode).",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="N worker processes, each loading a shard of genes.",
+)
+@click.option(
+    "--precision",
+    type=click.Choice(vector.PRECISION_LIST),
+    default=vector.FLOAT32,
+    help="Storage precision of gene expression vectors.",
+)
+@click.option(
+    "--compression",
+    type=click.Choice(vector.COMPRESSION_LIST),
+    default=vector.NONE,
+    help="Compression of gene expression vectors.",
+)
+@click.option(
+    "--correlation",
+    is_flag=True,
+    help="Store scores for the correlated genes endpoint.",
+)
+def add(
+    config_file_name,
+    mode,
+    batch_size,
+    backed,
+    chunk_size,
+    workers,
+    precision,
+    compression,
+    correlation,
+):
     """Add a new h5ad file to the database."""
     output_header(f"Adding data from config file:  {config_file_name}.")
     luna_config = LunaConfig(config_file_name)
@@ -39,6 +96,14 @@ def add(config_file_name):
         luna_config.h5ad_description,
         luna_config.h5ad_url,
         luna_config.gene_list,
+        ingest_mode=mode,
+        batch_size=batch_size,
+        backed=backed,
+        chunk_size=chunk_size,
+        workers=workers,
+        precision=precision,
+        compression=compression,
+        correlation=correlation,
     )
     try:
         h5ad.persist_to_database()
@@ -90,6 +155,20 @@ def reset():
     output_header(emoji.emojize("Done! :beer:", use_aliases=True))
 
 
+@cli.command()
+@click.option(
+    "--correlation",
+    is_flag=True,
+    help="Compute scores for the correlated genes endpoint.",
+)
+def migrate(correlation):
+    """Upgrade an existing database to the current schema."""
+    output_header("Migrating database to the current schema.")
+    db_migration = DbMigration(correlation=correlation)
+    db_migration.migrate()
+    output_header(emoji.emojize("Done! :beer:", use_aliases=True))
+
+
 def output_header(msg):
     """Output header with emphasis."""
     click.echo(click.style(msg, fg="green"))
@@ -0,0 +1,27 @@
+"""Per-category bitmap indexes over categorical annotations."""
+import numpy as np
+
+
+def build_bitmaps(codes, num_categories):
+    """
+    Build one bitmap per category, from the category code of each cell.
+
+    Returns a num_categories x ceil(num_cells / 8) array of packed bits,
+    where bit i of row c is set if cell i is in category c.
+    """
+    codes = np.asarray(codes)
+    num_bytes = (len(codes) + 7) // 8
+    bitmaps = np.zeros((num_categories, num_bytes), dtype=np.uint8)
+    for code in range(num_categories):
+        bitmaps[code] = np.packbits(codes == code)
+    return bitmaps
+
+
+def decode_bitmaps(blob, num_categories):
+    """Decode packed bitmaps into a read-only num_categories x N array."""
+    return np.frombuffer(blob, dtype=np.uint8).reshape(num_categories, -1)
+
+
+def get_indices(bitmap):
+    """Get the indices of all cells set in the specified bitmap."""
+    return np.flatnonzero(np.unpackbits(bitmap))
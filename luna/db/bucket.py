@@ -1,5 +1,6 @@
 """Bucket object for storing a collection of cells."""
 
+import uuid
 from luna.db.base import Base
 from sqlalchemy import Column, Integer, String
 
@@ -9,11 +10,17 @@ class Bucket(Base):
 
     __tablename__ = "bucket"
 
+    # Buckets are hidden from the API until all of their data is loaded.
+    LOADING = "loading"
+    READY = "ready"
+
     id = Column(Integer, primary_key=True)
     slug = Column(String, unique=True)
     name = Column(String)
     description = Column(String)
     url = Column(String)
+    version = Column(String)
+    status = Column(String)
 
     def __init__(self, slug, name, description=None, url=None):
         """Create Bucket Object."""
@@ -22,6 +29,10 @@ class Bucket(Base):
         self.description = description
         self.url = url
 
+        # Stamped at ingest;  bucket data never changes for a given version.
+        self.version = uuid.uuid4().hex
+        self.status = Bucket.LOADING
+
     def __repr__(self):
         """Get bucket summary."""
         return f"<Bucket({self.slug}, {self.description})>"
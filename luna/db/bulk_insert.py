@@ -0,0 +1,71 @@
+"""Bulk insert of ORM objects, bypassing the ORM unit of work."""
+import enum
+import io
+
+
+class BulkInsert:
+    """
+    Bulk insert ORM objects into their table.
+
+    On PostgreSQL, rows are streamed with COPY;  on all other dialects,
+    rows are inserted with a single executemany per batch.  Each batch is
+    written in its own transaction.
+    """
+
+    COPY_NULL = "\\N"
+
+    def __init__(self, engine, table):
+        """Create new BulkInsert Instance for the specified table."""
+        self.engine = engine
+        self.table = table
+        self.column_list = [c.name for c in table.columns if c.name != "id"]
+
+    def insert(self, object_list):
+        """Insert the specified ORM objects as a single batch."""
+        if len(object_list) == 0:
+            return
+        row_list = [self._to_row(current) for current in object_list]
+        if self.engine.dialect.name == "postgresql":
+            self._copy(row_list)
+        else:
+            self._execute_many(row_list)
+
+    def _to_row(self, current):
+        return {name: getattr(current, name) for name in self.column_list}
+
+    def _execute_many(self, row_list):
+        with self.engine.begin() as connection:
+            connection.execute(self.table.insert(), row_list)
+
+    def _copy(self, row_list):
+        buffer = io.StringIO()
+        for row in row_list:
+            field_list = [self._to_copy_field(v) for v in row.values()]
+            buffer.write("\t".join(field_list))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        column_str = ", ".join(self.column_list)
+        sql = f"COPY {self.table.name} ({column_str}) FROM STDIN"
+        raw_connection = self.engine.raw_connection()
+        try:
+            cursor = raw_connection.cursor()
+            cursor.copy_expert(sql, buffer)
+            raw_connection.commit()
+        finally:
+            raw_connection.close()
+
+    def _to_copy_field(self, value):
+        # Encode a single value in the COPY text format.
+        if value is None:
+            return BulkInsert.COPY_NULL
+        if isinstance(value, enum.Enum):
+            return value.name
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return "\\\\x" + bytes(value).hex()
+        value = str(value)
+        value = value.replace("\\", "\\\\")
+        value = value.replace("\t", "\\t")
+        value = value.replace("\n", "\\n")
+        value = value.replace("\r", "\\r")
+        return value
@@ -0,0 +1,34 @@
+"""Dictionary encoding of categorical values."""
+import numpy as np
+from natsort import natsorted, ns
+
+
+def get_code_dtype(num_categories):
+    """Get the smallest unsigned integer dtype that holds every code."""
+    if num_categories <= 2 ** 8:
+        return np.dtype("u1")
+    elif num_categories <= 2 ** 16:
+        return np.dtype("<u2")
+    return np.dtype("<u4")
+
+
+def encode_categories(value_list):
+    """
+    Encode the specified values as naturally sorted categories and codes.
+
+    Returns (category_list, codes), where category_list holds the distinct
+    values in natural sort order, and codes holds the index of each value
+    within category_list.
+    """
+    values = np.array([str(value) for value in value_list], dtype=object)
+    unique_list, inverse = np.unique(values, return_inverse=True)
+    category_list = natsorted(unique_list.tolist(), alg=ns.IGNORECASE)
+    rank_map = {category: i for i, category in enumerate(category_list)}
+    remap = np.array([rank_map[c] for c in unique_list], dtype=np.int64)
+    codes = remap[inverse].astype(get_code_dtype(len(category_list)))
+    return category_list, codes
+
+
+def decode_codes(blob, num_categories):
+    """Decode raw codes into a read-only NumPy array."""
+    return np.frombuffer(blob, dtype=get_code_dtype(num_categories))
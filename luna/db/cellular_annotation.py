@@ -1,7 +1,10 @@
 """Cellular Annotation."""
 from luna.db.slug import SlugUtil
 from luna.db.base import Base, DB_DELIM
-from sqlalchemy import Column, Integer, String
+from luna.db.vector import encode_vector, decode_vector
+from luna.db.categorical import encode_categories, decode_codes
+from luna.db.bitmap import build_bitmaps, decode_bitmaps
+from sqlalchemy import Column, Integer, String, LargeBinary, Index
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import Enum
@@ -19,29 +22,94 @@ class CellularAnnotation(Base):
     """Cellular Annotation ORM Class."""
 
     __tablename__ = "cellular_annotation"
+    __table_args__ = (
+        Index(
+            "ix_cellular_annotation_bucket_type_slug",
+            "bucket_id",
+            "type",
+            "slug",
+            unique=True,
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     slug = Column(String)
     label = Column(String)
     type = Column(Enum(CellularAnnotationType))
     value_list = Column(String)
+    value_blob = Column(LargeBinary)
+    value_encoding = Column(String)
+    category_list = Column(String)
+    code_blob = Column(LargeBinary)
+    bitmap_blob = Column(LargeBinary)
     bucket_id = Column(Integer, ForeignKey("bucket.id"))
     bucket = relationship("Bucket", backref="cellular_annotation_list")
 
-    def __init__(self, key, type, value_list, bucket_id):
-        """Create new CellularAnnotation Object."""
+    def __init__(self, key, type, value_list, bucket_id, value_encoding=None):
+        """
+        Create new CellularAnnotation Object.
+
+        Gene expression vectors are stored with the specified encoding, or
+        as raw float32 if None;  see luna.db.vector.
+        """
         slugger = SlugUtil()
         self.label = key
         self.slug = slugger.sluggify(key)
         self.type = type
-        self.value_list = DB_DELIM.join(map(str, value_list))
         self.bucket_id = bucket_id
 
+        # Gene expression vectors are stored as binary vectors;  all other
+        # annotations are stored as naturally sorted categories, plus one
+        # integer code per cell, plus one bitmap per category for filters.
+        self.value_list = None
+        if type == CellularAnnotationType.GENE_EXPRESSION:
+            self.value_blob = encode_vector(value_list, value_encoding)
+            self.value_encoding = value_encoding
+            self.category_list = None
+            self.code_blob = None
+            self.bitmap_blob = None
+        else:
+            category_list, codes = encode_categories(value_list)
+            self.value_blob = None
+            self.value_encoding = None
+            self.category_list = DB_DELIM.join(category_list)
+            self.code_blob = codes.tobytes()
+            bitmaps = build_bitmaps(codes, len(category_list))
+            self.bitmap_blob = bitmaps.tobytes()
+
+    def get_values(self):
+        """Get the decoded gene expression vector."""
+        return decode_vector(self.value_blob, self.value_encoding)
+
+    def get_categories(self):
+        """Get the naturally sorted list of distinct categories."""
+        return get_category_list(self.category_list)
+
+    def get_codes(self):
+        """Get the category code of each cell."""
+        return decode_codes(self.code_blob, len(self.get_categories()))
+
+    def get_bitmaps(self):
+        """Get the packed bitmap of cells in each category."""
+        return decode_bitmaps(self.bitmap_blob, len(self.get_categories()))
+
     def __repr__(self):
         """Get CellularAnnotation Summary."""
-        token_list = self.value_list.split(DB_DELIM)
+        if self.value_blob is not None:
+            num_elements = len(self.get_values())
+        elif self.code_blob is not None:
+            num_elements = len(self.get_codes())
+        else:
+            num_elements = len(self.value_list.split(DB_DELIM))
         return "<CellularAnnotation(%s, type=%s, vector of %d elements)>" % (
             self.slug,
             self.type,
-            len(token_list),
+            num_elements,
         )
+
+
+def get_category_list(category_list):
+    """Split a stored, delimited category list."""
+    if category_list is None:
+        return []
+    return category_list.split(DB_DELIM)
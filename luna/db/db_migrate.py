@@ -0,0 +1,247 @@
+"""Upgrade existing databases to the current schema."""
+import logging
+import uuid
+import numpy as np
+from sqlalchemy import and_, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from luna.db.base import Base, DB_DELIM
+from luna.db.db_util import DbConnection
+from luna.db.vector import encode_vector, decode_vector, VECTOR_DTYPE
+from luna.db.categorical import encode_categories
+from luna.db.correlation import PEARSON, encode_scores
+from luna.db.bitmap import build_bitmaps
+from luna.db import cellular_annotation as ann
+from luna.db.bucket import Bucket
+from luna.db.gene_statistics import GeneStatistics
+from luna.db import scatter_plot as sca
+
+
+class DbMigration:
+    """Upgrade an existing database in place, without reloading buckets."""
+
+    BATCH_SIZE = 100
+
+    def __init__(self, correlation=False):
+        """
+        Create new DbMigration Instance.
+
+        If correlation is True, correlation scores are also computed for all
+        genes without them.
+        """
+        self.correlation = correlation
+        self.db_connection = DbConnection()
+        self.engine = self.db_connection.engine
+        self.session = Session(bind=self.engine)
+
+    def migrate(self):
+        """Run all migration steps;  each step is safe to re-run."""
+        self._create_missing_tables()
+        self._add_missing_columns()
+        self._create_missing_indexes()
+        self._migrate_expression_vectors()
+        self._migrate_categorical_annotations()
+        self._build_annotation_bitmaps()
+        self._compute_gene_statistics()
+        if self.correlation:
+            self._compute_correlation_scores()
+        self._stamp_bucket_versions()
+        self._mark_buckets_ready()
+        self._build_lod_indexes()
+        self.session.close()
+
+    def _create_missing_tables(self):
+        logging.info("Creating missing tables.")
+        Base.metadata.create_all(self.engine)
+
+    def _add_missing_columns(self):
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    self._add_column(table.name, column)
+
+    def _add_column(self, table_name, column):
+        logging.info(f"Adding column:  {table_name}.{column.name}.")
+        column_type = column.type.compile(dialect=self.engine.dialect)
+        sql = f"ALTER TABLE {table_name} ADD COLUMN {column.name} "
+        sql += column_type
+        with self.engine.begin() as connection:
+            connection.execute(text(sql))
+
+    def _create_missing_indexes(self):
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    self._create_index(index)
+
+    def _create_index(self, index):
+        logging.info(f"Creating index:  {index.name}.")
+        try:
+            index.create(self.engine)
+        except IntegrityError:
+            logging.warning(
+                f"Duplicate rows prevent unique index:  {index.name};  "
+                "reload the affected buckets, and migrate again."
+            )
+
+    def _migrate_expression_vectors(self):
+        # Convert delimited text vectors, written by earlier versions,
+        # to binary float32.
+        target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+        while True:
+            record_list = (
+                self.session.query(ann.CellularAnnotation)
+                .filter_by(type=target_type, value_blob=None)
+                .filter(ann.CellularAnnotation.value_list.isnot(None))
+                .limit(DbMigration.BATCH_SIZE)
+                .all()
+            )
+            if len(record_list) == 0:
+                break
+            for record in record_list:
+                logging.info(f"Migrating expression vector:  {record.slug}.")
+                value_list = record.value_list.split(DB_DELIM)
+                values = np.array(value_list, dtype=VECTOR_DTYPE)
+                record.value_blob = encode_vector(values)
+                record.value_list = None
+            self.session.commit()
+
+    def _migrate_categorical_annotations(self):
+        # Convert delimited text annotations, written by earlier versions,
+        # to categories plus integer codes.
+        target_type = ann.CellularAnnotationType.OTHER
+        while True:
+            record_list = (
+                self.session.query(ann.CellularAnnotation)
+                .filter_by(type=target_type, code_blob=None)
+                .filter(ann.CellularAnnotation.value_list.isnot(None))
+                .limit(DbMigration.BATCH_SIZE)
+                .all()
+            )
+            if len(record_list) == 0:
+                break
+            for record in record_list:
+                logging.info(f"Migrating annotation:  {record.slug}.")
+                value_list = record.value_list.split(DB_DELIM)
+                category_list, codes = encode_categories(value_list)
+                record.category_list = DB_DELIM.join(category_list)
+                record.code_blob = codes.tobytes()
+                record.value_list = None
+            self.session.commit()
+
+    def _build_annotation_bitmaps(self):
+        # Annotations loaded by earlier versions have no bitmap index.
+        target_type = ann.CellularAnnotationType.OTHER
+        while True:
+            record_list = (
+                self.session.query(ann.CellularAnnotation)
+                .filter_by(type=target_type, bitmap_blob=None)
+                .filter(ann.CellularAnnotation.code_blob.isnot(None))
+                .limit(DbMigration.BATCH_SIZE)
+                .all()
+            )
+            if len(record_list) == 0:
+                break
+            for record in record_list:
+                logging.info(f"Building annotation bitmaps:  {record.slug}.")
+                bitmaps = build_bitmaps(
+                    record.get_codes(), len(record.get_categories())
+                )
+                record.bitmap_blob = bitmaps.tobytes()
+            self.session.commit()
+
+    def _compute_gene_statistics(self):
+        # Genes loaded by earlier versions have no statistics.
+        target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+        while True:
+            record_list = (
+                self.session.query(ann.CellularAnnotation)
+                .outerjoin(
+                    GeneStatistics,
+                    and_(
+                        GeneStatistics.bucket_id
+                        == ann.CellularAnnotation.bucket_id,
+                        GeneStatistics.slug == ann.CellularAnnotation.slug,
+                    ),
+                )
+                .filter(ann.CellularAnnotation.type == target_type)
+                .filter(ann.CellularAnnotation.value_blob.isnot(None))
+                .filter(GeneStatistics.id.is_(None))
+                .limit(DbMigration.BATCH_SIZE)
+                .all()
+            )
+            if len(record_list) == 0:
+                break
+            for record in record_list:
+                logging.info(f"Computing gene statistics:  {record.slug}.")
+                values = record.get_values()
+                self.session.add(
+                    GeneStatistics(
+                        record.slug, values, record.bucket_id, self.correlation
+                    )
+                )
+            self.session.commit()
+
+    def _compute_correlation_scores(self):
+        # Scores are only computed on request, and by earlier versions.
+        target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+        while True:
+            record_list = (
+                self.session.query(
+                    GeneStatistics,
+                    ann.CellularAnnotation.value_blob,
+                    ann.CellularAnnotation.value_encoding,
+                )
+                .join(
+                    ann.CellularAnnotation,
+                    and_(
+                        GeneStatistics.bucket_id
+                        == ann.CellularAnnotation.bucket_id,
+                        GeneStatistics.slug == ann.CellularAnnotation.slug,
+                    ),
+                )
+                .filter(ann.CellularAnnotation.type == target_type)
+                .filter(ann.CellularAnnotation.value_blob.isnot(None))
+                .filter(GeneStatistics.pearson_blob.is_(None))
+                .limit(DbMigration.BATCH_SIZE)
+                .all()
+            )
+            if len(record_list) == 0:
+                break
+            for stats, value_blob, value_encoding in record_list:
+                logging.info(f"Computing correlation scores:  {stats.slug}.")
+                values = decode_vector(value_blob, value_encoding)
+                stats.pearson_blob = encode_scores(values, PEARSON)
+            self.session.commit()
+
+    def _stamp_bucket_versions(self):
+        # Buckets loaded by earlier versions have no version stamp.
+        record_list = self.session.query(Bucket).filter_by(version=None).all()
+        for record in record_list:
+            logging.info(f"Stamping bucket version:  {record.slug}.")
+            record.version = uuid.uuid4().hex
+        self.session.commit()
+
+    def _mark_buckets_ready(self):
+        # Buckets loaded by earlier versions have no status, and were
+        # always visible.
+        record_list = self.session.query(Bucket).filter_by(status=None).all()
+        for record in record_list:
+            logging.info(f"Marking bucket ready:  {record.slug}.")
+            record.status = Bucket.READY
+        self.session.commit()
+
+    def _build_lod_indexes(self):
+        # Scatter plots loaded by earlier versions have no LOD index.
+        record_list = (
+            self.session.query(sca.ScatterPlot).filter_by(lod_order=None).all()
+        )
+        for record in record_list:
+            logging.info(f"Building LOD index:  {record.type}.")
+            coordinates = sca.decode_coordinate_list(record.coordinate_list)
+            record.set_lod_index(coordinates)
+            self.session.commit()
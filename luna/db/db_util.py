@@ -2,7 +2,10 @@
 import os
 import logging
 from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
 from sqlalchemy_utils import database_exists, create_database, drop_database
 from luna.db.base import Base
 
@@ -45,3 +48,87 @@ class DbConnection:
     def _init_db_connections(self):
         self.engine = create_engine(self.db_connect_str)
         self.session = Session(bind=self.engine)
+
+
+class DbPool:
+    """
+    Process-wide async database engine with a tunable connection pool.
+
+    Intended to be created once per API process.  Connects via an asyncio
+    driver:  asyncpg for PostgreSQL and aiosqlite for SQLite, derived from
+    LUNA_DB_CONNECT, or set explicitly via LUNA_DB_CONNECT_ASYNC.  Pool
+    settings may be over-ridden with the following environment variables:
+
+    LUNA_DB_POOL_SIZE:  number of connections kept open (default: 5).
+    LUNA_DB_MAX_OVERFLOW:  extra connections allowed under load (default: 10).
+    LUNA_DB_POOL_RECYCLE:  seconds before a connection is recycled
+        (default: 1800).
+    LUNA_DB_POOL_PRE_PING:  test connections before use (default: true).
+    """
+
+    ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+    def __init__(self):
+        """Construct a new async engine and session factory."""
+        self.db_connect_str = os.getenv(
+            "LUNA_DB_CONNECT", default=DbConnection.DEFAULT_DB_CONNECT_STR
+        )
+        self.async_db_url = make_url(
+            os.getenv("LUNA_DB_CONNECT_ASYNC")
+            or self._to_async_url(self.db_connect_str)
+        )
+        self.engine = create_async_engine(
+            self.async_db_url, **self._pool_args()
+        )
+        self.session_factory = sessionmaker(
+            self.engine, class_=AsyncSession, expire_on_commit=False
+        )
+
+    def prepare_database(self):
+        """Create the database and any missing tables;  run once at startup."""
+        if not database_exists(self.db_connect_str):
+            logging.info("Database does not exist.")
+            create_database(self.db_connect_str)
+        sync_engine = create_engine(self.db_connect_str)
+        Base.metadata.create_all(sync_engine)
+        sync_engine.dispose()
+
+    def create_session(self):
+        """Create a new AsyncSession, backed by the shared connection pool."""
+        return self.session_factory()
+
+    async def dispose(self):
+        """Close all pooled connections."""
+        await self.engine.dispose()
+
+    def _to_async_url(self, db_connect_str):
+        url = make_url(db_connect_str)
+        backend = url.get_backend_name()
+        driver = DbPool.ASYNC_DRIVERS.get(backend)
+        if driver is None:
+            return url
+        return url.set(drivername=f"{backend}+{driver}")
+
+    def _pool_args(self):
+        pool_args = {
+            "pool_pre_ping": _get_env_flag("LUNA_DB_POOL_PRE_PING", True),
+            "pool_recycle": int(os.getenv("LUNA_DB_POOL_RECYCLE", "1800")),
+        }
+
+        # SQLite connections are cheap, and must not outlive a reset of the
+        # database file, so they are not pooled.
+        if self.async_db_url.get_backend_name() == "sqlite":
+            pool_args["poolclass"] = NullPool
+        else:
+            pool_args["pool_size"] = int(os.getenv("LUNA_DB_POOL_SIZE", "5"))
+            pool_args["max_overflow"] = int(
+                os.getenv("LUNA_DB_MAX_OVERFLOW", "10")
+            )
+        return pool_args
+
+
+def _get_env_flag(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ["1", "true", "yes"]
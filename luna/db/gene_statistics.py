@@ -0,0 +1,88 @@
+"""Per-gene expression statistics, computed once at ingest."""
+import numpy as np
+from luna.db.slug import SlugUtil
+from luna.db.base import Base
+from luna.db.correlation import PEARSON, encode_scores
+from sqlalchemy import Column, Integer, String, Float, Index, LargeBinary
+from sqlalchemy import ForeignKey
+from sqlalchemy.orm import deferred, relationship
+
+
+class GeneStatistics(Base):
+    """Gene Statistics ORM Class."""
+
+    __tablename__ = "gene_statistics"
+    __table_args__ = (
+        Index(
+            "ix_gene_statistics_bucket_slug", "bucket_id", "slug", unique=True
+        ),
+    )
+
+    # Quantiles stored for each gene, and the matching column names.
+    QUANTILE_MAP = {
+        "q25": 0.25,
+        "q50": 0.50,
+        "q75": 0.75,
+        "q99": 0.99,
+    }
+
+    id = Column(Integer, primary_key=True)
+    slug = Column(String)
+    num_cells = Column(Integer)
+    min_value = Column(Float)
+    max_value = Column(Float)
+    mean = Column(Float)
+    fraction_nonzero = Column(Float)
+    q25 = Column(Float)
+    q50 = Column(Float)
+    q75 = Column(Float)
+    q99 = Column(Float)
+    # Standardized scores, for gene-gene correlation, if requested at
+    # ingest.  These are as large as the expression vector, so are only
+    # loaded when accessed.  Spearman scores are derived from these, as the
+    # z-scores preserve the ranks of the values.
+    pearson_blob = deferred(Column(LargeBinary))
+    bucket_id = Column(Integer, ForeignKey("bucket.id"))
+    bucket = relationship("Bucket", backref="gene_statistics_list")
+
+    def __init__(self, key, values, bucket_id, correlation=False):
+        """
+        Create new GeneStatistics Object from a vector of expression.
+
+        If correlation is True, standardized scores are also stored, for
+        gene-gene correlation.
+        """
+        slugger = SlugUtil()
+        self.slug = slugger.sluggify(key)
+        self.bucket_id = bucket_id
+
+        values = np.asarray(values, dtype=np.float64)
+        self.pearson_blob = None
+        if correlation:
+            self.pearson_blob = encode_scores(values, PEARSON)
+        self.num_cells = len(values)
+        if self.num_cells == 0:
+            values = np.zeros(1)
+        self.min_value = float(values.min())
+        self.max_value = float(values.max())
+        self.mean = float(values.mean())
+        self.fraction_nonzero = float(np.count_nonzero(values) / len(values))
+        quantile_list = list(GeneStatistics.QUANTILE_MAP.values())
+        quantiles = np.quantile(values, quantile_list)
+        for name, quantile in zip(GeneStatistics.QUANTILE_MAP, quantiles):
+            setattr(self, name, float(quantile))
+
+    @staticmethod
+    def get_quantile_columns():
+        """Get the quantile columns, in the order of QUANTILE_MAP."""
+        quantile_map = GeneStatistics.QUANTILE_MAP
+        return [getattr(GeneStatistics, name) for name in quantile_map]
+
+    def __repr__(self):
+        """Get GeneStatistics Summary."""
+        return "<GeneStatistics(%s, min=%g, max=%g, mean=%g)>" % (
+            self.slug,
+            self.min_value,
+            self.max_value,
+            self.mean,
+        )
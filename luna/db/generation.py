@@ -0,0 +1,49 @@
+"""Generation counter, bumped whenever bucket metadata changes."""
+import uuid
+from luna.db.base import Base
+from sqlalchemy import Column, Integer, String
+
+
+class Generation(Base):
+    """
+    Generation ORM Class.
+
+    Holds a single row.  The instance token is new for each database, so
+    that a reset database is never mistaken for an earlier one, and the
+    counter is bumped each time data is ingested.
+    """
+
+    __tablename__ = "generation"
+
+    id = Column(Integer, primary_key=True)
+    instance = Column(String)
+    counter = Column(Integer)
+
+    def __init__(self):
+        """Create new Generation Object."""
+        self.instance = uuid.uuid4().hex
+        self.counter = 0
+
+    def __repr__(self):
+        """Get Generation Summary."""
+        return f"<Generation({self.instance}, {self.counter})>"
+
+    @staticmethod
+    def bump(session):
+        """Bump the generation counter, and commit."""
+        generation = session.query(Generation).with_for_update().first()
+        if generation is None:
+            generation = Generation()
+            session.add(generation)
+        generation.counter += 1
+        session.commit()
+        return generation.counter
+
+    @staticmethod
+    def get_current(session):
+        """Get the current (instance, counter) pair, or None if never set."""
+        record = session.query(Generation.instance, Generation.counter)
+        record = record.first()
+        if record is None:
+            return None
+        return (record.instance, record.counter)
@@ -0,0 +1,89 @@
+"""Expression statistics of genes, grouped by a categorical annotation."""
+import numpy as np
+from scipy import sparse
+from luna.db.gene_statistics import GeneStatistics
+
+
+def get_group_statistics(values, codes, num_groups):
+    """
+    Get expression statistics for each group of cells.
+
+    values holds the expression of each cell, and codes holds the group of
+    each cell, from 0 to num_groups - 1.  Returns a dict of arrays, with
+    one element per group:  num_cells, min, max, mean, fraction_nonzero,
+    plus each quantile in GeneStatistics.QUANTILE_MAP.  Quantiles are
+    linearly interpolated, as in numpy.quantile.  Empty groups are zero.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    codes = np.asarray(codes, dtype=np.int64)
+    if len(values) != len(codes):
+        raise ValueError("Values and codes must have the same length.")
+
+    num_cells = np.bincount(codes, minlength=num_groups)
+    divisor = np.maximum(num_cells, 1)
+    sums = np.bincount(codes, weights=values, minlength=num_groups)
+    nonzero = np.bincount(
+        codes, weights=(values != 0).astype(np.float64), minlength=num_groups
+    )
+
+    # Sort by group, then by value, so that each group is a sorted run.
+    sorted_values = values[np.lexsort((values, codes))]
+    if len(sorted_values) == 0:
+        sorted_values = np.zeros(1)
+    start = np.concatenate(([0], np.cumsum(num_cells)[:-1]))
+    last = np.maximum(num_cells - 1, 0)
+    empty = num_cells == 0
+
+    def take(offset):
+        # Empty groups may start past the end;  their values are masked.
+        index = np.minimum(start + offset, len(sorted_values) - 1)
+        return np.where(empty, 0.0, sorted_values[index])
+
+    group_stats = {
+        "num_cells": num_cells,
+        "min": take(0),
+        "max": take(last),
+        "mean": sums / divisor,
+        "fraction_nonzero": nonzero / divisor,
+    }
+    for name, quantile in GeneStatistics.QUANTILE_MAP.items():
+        position = quantile * last
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, last)
+        lower_values = take(lower)
+        upper_values = take(upper)
+        fraction = position - lower
+        group_stats[name] = lower_values + (
+            upper_values - lower_values
+        ) * fraction
+    return group_stats
+
+
+def get_group_means(matrix, codes, num_groups):
+    """
+    Get the mean and fraction nonzero of each gene, for each group of cells.
+
+    matrix holds the expression of each gene, genes x cells, and codes
+    holds the group of each cell.  Returns (num_cells, mean,
+    fraction_nonzero), where num_cells has one element per group, and mean
+    and fraction_nonzero are genes x groups.  Each is computed as a single
+    product with a sparse, cells x groups one-hot matrix, in float64, so
+    that sums over millions of cells keep their precision.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    codes = np.asarray(codes, dtype=np.int64)
+    if matrix.shape[1] != len(codes):
+        raise ValueError("Matrix and codes must have the same cell count.")
+
+    num_cells = np.bincount(codes, minlength=num_groups)
+    divisor = np.maximum(num_cells, 1)
+    ones = np.ones(len(codes), dtype=np.float64)
+    one_hot = sparse.csr_matrix(
+        (ones, (np.arange(len(codes)), codes)),
+        shape=(len(codes), num_groups),
+    )
+    sums = np.asarray(matrix.astype(np.float64) @ one_hot)
+    nonzero = np.asarray((matrix != 0).astype(np.float64) @ one_hot)
+    mean = np.ascontiguousarray(sums / divisor)
+    fraction_nonzero = np.ascontiguousarray(nonzero / divisor)
+    return num_cells, mean, fraction_nonzero
@@ -1,10 +1,12 @@
 """ScatterPlot object for storing X,Y coordinates."""
 from luna.db.base import Base, DB_DELIM
-from sqlalchemy import Column, Integer, String
+from luna.db import spatial_index
+from sqlalchemy import Column, Integer, String, LargeBinary, Index
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import Enum
 import enum
+import numpy as np
 
 
 class ScatterPlotType(enum.Enum):
@@ -18,10 +20,15 @@ class ScatterPlot(Base):
     """Scatter Plot ORM Class."""
 
     __tablename__ = "scatter_plot"
+    __table_args__ = (
+        Index("ix_scatter_plot_bucket_type", "bucket_id", "type", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     type = Column(Enum(ScatterPlotType))
     coordinate_list = Column(String)
+    lod_order = Column(LargeBinary)
+    lod_coordinates = Column(LargeBinary)
     bucket_id = Column(Integer, ForeignKey("bucket.id"))
     bucket = relationship("Bucket", backref="scatter_plot_list")
 
@@ -33,8 +40,28 @@ class ScatterPlot(Base):
         for coord in value_list:
             self.coordinate_list += "%f,%f%s" % (coord[0], coord[1], DB_DELIM)
         self.bucket_id = bucket_id
+        self.set_lod_index(value_list)
+
+    def set_lod_index(self, value_list):
+        """Build the level-of-detail index for the specified coordinates."""
+        coordinates = np.asarray(value_list, dtype=np.float64)
+        coordinates = coordinates.reshape(len(coordinates), -1)[:, 0:2]
+        lod_order = spatial_index.build_lod_order(coordinates)
+        lod_coordinates = coordinates[lod_order].astype(
+            spatial_index.COORDINATE_DTYPE
+        )
+        self.lod_order = lod_order.tobytes()
+        self.lod_coordinates = lod_coordinates.tobytes()
 
     def __repr__(self):
         """Get Scatter Plot Summary."""
         token_list = self.coordinate_list.split(DB_DELIM)
         return f"<ScatterPlot(vector of {len(token_list)} elements)>"
+
+
+def decode_coordinate_list(coordinate_list):
+    """Decode a delimited coordinate list into an N x 2 NumPy array."""
+    value_list = coordinate_list.rstrip(DB_DELIM).replace(DB_DELIM, ",")
+    if len(value_list) == 0:
+        return np.zeros((0, 2), dtype=np.float64)
+    return np.array(value_list.split(","), dtype=np.float64).reshape(-1, 2)
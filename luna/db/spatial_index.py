@@ -0,0 +1,164 @@
+"""Level-of-detail spatial index over scatter plot coordinates."""
+import numpy as np
+
+# Coordinates are stored as float32 (x, y) pairs, cell indices as int32.
+COORDINATE_DTYPE = np.dtype("<f4")
+INDEX_DTYPE = np.dtype("<i4")
+MAX_LEVEL = 12
+
+
+def build_lod_order(coordinates):
+    """
+    Get a progressive (coarse to fine) ordering of cell indices.
+
+    Builds a multi-resolution grid over the bounding box of all cells.  At
+    level L, the box is divided into 2^L x 2^L cells, and one not yet
+    selected point is picked from each occupied cell.  Any prefix of the
+    resulting order is therefore a spatially representative subset of the
+    cells, and so is any prefix restricted to a viewport.
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    num_points = coordinates.shape[0]
+    if num_points == 0:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+
+    min_xy = coordinates.min(axis=0)
+    span_xy = coordinates.max(axis=0) - min_xy
+    span_xy[span_xy == 0] = 1.0
+    normalized = (coordinates - min_xy) / span_xy
+
+    selected = np.zeros(num_points, dtype=bool)
+    order_list = []
+    for level in range(MAX_LEVEL + 1):
+        grid_size = 2 ** level
+        cells = (normalized * grid_size).astype(np.int64)
+        cells = np.minimum(cells, grid_size - 1)
+        cell_ids = cells[:, 0] * grid_size + cells[:, 1]
+        candidates = np.flatnonzero(~selected)
+        _, first_index = np.unique(cell_ids[candidates], return_index=True)
+        picked = candidates[np.sort(first_index)]
+        order_list.append(picked)
+        selected[picked] = True
+        if selected.all():
+            break
+    order_list.append(np.flatnonzero(~selected))
+    return np.concatenate(order_list).astype(INDEX_DTYPE)
+
+
+class LodIndex:
+    """
+    Viewport queries over the cells of a scatter plot, in LOD order.
+
+    Cells are bucketed into a TILE_LEVEL grid over their bounding box, and
+    each tile holds the LOD positions of its cells, in ascending order.  A
+    viewport query therefore only reads the cells of the tiles it overlaps,
+    rather than all cells.
+    """
+
+    TILE_LEVEL = 6
+
+    def __init__(self, lod_order, lod_coordinates):
+        """
+        Create new LodIndex.
+
+        lod_coordinates holds the coordinates already permuted into LOD
+        order, and lod_order the matching cell indices.
+        """
+        self.lod_order = lod_order
+        self.lod_coordinates = lod_coordinates
+        self.grid_size = 2**LodIndex.TILE_LEVEL
+        num_tiles = self.grid_size * self.grid_size
+        if len(lod_order) == 0:
+            self.min_xy = np.zeros(2)
+            self.span_xy = np.ones(2)
+            self.positions = np.zeros(0, dtype=INDEX_DTYPE)
+            self.tile_starts = np.zeros(num_tiles + 1, dtype=np.int64)
+            return
+
+        coordinates = np.asarray(lod_coordinates, dtype=np.float64)
+        self.min_xy = coordinates.min(axis=0)
+        self.span_xy = coordinates.max(axis=0) - self.min_xy
+        self.span_xy[self.span_xy == 0] = 1.0
+        tile_x = self._get_tiles(coordinates[:, 0], 0)
+        tile_y = self._get_tiles(coordinates[:, 1], 1)
+        tile_ids = tile_x * self.grid_size + tile_y
+
+        # A stable sort keeps the LOD positions of each tile in order.
+        self.positions = np.argsort(tile_ids, kind="stable").astype(
+            INDEX_DTYPE
+        )
+        tile_counts = np.bincount(tile_ids, minlength=num_tiles)
+        self.tile_starts = np.zeros(num_tiles + 1, dtype=np.int64)
+        np.cumsum(tile_counts, out=self.tile_starts[1:])
+
+    def __len__(self):
+        """Get the number of cells in the index."""
+        return len(self.lod_order)
+
+    def query(self, bbox=None, limit=None):
+        """
+        Get a representative subset of cells within a viewport.
+
+        bbox is an optional (x_min, x_max, y_min, y_max) tuple;  None values
+        are unbounded.  Returns (cell_indices, coordinates, total), where
+        total is the number of cells within the viewport, before the limit
+        is applied.
+        """
+        if bbox is None or all(b is None for b in bbox):
+            total = len(self.lod_order)
+            end = total if limit is None else min(limit, total)
+            return self.lod_order[:end], self.lod_coordinates[:end], total
+
+        position_list = self._get_positions(bbox)
+        total = len(position_list)
+        if limit is not None and limit < total:
+            position_list = np.partition(position_list, limit - 1)[:limit]
+        position_list = np.sort(position_list)
+        return (
+            self.lod_order[position_list],
+            self.lod_coordinates[position_list],
+            total,
+        )
+
+    def _get_positions(self, bbox):
+        # Gather the positions of the cells in the overlapping tiles, one
+        # contiguous run of tiles per grid column, then mask by the bbox.
+        x_min, x_max, y_min, y_max = bbox
+        x_lo, x_hi = self._get_tile_range(x_min, x_max, 0)
+        y_lo, y_hi = self._get_tile_range(y_min, y_max, 1)
+        run_list = []
+        for tile_x in range(x_lo, x_hi + 1):
+            start = self.tile_starts[tile_x * self.grid_size + y_lo]
+            end = self.tile_starts[tile_x * self.grid_size + y_hi + 1]
+            run_list.append(self.positions[start:end])
+        if len(run_list) == 0:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        candidates = np.concatenate(run_list)
+
+        # Compare at the precision used to assign the tiles.
+        x = self.lod_coordinates[candidates, 0].astype(np.float64)
+        y = self.lod_coordinates[candidates, 1].astype(np.float64)
+        mask = np.ones(len(candidates), dtype=bool)
+        if x_min is not None:
+            mask &= x >= x_min
+        if x_max is not None:
+            mask &= x <= x_max
+        if y_min is not None:
+            mask &= y >= y_min
+        if y_max is not None:
+            mask &= y <= y_max
+        return candidates[mask]
+
+    def _get_tile_range(self, low, high, axis):
+        low = self.min_xy[axis] if low is None else low
+        high = self.min_xy[axis] + self.span_xy[axis] if high is None else high
+        bounds = np.array([low, high], dtype=np.float64)
+        if np.isnan(bounds).any():
+            return 0, -1
+        tiles = self._get_tiles(bounds, axis)
+        return int(tiles[0]), int(tiles[1])
+
+    def _get_tiles(self, values, axis):
+        normalized = (values - self.min_xy[axis]) / self.span_xy[axis]
+        tiles = np.floor(normalized * self.grid_size)
+        return np.clip(tiles, 0, self.grid_size - 1).astype(np.int64)
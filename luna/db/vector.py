@@ -0,0 +1,152 @@
+"""
+Binary encoding of numeric vectors.
+
+By default, vectors are stored as raw little-endian float32, so that
+decoding is a single frombuffer call.  Expression vectors may instead be
+stored at reduced precision, optionally compressed, as described by an
+encoding string such as "uint8+zstd";  None denotes raw float32.
+
+Precision options, and the maximum absolute error of a decoded value v,
+as returned by get_max_error:
+
+float32:  exact, for float32 input.
+float16:  |v| * 2 ** -11, plus 2 ** -25 near zero;  values beyond +/-65504
+    cannot be stored.
+uint16:  (max - min) / (2 * 65535), via linear quantization with a stored
+    offset and scale, where min and max are those of the vector, plus
+    float32 rounding of the decoded value.
+uint8:  (max - min) / (2 * 255), likewise.
+
+Zero is always stored exactly by float16, and by uint8 and uint16 when
+the vector has no negative values, as for counts.  Compression, with zstd
+or lz4, is lossless.
+"""
+import lz4.frame
+import numpy as np
+import zstandard
+
+# Raw little-endian float32, so that decoding is a single frombuffer call.
+VECTOR_DTYPE = np.dtype("<f4")
+
+FLOAT32 = "float32"
+FLOAT16 = "float16"
+UINT16 = "uint16"
+UINT8 = "uint8"
+PRECISION_LIST = [FLOAT32, FLOAT16, UINT16, UINT8]
+
+NONE = "none"
+ZSTD = "zstd"
+LZ4 = "lz4"
+COMPRESSION_LIST = [NONE, ZSTD, LZ4]
+
+# Stored dtype of each precision.
+DTYPE_MAP = {
+    FLOAT32: VECTOR_DTYPE,
+    FLOAT16: np.dtype("<f2"),
+    UINT16: np.dtype("<u2"),
+    UINT8: np.dtype("u1"),
+}
+
+# Quantized vectors start with their offset and scale, as float64.
+QUANTIZED_HEADER_DTYPE = np.dtype("<f8")
+QUANTIZED_HEADER_SIZE = 2 * QUANTIZED_HEADER_DTYPE.itemsize
+
+ENCODING_DELIM = "+"
+
+
+def get_encoding(precision=FLOAT32, compression=NONE):
+    """Get the encoding string for the specified options."""
+    if precision not in PRECISION_LIST:
+        raise ValueError(f"Unknown precision:  {precision}.")
+    if compression not in COMPRESSION_LIST:
+        raise ValueError(f"Unknown compression:  {compression}.")
+    if precision == FLOAT32 and compression == NONE:
+        return None
+    if compression == NONE:
+        return precision
+    return f"{precision}{ENCODING_DELIM}{compression}"
+
+
+def parse_encoding(encoding):
+    """Get the (precision, compression) pair of an encoding string."""
+    if encoding is None:
+        return FLOAT32, NONE
+    precision, _, compression = encoding.partition(ENCODING_DELIM)
+    return precision, compression or NONE
+
+
+def encode_vector(value_list, encoding=None):
+    """Encode the specified values, by default as raw float32 bytes."""
+    values = np.asarray(value_list, dtype=np.float64)
+    precision, compression = parse_encoding(encoding)
+    dtype = DTYPE_MAP[precision]
+    if precision in [UINT16, UINT8]:
+        blob = _quantize(values, dtype)
+    else:
+        if precision == FLOAT16 and np.any(
+            np.abs(values) > np.finfo(dtype).max
+        ):
+            raise ValueError("Values are out of range for float16.")
+        blob = values.astype(dtype).tobytes()
+    return _compress(blob, compression)
+
+
+def decode_vector(blob, encoding=None):
+    """Decode the specified bytes into a float32 NumPy array."""
+    if encoding is None:
+        return np.frombuffer(blob, dtype=VECTOR_DTYPE)
+    precision, compression = parse_encoding(encoding)
+    blob = _decompress(blob, compression)
+    dtype = DTYPE_MAP[precision]
+    if precision in [UINT16, UINT8]:
+        return _dequantize(blob, dtype)
+    return np.frombuffer(blob, dtype=dtype).astype(VECTOR_DTYPE)
+
+
+def get_max_error(value_list, encoding=None):
+    """Get the documented maximum absolute error of decoded values."""
+    values = np.asarray(value_list, dtype=np.float64)
+    precision, _ = parse_encoding(encoding)
+    if len(values) == 0 or precision == FLOAT32:
+        return 0.0
+    if precision == FLOAT16:
+        return float(np.abs(values).max()) * 2.0 ** -11 + 2.0 ** -25
+    levels = np.iinfo(DTYPE_MAP[precision]).max
+    rounding = float(np.abs(values).max()) * 2.0 ** -24
+    return float(values.max() - values.min()) / (2 * levels) + rounding
+
+
+def _quantize(values, dtype):
+    levels = np.iinfo(dtype).max
+    offset = float(values.min()) if len(values) > 0 else 0.0
+    value_range = float(values.max()) - offset if len(values) > 0 else 0.0
+    scale = value_range / levels if value_range > 0 else 1.0
+    codes = np.rint((values - offset) / scale)
+    codes = np.clip(codes, 0, levels).astype(dtype)
+    header = np.array([offset, scale], dtype=QUANTIZED_HEADER_DTYPE)
+    return header.tobytes() + codes.tobytes()
+
+
+def _dequantize(blob, dtype):
+    header = np.frombuffer(
+        blob[:QUANTIZED_HEADER_SIZE], dtype=QUANTIZED_HEADER_DTYPE
+    )
+    offset, scale = header
+    codes = np.frombuffer(blob[QUANTIZED_HEADER_SIZE:], dtype=dtype)
+    return (offset + codes * scale).astype(VECTOR_DTYPE)
+
+
+def _compress(blob, compression):
+    if compression == ZSTD:
+        return zstandard.ZstdCompressor().compress(blob)
+    elif compression == LZ4:
+        return lz4.frame.compress(blob)
+    return blob
+
+
+def _decompress(blob, compression):
+    if compression == ZSTD:
+        return zstandard.ZstdDecompressor().decompress(blob)
+    elif compression == LZ4:
+        return lz4.frame.decompress(blob)
+    return bytes(blob)
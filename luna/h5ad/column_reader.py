@@ -0,0 +1,82 @@
+"""Extract dense per-gene columns from an expression matrix."""
+import logging
+import numpy as np
+from scipy import sparse
+
+
+class ColumnReader:
+    """
+    Extract dense per-gene columns from an expression matrix.
+
+    In-memory dense matrices are sliced directly.  In-memory sparse
+    matrices are converted to CSC once, so that each column is extracted in
+    O(nnz of that column), instead of a full scan of a CSR matrix per gene.
+
+    Backed (on-disk) matrices are read in blocks of chunk_size columns, so
+    that peak memory is bounded by num_rows * chunk_size values.  On-disk
+    CSR matrices are walked in blocks of ROW_BLOCK_SIZE rows to assemble
+    each column block.
+    """
+
+    DEFAULT_CHUNK_SIZE = 256
+    ROW_BLOCK_SIZE = 10000
+
+    def __init__(self, x, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Create new ColumnReader for the specified matrix."""
+        if chunk_size < 1:
+            raise ValueError("Chunk size must be at least 1.")
+        self.num_rows = x.shape[0]
+        self.chunk_size = chunk_size
+        self.is_sparse = sparse.issparse(x)
+        self.is_backed = not (self.is_sparse or isinstance(x, np.ndarray))
+        if self.is_sparse:
+            if not sparse.isspmatrix_csc(x):
+                logging.info("Converting sparse matrix to CSC.")
+                x = x.tocsc()
+            x.sum_duplicates()
+        self.x = x
+        self.chunk_start = None
+        self.chunk = None
+
+    def get_column(self, index):
+        """Get the dense vector for the specified column."""
+        if self.is_backed:
+            return self._get_backed_column(index)
+        if not self.is_sparse:
+            return np.asarray(self.x[:, index]).ravel()
+
+        start = self.x.indptr[index]
+        end = self.x.indptr[index + 1]
+        column = np.zeros(self.num_rows, dtype=self.x.dtype)
+        column[self.x.indices[start:end]] = self.x.data[start:end]
+        return column
+
+    def _get_backed_column(self, index):
+        chunk_start = index - (index % self.chunk_size)
+        if chunk_start != self.chunk_start:
+            self.chunk = None
+            self.chunk = self._read_chunk(chunk_start)
+            self.chunk_start = chunk_start
+        return np.ascontiguousarray(self.chunk[:, index - chunk_start])
+
+    def _read_chunk(self, chunk_start):
+        chunk_end = min(chunk_start + self.chunk_size, self.x.shape[1])
+        logging.info(f"Reading columns {chunk_start}-{chunk_end} from disk.")
+
+        # Backed sparse matrices (anndata SparseDataset) expose format_str
+        format_str = getattr(self.x, "format_str", None)
+        if format_str is None:
+            return np.asarray(self.x[:, chunk_start:chunk_end])
+        if format_str == "csc":
+            return self.x[:, chunk_start:chunk_end].toarray()
+
+        chunk = np.zeros(
+            (self.num_rows, chunk_end - chunk_start), dtype=self.x.dtype
+        )
+        row_block_size = ColumnReader.ROW_BLOCK_SIZE
+        for row_start in range(0, self.num_rows, row_block_size):
+            row_end = min(row_start + row_block_size, self.num_rows)
+            row_block = self.x[row_start:row_end]
+            block = row_block[:, chunk_start:chunk_end]
+            chunk[row_start:row_end] = block.toarray()
+        return chunk
@@ -3,6 +3,7 @@ import warnings
 import anndata
 import numpy as np
 import logging
+from luna.h5ad.column_reader import ColumnReader
 
 
 class H5adDownSample:
@@ -38,11 +39,12 @@ class H5adDownSample:
         new_h5ad.write_h5ad(downsample_file_name)
 
     def _get_downsampled_x(self, x, gene_list, gene_index, num_rows):
+        column_reader = ColumnReader(x)
         new_x = []
         for gene in gene_list:
             index = gene_index[gene]
             logging.info(f"Extracting: {gene}, index={index}.")
-            new_x.append(x[0:num_rows, index])
+            new_x.append(column_reader.get_column(index)[0:num_rows])
         new_x = np.column_stack(new_x)
         return new_x
 
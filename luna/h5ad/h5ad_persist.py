@@ -1,14 +1,25 @@
 """Persist h5ad files to the database."""
 import warnings
 import anndata
+import math
+import uuid
 import os
+import time
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from sqlalchemy.orm import Session
 from luna.db.bucket import Bucket
+from luna.db.slug import SlugUtil
 from luna.db.db_util import DbConnection
+from luna.db.bulk_insert import BulkInsert
+from luna.db.generation import Generation
 from luna.db.cellular_annotation import CellularAnnotation
 from luna.db.cellular_annotation import CellularAnnotationType
+from luna.db.gene_statistics import GeneStatistics
 from luna.db.scatter_plot import ScatterPlot, ScatterPlotType
+from luna.db import vector
+from luna.h5ad.column_reader import ColumnReader
 
 
 class H5adDb:
@@ -17,12 +28,57 @@ class H5adDb:
     UMAP_KEY = "X_umap"
     TSNE_KEY = "X_tsne"
 
-    def __init__(self, slug, file_name, description, url, gene_list=[]):
+    # ORM mode adds and commits one gene at a time;  bulk mode writes
+    # batches of genes with COPY (PostgreSQL) or executemany.
+    ORM_MODE = "orm"
+    BULK_MODE = "bulk"
+    INGEST_MODES = [ORM_MODE, BULK_MODE]
+    DEFAULT_BATCH_SIZE = 500
+
+    def __init__(
+        self,
+        slug,
+        file_name,
+        description,
+        url,
+        gene_list=[],
+        ingest_mode=ORM_MODE,
+        batch_size=DEFAULT_BATCH_SIZE,
+        backed=False,
+        chunk_size=ColumnReader.DEFAULT_CHUNK_SIZE,
+        workers=1,
+        precision=vector.FLOAT32,
+        compression=vector.NONE,
+        correlation=False,
+    ):
         """
         Construct class with h5ad meta-data.
 
         If gene_list is empty, all genes will be imported.
+
+        If backed is True, the h5ad file is opened in read-only backed mode,
+        and the expression matrix is read from disk in blocks of chunk_size
+        genes, rather than loaded into memory up front.
+
+        If workers is greater than 1, genes are split into shards, and each
+        shard is read and inserted by its own process, with its own database
+        connection.
+
+        Gene expression vectors are stored at the specified precision,
+        optionally compressed;  see luna.db.vector for the maximum error of
+        each precision.
+
+        If correlation is True, standardized scores are stored for each
+        gene, for gene-gene correlation, at 2 bytes per cell.
         """
+        if ingest_mode not in H5adDb.INGEST_MODES:
+            raise ValueError(f"Unknown ingest mode:  {ingest_mode}.")
+        if batch_size < 1:
+            raise ValueError("Batch size must be at least 1.")
+        if workers < 1:
+            raise ValueError("Number of workers must be at least 1.")
+        self.value_encoding = vector.get_encoding(precision, compression)
+
         # Ignore Future Warnings from anndata
         warnings.simplefilter(action="ignore", category=FutureWarning)
 
@@ -32,8 +88,17 @@ class H5adDb:
         self.url = url
 
         self.file_name = os.path.basename(file_name)
-        self.adata = anndata.read_h5ad(file_name)
+        self.backed = backed
+        self.chunk_size = chunk_size
+        backed_mode = "r" if backed else None
+        self.adata = anndata.read_h5ad(file_name, backed=backed_mode)
         self.gene_list = gene_list
+        self.ingest_mode = ingest_mode
+        self.batch_size = batch_size
+        self.workers = workers
+        self.precision = precision
+        self.compression = compression
+        self.correlation = correlation
 
         # Set up the db connection and session
         self.db_connection = DbConnection()
@@ -41,29 +106,98 @@ class H5adDb:
         self.session = Session(bind=self.engine)
 
     def persist_to_database(self):
-        """Persist to the database."""
+        """
+        Persist to the database.
+
+        The bucket is hidden from the API until all of its data is loaded.
+        If a bucket with the same slug already exists, loading resumes:
+        only annotations, scatter plots and genes that are not yet in the
+        database are added.  This completes an interrupted load, or adds
+        new genes to a bucket that is already loaded.
+        """
         self._persist_bucket()
-        self._persist_annotations()
-        self._persist_scatter_plots()
-        self._persist_x()
+        try:
+            self._persist_annotations()
+            self._persist_scatter_plots()
+            self._resolve_gene_list()
+            self._persist_x()
+        finally:
+            if self.backed:
+                self.adata.file.close()
+        self._mark_bucket_ready()
+
+        # Signal API processes to refresh their cached metadata.
+        Generation.bump(self.session)
 
     def _persist_bucket(self):
-        logging.info(f"Persisting bucket: {self.file_name}.")
-        self.bucket = Bucket(self.slug, self.file_name, self.desc, self.url)
-        self.session.add(self.bucket)
+        self.bucket = self.session.query(Bucket).filter_by(slug=self.slug)
+        self.bucket = self.bucket.first()
+        if self.bucket is None:
+            logging.info(f"Persisting bucket: {self.file_name}.")
+            self.bucket = Bucket(
+                self.slug, self.file_name, self.desc, self.url
+            )
+            self.session.add(self.bucket)
+            self.session.commit()
+            logging.info(f"Got Bucket ID: {self.bucket.id}.")
+        elif self.bucket.name != self.file_name:
+            raise ValueError(
+                f"Bucket {self.slug} was loaded from {self.bucket.name}, "
+                f"not {self.file_name}."
+            )
+        else:
+            logging.info(
+                f"Resuming bucket: {self.bucket.id} ({self.bucket.status})."
+            )
+            self._remove_orphan_statistics()
+
+    def _remove_orphan_statistics(self):
+        # Bulk mode commits statistics just before their genes;  drop any
+        # left behind by an interrupted batch, so that it can be re-run.
+        gene_slug_list = self.session.query(CellularAnnotation.slug).filter_by(
+            bucket_id=self.bucket.id,
+            type=CellularAnnotationType.GENE_EXPRESSION,
+        )
+        self.session.query(GeneStatistics).filter_by(
+            bucket_id=self.bucket.id
+        ).filter(~GeneStatistics.slug.in_(gene_slug_list)).delete(
+            synchronize_session=False
+        )
+        self.session.commit()
+
+    def _mark_bucket_ready(self):
+        if self.bucket.status == Bucket.READY and len(self.gene_list) > 0:
+            # New genes were added to a loaded bucket;  the new version
+            # invalidates cached responses.
+            self.bucket.version = uuid.uuid4().hex
+        self.bucket.status = Bucket.READY
         self.session.commit()
-        logging.info(f"Got Bucket ID: {self.bucket.id}.")
+        logging.info(f"Bucket is ready: {self.bucket.id}.")
+
+    def _get_persisted_slugs(self, annotation_type):
+        record_list = self.session.query(CellularAnnotation.slug).filter_by(
+            bucket_id=self.bucket.id, type=annotation_type
+        )
+        return {record.slug for record in record_list}
 
     def _persist_annotations(self):
         # Annotations are in .obs
         # obs is a pandas dataframe
         obs = self.adata.obs
         column_list = obs.columns
+        persisted_set = self._get_persisted_slugs(CellularAnnotationType.OTHER)
+        slugger = SlugUtil()
         for column_name in column_list:
+            if slugger.sluggify(column_name) in persisted_set:
+                logging.info(f"Already persisted:  {column_name}.")
+                continue
             current_value_list = obs[column_name].to_list()
             current_value_set = set(current_value_list)
             if len(current_value_set) < 100:
                 logging.info(f"Persisting annotations:  {column_name}.")
+
+                # Distinct values are naturally sorted once, here, and
+                # stored as categories plus one integer code per cell.
                 current_annotation = CellularAnnotation(
                     column_name,
                     CellularAnnotationType.OTHER,
@@ -83,7 +217,12 @@ class H5adDb:
         self._persist_scatter_plot(obsm, H5adDb.TSNE_KEY, ScatterPlotType.TSNE)
 
     def _persist_scatter_plot(self, obsm, obsm_key, scatter_plot_type):
-        if obsm_key in obsm:
+        persisted_count = (
+            self.session.query(ScatterPlot)
+            .filter_by(bucket_id=self.bucket.id, type=scatter_plot_type)
+            .count()
+        )
+        if obsm_key in obsm and persisted_count == 0:
             logging.info(f"Persisting: {obsm_key}.")
             scatter_plot = ScatterPlot(
                 scatter_plot_type, obsm[obsm_key], self.bucket.id
@@ -91,31 +230,144 @@ class H5adDb:
             self.session.add(scatter_plot)
             self.session.commit()
 
+    def _resolve_gene_list(self):
+        # Gene symbols are in .var
+        if self.gene_list is None or len(self.gene_list) == 0:
+            self.gene_list = self.adata.var.index
+        self.gene_list = self._remove_duplicate_genes(self.gene_list)
+
+        # Genes are committed one at a time (ORM mode) or one batch at a
+        # time (bulk mode);  skip any already committed.
+        persisted_set = self._get_persisted_slugs(
+            CellularAnnotationType.GENE_EXPRESSION
+        )
+        slugger = SlugUtil()
+        num_genes = len(self.gene_list)
+        self.gene_list = [
+            gene
+            for gene in self.gene_list
+            if slugger.sluggify(gene) not in persisted_set
+        ]
+        if len(self.gene_list) < num_genes:
+            logging.info(
+                f"Already persisted {num_genes - len(self.gene_list)} of "
+                f"{num_genes} genes."
+            )
+
     def _persist_x(self):
         # Expression matrix is in .X
         # Gene symbols are in .var
-        x = self.adata.X
+        if len(self.gene_list) == 0:
+            return
         var = self.adata.var
-        rows = x.shape[0]
 
         gene_index = self._create_gene_index_lookup(var)
 
-        if self.gene_list is None or len(self.gene_list) == 0:
-            self.gene_list = var.index
+        # Genes are persisted in column order, so that each chunk of a
+        # backed matrix is read once, and each shard is a contiguous run.
+        # Genes missing from .var sort last, and fail when reached.
+        num_columns = len(gene_index)
+        self.gene_list.sort(key=lambda gene: gene_index.get(gene, num_columns))
+
+        start_time = time.time()
+        if self.workers > 1:
+            # Workers open the file themselves;  a reader here would only
+            # add a CSC copy of an in-memory sparse X to the parent.
+            self._persist_x_parallel()
+        elif self.ingest_mode == H5adDb.BULK_MODE:
+            column_reader = ColumnReader(self.adata.X, self.chunk_size)
+            self._persist_x_bulk(column_reader, gene_index)
+        else:
+            column_reader = ColumnReader(self.adata.X, self.chunk_size)
+            self._persist_x_orm(column_reader, gene_index)
+        elapsed = time.time() - start_time
+        logging.info(
+            f"Persisted {len(self.gene_list)} genes in {elapsed:.2f} seconds "
+            f"({self.ingest_mode} mode, {self.workers} workers)."
+        )
 
+    def _persist_x_parallel(self):
+        # Shards are contiguous runs of columns, so that each worker reads
+        # the matrix sequentially.
+        gene_list = self.gene_list
+        shard_size = max(1, math.ceil(len(gene_list) / self.workers))
+        shard_list = []
+        for start in range(0, len(gene_list), shard_size):
+            end = start + shard_size
+            shard = dict(
+                file_name=self.h5ad_file_name,
+                bucket_id=self.bucket.id,
+                gene_list=gene_list[start:end],
+                ingest_mode=self.ingest_mode,
+                batch_size=self.batch_size,
+                chunk_size=self.chunk_size,
+                precision=self.precision,
+                compression=self.compression,
+                correlation=self.correlation,
+            )
+            shard_list.append(shard)
+        with ProcessPoolExecutor(
+            max_workers=len(shard_list), mp_context=get_context("spawn")
+        ) as executor:
+            for num_genes in executor.map(_persist_shard, shard_list):
+                logging.info(f"Committed shard of {num_genes} genes.")
+
+    def _persist_x_orm(self, column_reader, gene_index):
         for current_gene in self.gene_list:
-            index = gene_index[current_gene]
-            logging.info(f"Persisting: {current_gene}, index={index}.")
-            slice = x[0:rows, index]
-            current_annotation = CellularAnnotation(
-                current_gene,
-                CellularAnnotationType.GENE_EXPRESSION,
-                slice,
-                self.bucket.id,
+            current_annotation, current_stats = self._create_gene_records(
+                column_reader, gene_index, current_gene
             )
             self.session.add(current_annotation)
+            self.session.add(current_stats)
             self.session.commit()
 
+    def _persist_x_bulk(self, column_reader, gene_index):
+        bulk_insert = BulkInsert(self.engine, CellularAnnotation.__table__)
+        stats_insert = BulkInsert(self.engine, GeneStatistics.__table__)
+        for start in range(0, len(self.gene_list), self.batch_size):
+            end = start + self.batch_size
+            batch = self.gene_list[start:end]
+            record_list = [
+                self._create_gene_records(column_reader, gene_index, gene)
+                for gene in batch
+            ]
+            stats_insert.insert([record[1] for record in record_list])
+            bulk_insert.insert([record[0] for record in record_list])
+            logging.info(f"Committed batch of {len(batch)} genes.")
+
+    def _create_gene_records(self, column_reader, gene_index, current_gene):
+        # Statistics are computed from the same column as the vector, so
+        # that X is only read once.
+        index = gene_index[current_gene]
+        logging.info(f"Persisting: {current_gene}, index={index}.")
+        column = column_reader.get_column(index)
+        current_annotation = CellularAnnotation(
+            current_gene,
+            CellularAnnotationType.GENE_EXPRESSION,
+            column,
+            self.bucket.id,
+            self.value_encoding,
+        )
+        current_stats = GeneStatistics(
+            current_gene, column, self.bucket.id, self.correlation
+        )
+        return current_annotation, current_stats
+
+    def _remove_duplicate_genes(self, gene_list):
+        # Genes are unique per bucket by slug;  keep the first of any genes
+        # whose names differ only in case or punctuation.
+        slugger = SlugUtil()
+        slug_set = set()
+        unique_list = []
+        for gene in gene_list:
+            slug = slugger.sluggify(gene)
+            if slug in slug_set:
+                logging.warning(f"Skipping duplicate gene:  {gene}.")
+            else:
+                slug_set.add(slug)
+                unique_list.append(gene)
+        return unique_list
+
     def _create_gene_index_lookup(self, var):
         gene_index = {}
         index_counter = 0
@@ -123,3 +375,29 @@ class H5adDb:
             gene_index[gene] = index_counter
             index_counter += 1
         return gene_index
+
+
+def _persist_shard(shard):
+    # Runs in a worker process, with its own file handle and connection.
+    logging.info(f"Persisting shard of {len(shard['gene_list'])} genes.")
+    h5ad = H5adDb(
+        None,
+        shard["file_name"],
+        None,
+        None,
+        shard["gene_list"],
+        ingest_mode=shard["ingest_mode"],
+        batch_size=shard["batch_size"],
+        backed=True,
+        chunk_size=shard["chunk_size"],
+        precision=shard["precision"],
+        compression=shard["compression"],
+        correlation=shard["correlation"],
+    )
+    try:
+        h5ad.bucket = h5ad.session.query(Bucket).get(shard["bucket_id"])
+        h5ad._persist_x()
+    finally:
+        h5ad.adata.file.close()
+        h5ad.session.close()
+    return len(shard["gene_list"])
@@ -1,17 +1,31 @@
 """Tests for the Luna API."""
+import asyncio
+import os
+import statistics
+import time
+from urllib.parse import urlencode
+import httpx
 import pytest
-from fastapi import HTTPException
+import numpy as np
+from fastapi.testclient import TestClient
+from scipy.stats import spearmanr
+from sqlalchemy import event
 from luna.api import api
 from luna.h5ad.h5ad_persist import H5adDb
 from luna.vignette.vignette_persist import VignetteDb
+from luna.db.bucket import Bucket
 from luna.db.db_util import DbConnection
 from luna.db import cellular_annotation as ann
 from luna.db import scatter_plot as sca
+from luna.db.generation import Generation
+from luna.db.vector import get_max_error
 
 
 BUCKET_SLUG = "tabula_muris_mini"
 BUCKET_SLUG_DOES_NOT_EXIST = "hello_world"
 
+client = TestClient(api.app)
+
 
 @pytest.fixture()
 def load_sample_data_and_vignettes():
@@ -30,7 +44,7 @@ def load_sample_data_no_vignettes():
     _load_sample_data()
 
 
-def _load_sample_data():
+def _load_sample_data(**kwargs):
     db_connection = DbConnection()
     db_connection.reset_database()
     slug = "tabula_muris_mini"
@@ -38,9 +52,12 @@ def _load_sample_data():
     gene_list = ["Egfr", "P2ry12", "Serpina1c"]
     description = "Mini h5ad test file"
     url = "http://mini-h5ad-test-file.com"
-    h5ad = H5adDb(slug, file_name, description, url, gene_list)
+    h5ad = H5adDb(slug, file_name, description, url, gene_list, **kwargs)
     h5ad.persist_to_database()
 
+    # Do not wait for the cache to notice the new generation.
+    api.metadata_cache.invalidate()
+
 
 def test_api(load_sample_data_and_vignettes):
     """Test the Luna API with Vignettes."""
@@ -55,8 +72,7 @@ def test_api(load_sample_data_and_vignettes):
 
 def test_api_no_vignettes(load_sample_data_no_vignettes):
     """Test the Luna API without Vignettes."""
-    with pytest.raises(HTTPException):
-        api.get_vignettes(BUCKET_SLUG)
+    assert client.get(f"/vignettes/{BUCKET_SLUG}").status_code == 404
 
 
 def test_api_no_annotations(load_sample_data_and_vignettes):
@@ -64,98 +80,750 @@ def test_api_no_annotations(load_sample_data_and_vignettes):
     db_connection = DbConnection()
     session = db_connection.session
     session.query(ann.CellularAnnotation).delete()
-    session.query(sca.ScatterPlot.coordinate_list).delete()
-    session.query(sca.ScatterPlot.coordinate_list).delete()
+    session.query(sca.ScatterPlot).delete()
+    session.commit()
+    Generation.bump(session)
+    session.close()
+    api.metadata_cache.invalidate()
+    res = client.get(f"/annotation_list/{BUCKET_SLUG}")
+    assert res.status_code == 404
+    assert client.get(f"/umap/{BUCKET_SLUG}").status_code == 404
+    assert client.get(f"/tsne/{BUCKET_SLUG}").status_code == 404
+
+
+def test_shared_db_pool(load_sample_data_no_vignettes):
+    """Test that all requests share a single engine and connection pool."""
+    client.get("/buckets")
+    db_pool = api.db_pool
+    assert db_pool is not None
+    client.get(f"/umap/{BUCKET_SLUG}")
+    assert api.db_pool is db_pool
+
+    # Startup and shutdown events create and dispose of the shared pool.
+    with TestClient(api.app) as scoped_client:
+        assert scoped_client.get("/buckets").status_code == 200
+    assert api.db_pool is None
+
+
+def test_api_etags(load_sample_data_no_vignettes):
+    """Test ETags, 304 responses and the response cache."""
+    api.response_cache.clear()
+    for path in [
+        f"/umap/{BUCKET_SLUG}",
+        f"/tsne/{BUCKET_SLUG}",
+        f"/expression/{BUCKET_SLUG}/Egfr",
+        f"/annotation/{BUCKET_SLUG}/tissue",
+    ]:
+        res = client.get(path)
+        assert res.status_code == 200
+        etag = res.headers["etag"]
+        assert etag.startswith('"')
+        assert "must-revalidate" in res.headers["cache-control"]
+
+        res = client.get(path, headers={"If-None-Match": etag})
+        assert res.status_code == 304
+        assert res.content == b""
+        assert res.headers["etag"] == etag
+
+        res = client.get(path, headers={"If-None-Match": '"other"'})
+        assert res.status_code == 200
+        assert res.headers["etag"] == etag
+    assert len(api.response_cache.entry_map) == 4
+
+    # Errors are not cached.
+    assert client.get(f"/expression/{BUCKET_SLUG}/Pten").status_code == 404
+    assert len(api.response_cache.entry_map) == 4
+
+    # Re-loading the bucket stamps a new version, and so a new ETag.
+    res = client.get(f"/umap/{BUCKET_SLUG}")
+    _load_sample_data()
+    res2 = client.get(f"/umap/{BUCKET_SLUG}")
+    assert res2.headers["etag"] != res.headers["etag"]
+
+
+def test_api_annotation_whitespace(load_sample_data_no_vignettes):
+    """Test that distinct values match the stored categories exactly."""
+    session = DbConnection().session
+    bucket_id = session.query(Bucket.id).filter_by(slug=BUCKET_SLUG).scalar()
+    value_list = ["b", " b", "a10", "a2"] * 25
+    other_type = ann.CellularAnnotationType.OTHER
+    record = ann.CellularAnnotation("pad", other_type, value_list, bucket_id)
+    session.add(record)
+    session.commit()
+    Generation.bump(session)
+    session.close()
+    api.metadata_cache.invalidate()
+
+    path = f"/annotation/{BUCKET_SLUG}/pad"
+    res = client.get(path).json()
+    codes = client.get(path, params={"format": "codes"}).json()
+    assert res["values_distinct"] == codes["categories"]
+    assert res["values_distinct"] == [" b", "a2", "a10", "b"]
+    assert set(res["values_ordered"]) == set(res["values_distinct"])
+
+
+def test_api_binary(load_sample_data_no_vignettes):
+    """Test the binary wire format, via content negotiation."""
+    binary = {"Accept": "application/octet-stream"}
+    res = client.get(f"/expression/{BUCKET_SLUG}/Egfr", headers=binary)
+    assert res.headers["content-type"] == "application/octet-stream"
+    assert res.headers["x-luna-shape"] == "100"
+    assert res.headers["x-luna-dtype"] == "float32-le"
+    assert float(res.headers["x-luna-max-expression"]) == pytest.approx(
+        7.354609
+    )
+    values = np.frombuffer(res.content, dtype="<f4")
+    json_res = client.get(f"/expression/{BUCKET_SLUG}/Egfr").json()
+    json_values = np.array(json_res["values_ordered"], dtype="<f4")
+    assert np.array_equal(values, json_values)
+
+    res = client.get(f"/umap/{BUCKET_SLUG}", headers=binary)
+    assert res.headers["x-luna-shape"] == "100,2"
+    coordinates = np.frombuffer(res.content, dtype="<f4").reshape(-1, 2)
+    assert coordinates[0][0] == pytest.approx(-0.437479)
+    assert coordinates[0][1] == pytest.approx(13.087562)
+    assert "Accept" in res.headers["vary"]
+
+    # JSON is the default, and wins when preferred or listed first.
+    for accept in [
+        None,
+        "*/*",
+        "application/json, application/octet-stream",
+        "application/octet-stream;q=0.5, application/json",
+    ]:
+        headers = {"Accept": accept} if accept else {}
+        res = client.get(f"/umap/{BUCKET_SLUG}", headers=headers)
+        assert res.headers["content-type"] == "application/json"
+        assert len(res.json()) == 100
+
+    # Binary and JSON representations have distinct ETags.
+    json_etag = client.get(f"/tsne/{BUCKET_SLUG}").headers["etag"]
+    res = client.get(f"/tsne/{BUCKET_SLUG}", headers=binary)
+    assert res.headers["etag"] != json_etag
+
+
+def test_api_binary_cors(load_sample_data_no_vignettes):
+    """Test that cross-origin clients may read the binary format headers."""
+    headers = {
+        "Accept": "application/octet-stream",
+        "Origin": "http://luna-frontend.example",
+    }
+    res = client.get(f"/expression/{BUCKET_SLUG}/Egfr", headers=headers)
+    assert res.headers["access-control-allow-origin"] == "*"
+    exposed = res.headers["access-control-expose-headers"].split(",")
+    exposed_set = {header.strip().lower() for header in exposed}
+    assert exposed_set >= {
+        "etag",
+        "x-luna-shape",
+        "x-luna-dtype",
+        "x-luna-max-expression",
+        "x-luna-genes",
+        "x-luna-missing",
+    }
+
+
+def test_api_expression_matrix(load_sample_data_no_vignettes):
+    """Test the multi-gene expression matrix endpoint."""
+    path = f"/expression_matrix/{BUCKET_SLUG}"
+    res = client.get(path, params={"genes": "Egfr,Pten,P2ry12,egfr"}).json()
+    assert res["genes"] == ["egfr", "p2ry12"]
+    assert res["missing"] == ["pten"]
+    assert len(res["values"]) == 2
+    assert len(res["values"][0]) == 100
+    assert res["max_expression"][0] == pytest.approx(7.354609)
+
+    single = client.get(f"/expression/{BUCKET_SLUG}/P2ry12").json()
+    assert res["values"][1] == single["values_ordered"]
+    assert res["max_expression"][1] == single["max_expression"]
+
+    binary = {"Accept": "application/octet-stream"}
+    params = {"genes": "Egfr,Pten,P2ry12"}
+    res = client.get(path, params=params, headers=binary)
+    assert res.headers["x-luna-shape"] == "2,100"
+    assert res.headers["x-luna-genes"] == "egfr,p2ry12"
+    assert res.headers["x-luna-missing"] == "pten"
+    matrix = np.frombuffer(res.content, dtype="<f4").reshape(2, 100)
+    single_values = np.array(single["values_ordered"], dtype="<f4")
+    assert np.array_equal(matrix[1], single_values)
+
+    # Binary responses list genes in headers, so they take fewer genes.
+    genes = ",".join(f"gene{i}" for i in range(api.MAX_BINARY_GENES + 1))
+    res = client.get(path, params={"genes": genes}, headers=binary)
+    assert res.status_code == 400
+    assert len(client.get(path, params={"genes": genes}).json()["missing"]) > 0
+
+    # All genes missing is not an error;  no genes at all is.
+    res = client.get(path, params={"genes": "Pten"}).json()
+    assert res["genes"] == []
+    assert res["missing"] == ["pten"]
+    assert client.get(path, params={"genes": " , "}).status_code == 400
+    assert client.get(path).status_code == 422
+    path = f"/expression_matrix/{BUCKET_SLUG_DOES_NOT_EXIST}"
+    assert client.get(path, params={"genes": "Egfr"}).status_code == 404
+
+
+def test_api_gene_search(load_sample_data_no_vignettes):
+    """Test gene search, and rejection of unknown genes."""
+    path = f"/genes/{BUCKET_SLUG}"
+    assert client.get(path, params={"q": "egfr"}).json() == ["egfr"]
+    assert client.get(path, params={"q": "P2"}).json() == ["p2ry12"]
+    assert client.get(path, params={"q": "r"}).json() == [
+        "p2ry12",
+        "serpina1c",
+        "egfr",
+    ]
+    assert client.get(path, params={"q": "r", "limit": 1}).json() == [
+        "p2ry12"
+    ]
+    assert client.get(path, params={"q": "pten"}).json() == []
+    assert client.get(path, params={"q": ""}).status_code == 422
+    path = f"/genes/{BUCKET_SLUG_DOES_NOT_EXIST}"
+    assert client.get(path, params={"q": "egfr"}).status_code == 404
+
+
+def test_api_scatter_plot_view(load_sample_data_no_vignettes):
+    """Test level-of-detail viewport queries."""
+    full = client.get(f"/umap/{BUCKET_SLUG}").json()
+    res = client.get(f"/umap/{BUCKET_SLUG}/view").json()
+    assert res["total"] == 100
+    assert sorted(res["indices"]) == list(range(100))
+    first = res["coordinates"][res["indices"].index(0)]
+    assert first["x"] == pytest.approx(full[0]["x"], abs=1e-5)
+    assert first["y"] == pytest.approx(full[0]["y"], abs=1e-5)
+
+    params = {"x_min": 0, "y_min": 0, "limit": 5}
+    res = client.get(f"/tsne/{BUCKET_SLUG}/view", params=params).json()
+    full = client.get(f"/tsne/{BUCKET_SLUG}").json()
+    inside = [i for i, c in enumerate(full) if c["x"] >= 0 and c["y"] >= 0]
+    assert res["total"] == len(inside)
+    assert len(res["indices"]) == 5
+    assert set(res["indices"]) <= set(inside)
+
+    # The decoded LOD index is reused, without reading the coordinate list.
+    statement_list = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statement_list.append(statement)
+
+    engine = api.db_pool.engine.sync_engine
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        api.response_cache.clear()
+        client.get(f"/tsne/{BUCKET_SLUG}/view", params=params)
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+    assert not any("scatter_plot" in s for s in statement_list)
+
+    path = f"/umap/{BUCKET_SLUG}/view"
+    assert client.get(path, params={"limit": 0}).status_code == 422
+    path = f"/umap/{BUCKET_SLUG_DOES_NOT_EXIST}/view"
+    assert client.get(path).status_code == 404
+
+
+def test_api_correlated_genes(load_sample_data_no_vignettes):
+    """Test the top-k correlated genes endpoint."""
+    path = f"/expression/{BUCKET_SLUG}/Egfr/correlated"
+    res = client.get(path)
+    assert res.status_code == 404
+    assert "--correlation" in res.json()["detail"]
+
+    _load_sample_data(correlation=True)
+    res = client.get(path).json()
+    assert res["gene"] == "egfr"
+    assert res["method"] == "pearson"
+    assert sorted(res["genes"]) == ["p2ry12", "serpina1c"]
+    assert res["correlations"] == sorted(res["correlations"], reverse=True)
+
+    egfr = client.get(f"/expression/{BUCKET_SLUG}/Egfr").json()
+    for gene, correlation in zip(res["genes"], res["correlations"]):
+        other = client.get(f"/expression/{BUCKET_SLUG}/{gene}").json()
+        target = np.corrcoef(egfr["values_ordered"], other["values_ordered"])
+        assert correlation == pytest.approx(target[0, 1], abs=1e-3)
+
+    params = {"method": "spearman", "limit": 1}
+    res = client.get(path, params=params).json()
+    assert res["method"] == "spearman"
+    assert len(res["genes"]) == 1
+    other = client.get(f"/expression/{BUCKET_SLUG}/{res['genes'][0]}").json()
+    target = spearmanr(egfr["values_ordered"], other["values_ordered"])
+    assert res["correlations"][0] == pytest.approx(target[0], abs=1e-5)
+
+    # Indexes are kept by bucket version, not by the metadata cache.
+    session = DbConnection().session
+    record = session.query(Bucket).filter_by(slug=BUCKET_SLUG).one()
+    bucket_id, bucket_version = record.id, record.version
+    session.close()
+    api.metadata_cache.invalidate()
+    cache = api.correlation_index_cache
+    assert cache.get(bucket_id, bucket_version, "pearson") is not None
+    file_name = cache.get_file_name(bucket_id, bucket_version, "pearson")
+    assert os.path.exists(file_name)
+
+    assert client.get(path, params={"method": "kendall"}).status_code == 422
+    assert client.get(path, params={"limit": 0}).status_code == 422
+    path = f"/expression/{BUCKET_SLUG}/Pten/correlated"
+    assert client.get(path).status_code == 404
+
+
+def test_api_stats_skip_scores(load_sample_data_no_vignettes):
+    """Test that gene statistics are served without reading scores."""
+    client.get("/buckets")
+    statement_list = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statement_list.append(statement)
+
+    engine = api.db_pool.engine.sync_engine
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        api.response_cache.clear()
+        res = client.get(f"/expression/{BUCKET_SLUG}/Egfr/stats")
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+    assert res.status_code == 200
+    assert any("gene_statistics" in s for s in statement_list)
+    assert not any("_blob" in s for s in statement_list)
+
+
+def test_api_grouped_stats(load_sample_data_no_vignettes):
+    """Test expression statistics of a gene, split by cell type."""
+    path = f"/expression/{BUCKET_SLUG}/Egfr/by/cell_ontology_class"
+    res = client.get(path)
+    assert res.status_code == 200
+    grouped = res.json()
+    assert grouped["gene"] == "egfr"
+    assert grouped["annotation"] == "cell_ontology_class"
+
+    expression = client.get(f"/expression/{BUCKET_SLUG}/Egfr").json()
+    path = f"/annotation/{BUCKET_SLUG}/cell_ontology_class"
+    annotation = client.get(path).json()
+    values = np.array(expression["values_ordered"], dtype=np.float32)
+    labels = np.array(annotation["values_ordered"])
+    assert grouped["categories"] == annotation["values_distinct"]
+    assert sum(grouped["num_cells"]) == len(values)
+    for i, category in enumerate(grouped["categories"]):
+        group_values = values[labels == category]
+        assert grouped["num_cells"][i] == len(group_values)
+        assert grouped["mean"][i] == pytest.approx(group_values.mean())
+        assert grouped["q50"][i] == pytest.approx(np.median(group_values))
+        assert np.float32(grouped["max"][i]) == group_values.max()
+
+    # Results are cached per bucket version.
+    etag = res.headers["etag"]
+    headers = {"If-None-Match": etag}
+    path = f"/expression/{BUCKET_SLUG}/Egfr/by/cell_ontology_class"
+    assert client.get(path, headers=headers).status_code == 304
+
+    for path in [
+        f"/expression/{BUCKET_SLUG}/Pten/by/cell_ontology_class",
+        f"/expression/{BUCKET_SLUG}/Egfr/by/egfr",
+        f"/expression/{BUCKET_SLUG}/Egfr/by/no_such_annotation",
+        f"/expression/{BUCKET_SLUG_DOES_NOT_EXIST}/Egfr/by/cell_type",
+    ]:
+        assert client.get(path).status_code == 404
+
+
+def test_api_quantized(load_sample_data_no_vignettes):
+    """Test transparent decoding of quantized, compressed expression."""
+    binary = {"Accept": "application/octet-stream"}
+    path = f"/expression/{BUCKET_SLUG}/Egfr"
+    full = client.get(path).json()
+    params = {"genes": "Egfr,P2ry12"}
+    matrix_path = f"/expression_matrix/{BUCKET_SLUG}"
+    full_matrix = client.get(matrix_path, params=params, headers=binary)
+
+    db_connection = DbConnection()
+    db_connection.reset_database()
+    h5ad = H5adDb(
+        BUCKET_SLUG,
+        "examples/tabula-muris-mini.h5ad",
+        "Mini h5ad test file",
+        "http://mini-h5ad-test-file.com",
+        ["Egfr", "P2ry12", "Serpina1c"],
+        precision="uint16",
+        compression="lz4",
+    )
+    h5ad.persist_to_database()
+    api.metadata_cache.invalidate()
+
+    res = client.get(path).json()
+    max_error = get_max_error(full["values_ordered"], "uint16+lz4")
+    assert res["values_ordered"] == pytest.approx(
+        full["values_ordered"], abs=max_error
+    )
+    assert res["max_expression"] == full["max_expression"]
+
+    res = client.get(matrix_path, params=params, headers=binary)
+    assert res.headers["x-luna-shape"] == "2,100"
+    matrix = np.frombuffer(res.content, dtype="<f4").reshape(2, -1)
+    full_matrix = np.frombuffer(full_matrix.content, dtype="<f4")
+    for values, full_values in zip(matrix, full_matrix.reshape(2, -1)):
+        max_error = get_max_error(full_values, "uint16+lz4")
+        assert np.abs(values - full_values).max() <= max_error
+
+
+def test_api_dot_plot(load_sample_data_no_vignettes):
+    """Test the dot plot aggregation endpoint."""
+    path = f"/dot_plot/{BUCKET_SLUG}/tissue"
+    params = {"genes": "Serpina1c,Egfr,Pten"}
+    res = client.get(path, params=params)
+    assert res.status_code == 200
+    dot_plot = res.json()
+    assert dot_plot["annotation"] == "tissue"
+    assert dot_plot["genes"] == ["serpina1c", "egfr"]
+    assert dot_plot["missing"] == ["pten"]
+    assert sum(dot_plot["num_cells"]) == 100
+    num_categories = len(dot_plot["categories"])
+    assert len(dot_plot["mean"]) == 2
+    assert len(dot_plot["mean"][0]) == num_categories
+
+    # Each row matches the grouped statistics of that gene.
+    for gene, mean, fraction_nonzero in zip(
+        dot_plot["genes"], dot_plot["mean"], dot_plot["fraction_nonzero"]
+    ):
+        grouped_path = f"/expression/{BUCKET_SLUG}/{gene}/by/tissue"
+        grouped = client.get(grouped_path).json()
+        assert grouped["categories"] == dot_plot["categories"]
+        assert mean == pytest.approx(grouped["mean"], rel=1e-5)
+        target = grouped["fraction_nonzero"]
+        assert fraction_nonzero == pytest.approx(target)
+
+    res = client.get(path, params={"genes": "Pten"}).json()
+    assert res["genes"] == []
+    assert res["mean"] == []
+
+    etag = client.get(path, params=params).headers["etag"]
+    headers = {"If-None-Match": etag}
+    assert client.get(path, params=params, headers=headers).status_code == 304
+
+    path = f"/dot_plot/{BUCKET_SLUG}/egfr"
+    assert client.get(path, params=params).status_code == 404
+    path = f"/dot_plot/{BUCKET_SLUG_DOES_NOT_EXIST}/tissue"
+    assert client.get(path, params=params).status_code == 404
+
+
+def test_api_cell_filter(load_sample_data_no_vignettes):
+    """Test filtering of vector endpoints by annotation categories."""
+    path = f"/annotation/{BUCKET_SLUG}/tissue"
+    tissue_list = client.get(path).json()["values_ordered"]
+    path = f"/annotation/{BUCKET_SLUG}/mouse_sex"
+    sex_list = client.get(path).json()["values_ordered"]
+    target = [
+        i
+        for i, (tissue, sex) in enumerate(zip(tissue_list, sex_list))
+        if tissue in ["Lung", "Heart"] and sex == "F"
+    ]
+    assert len(target) > 0
+    params = {"filter": "tissue:Lung|Heart;mouse_sex:F"}
+
+    res = client.get(f"/expression/{BUCKET_SLUG}/Egfr", params=params).json()
+    assert res["indices"] == target
+    full = client.get(f"/expression/{BUCKET_SLUG}/Egfr").json()
+    assert "indices" not in full
+    target_values = [full["values_ordered"][i] for i in target]
+    assert res["values_ordered"] == target_values
+    assert res["max_expression"] == full["max_expression"]
+
+    # Filtered responses are JSON, even if binary is preferred.
+    binary = {"Accept": "application/octet-stream"}
+    path = f"/expression/{BUCKET_SLUG}/Egfr"
+    res = client.get(path, params=params, headers=binary)
+    assert res.headers["content-type"] == "application/json"
+
+    res = client.get(f"/umap/{BUCKET_SLUG}", params=params).json()
+    full = client.get(f"/umap/{BUCKET_SLUG}").json()
+    assert res["indices"] == target
+    assert res["coordinates"] == [full[i] for i in target]
+    columns = dict(params, layout="columns")
+    res = client.get(f"/tsne/{BUCKET_SLUG}", params=columns).json()
+    assert res["indices"] == target
+    assert len(res["x"]) == len(res["y"]) == len(target)
+
+    path = f"/annotation/{BUCKET_SLUG}/tissue"
+    res = client.get(path, params=params).json()
+    assert res["indices"] == target
+    assert set(res["values_ordered"]) <= {"Lung", "Heart"}
+    codes = dict(params, format="codes")
+    res = client.get(path, params=codes).json()
+    assert len(res["codes"]) == len(target)
+
+    path = f"/expression/{BUCKET_SLUG}/Egfr"
+    for filter_str in ["tissue", "organ:Lung", "tissue:Moon"]:
+        res = client.get(path, params={"filter": filter_str})
+        assert res.status_code == 400
+
+
+def test_api_columnar_layout(load_sample_data_no_vignettes):
+    """Test the opt-in columnar layout of scatter plot coordinates."""
+    rows = client.get(f"/umap/{BUCKET_SLUG}").json()
+    params = {"layout": "columns"}
+    res = client.get(f"/umap/{BUCKET_SLUG}", params=params).json()
+    assert res["x"] == [c["x"] for c in rows]
+    assert res["y"] == [c["y"] for c in rows]
+    assert np.float32(res["x"][0]) == np.float32(-0.437479)
+
+    params = {"layout": "columns", "x_min": 0, "y_min": 0, "limit": 5}
+    res = client.get(f"/tsne/{BUCKET_SLUG}/view", params=params).json()
+    assert len(res["indices"]) == len(res["x"]) == len(res["y"]) == 5
+    assert "coordinates" not in res
+    assert all(x >= 0 for x in res["x"])
+
+    params = {"layout": "diagonal"}
+    res = client.get(f"/umap/{BUCKET_SLUG}", params=params)
+    assert res.status_code == 422
+
+
+def test_api_metrics(load_sample_data_no_vignettes):
+    """Test request metrics, per route, bucket and stage."""
+    api.metrics.reset()
+    api.response_cache.clear()
+    assert client.get(f"/expression/{BUCKET_SLUG}/Egfr").status_code == 200
+    res = client.get(f"/expression/{BUCKET_SLUG_DOES_NOT_EXIST}/Egfr")
+    assert res.status_code == 404
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    route = 'route="/expression/{bucket_slug}/{gene}"'
+    assert (
+        f'luna_requests_total{{{route},bucket="{BUCKET_SLUG}",'
+        'method="GET",status="200"} 1'
+    ) in res.text
+    assert (
+        f'luna_requests_total{{{route},bucket="",method="GET",'
+        'status="404"} 1'
+    ) in res.text
+    assert f'luna_response_size_bytes_count{{{route},bucket="' in res.text
+    for stage in ["db", "decode", "serialize"]:
+        line = f'luna_stage_duration_seconds_count{{{route},stage="{stage}"}}'
+        assert f"{line} 1" in res.text
+
+    # Requests rejected before the bucket is looked up add no bucket series.
+    res = client.get("/umap/unknown0", params={"layout": "bad"})
+    assert res.status_code == 422
+    assert client.get("/genes/unknown1").status_code == 422
+    res = client.get("/metrics")
+    assert "unknown" not in res.text
+    assert 'route="/umap/{bucket_slug}",bucket="",method="GET"' in res.text
+    res = client.get(f"/umap/{BUCKET_SLUG}", params={"layout": "bad"})
+    assert res.status_code == 422
+    res = client.get("/metrics")
+    assert f'/umap/{{bucket_slug}}",bucket="{BUCKET_SLUG}"' in res.text
+
+
+def test_api_concurrency(load_sample_data_no_vignettes, monkeypatch):
+    """Test that small requests stay fast while large transfers run."""
+    gene_list = _add_large_genes(num_genes=100, num_cells=100000)
+    monkeypatch.setattr(api.response_cache, "max_bytes", 0)
+    baseline_list, latency_list, num_large = asyncio.run(
+        _run_concurrently(gene_list, num_samples=200)
+    )
+
+    # Small requests are served while the large transfers are in flight,
+    # with a tail latency within a few times that of the same request with
+    # no load.
+    assert len(latency_list) == 200
+    assert num_large >= 8
+    assert _get_p95(latency_list) < 5 * _get_p95(baseline_list)
+
+
+def _get_p95(latency_list):
+    return statistics.quantiles(latency_list, n=20, method="inclusive")[-1]
+
+
+def _add_large_genes(num_genes, num_cells):
+    db_connection = DbConnection()
+    session = db_connection.session
+    bucket_id = session.query(Bucket.id).filter_by(slug=BUCKET_SLUG).scalar()
+    random = np.random.default_rng(0)
+    gene_list = []
+    for index in range(num_genes):
+        gene = f"large{index}"
+        values = random.random(num_cells)
+        target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+        record = ann.CellularAnnotation(gene, target_type, values, bucket_id)
+        session.add(record)
+        gene_list.append(gene)
     session.commit()
     session.close()
-    with pytest.raises(HTTPException):
-        api.get_annotation_list(BUCKET_SLUG)
-    with pytest.raises(HTTPException):
-        api.get_umap_coordinates(BUCKET_SLUG)
-    with pytest.raises(HTTPException):
-        api.get_tsne_coordinates(BUCKET_SLUG)
+    api.metadata_cache.invalidate()
+    return gene_list
+
+
+async def _run_concurrently(gene_list, num_samples, num_clients=8):
+    path = f"/expression_matrix/{BUCKET_SLUG}"
+    query = {"genes": ",".join(gene_list)}
+    num_bytes = len(gene_list) * 100000 * 4
+    async with httpx.AsyncClient(app=api.app, base_url="http://luna") as ac:
+        # Warm up, then time a small request with no load, for comparison.
+        assert await _get_streamed(path, query) == (200, num_bytes)
+        baseline_list = []
+        await _time_small_requests(ac, baseline_list, num_samples)
+
+        # Keep large transfers running until enough samples are taken.
+        latency_list = []
+
+        async def get_large():
+            num_large = 0
+            while len(latency_list) < num_samples:
+                response = await _get_streamed(path, query)
+                assert response == (200, num_bytes)
+                num_large += 1
+            return num_large
+
+        large_task = asyncio.gather(*[get_large() for _ in range(num_clients)])
+        await _time_small_requests(ac, latency_list, num_samples)
+        num_large = sum(await large_task)
+        return baseline_list, latency_list, num_large
+
+
+async def _time_small_requests(ac, latency_list, num_samples):
+    for _ in range(num_samples):
+        start = time.perf_counter()
+        res = await ac.get("/buckets")
+        assert res.status_code == 200
+        latency_list.append(time.perf_counter() - start)
+
+
+async def _get_streamed(path, query):
+    # Call the app directly, counting streamed body bytes as they are sent,
+    # as a server would;  the httpx test transport joins each body on the
+    # event loop.
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": urlencode(query).encode(),
+        "headers": [
+            (b"host", b"luna"),
+            (b"accept", api.BINARY_MEDIA_TYPE.encode()),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("luna", 80),
+    }
+    response = {"status": None, "num_bytes": 0}
+    request_list = [{"type": "http.request", "body": b""}]
+    complete = asyncio.Event()
+
+    async def receive():
+        if len(request_list) > 0:
+            return request_list.pop()
+        await complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        else:
+            response["num_bytes"] += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                complete.set()
+
+    await api.app(scope, receive, send)
+    return response["status"], response["num_bytes"]
 
 
 def _verify_buckets():
-    res = api.get_buckets()
+    res = client.get("/buckets").json()
     assert len(res) == 1
     bucket0 = res[0]
-    assert bucket0.name == "tabula-muris-mini.h5ad"
-    assert bucket0.slug == "tabula_muris_mini"
-    assert bucket0.description == "Mini h5ad test file"
-    assert bucket0.url == "http://mini-h5ad-test-file.com"
+    assert bucket0["name"] == "tabula-muris-mini.h5ad"
+    assert bucket0["slug"] == "tabula_muris_mini"
+    assert bucket0["description"] == "Mini h5ad test file"
+    assert bucket0["url"] == "http://mini-h5ad-test-file.com"
 
 
 def _verify_annotation_list():
-    res = api.get_annotation_list(BUCKET_SLUG)
+    res = client.get(f"/annotation_list/{BUCKET_SLUG}").json()
     assert len(res) == 9
-    assert res[0].label == "cell_ontology_class"
-    assert res[1].label == "clusters_from_manuscript"
+    assert res[0]["label"] == "cell_ontology_class"
+    assert res[1]["label"] == "clusters_from_manuscript"
 
-    with pytest.raises(HTTPException):
-        res = api.get_annotation_list(BUCKET_SLUG_DOES_NOT_EXIST)
+    res = client.get(f"/annotation_list/{BUCKET_SLUG_DOES_NOT_EXIST}")
+    assert res.status_code == 404
 
 
 def _verify_annotation_values():
-    res = api.get_annotation_values(BUCKET_SLUG, "cell_ontology_class")
+    res = client.get(f"/annotation/{BUCKET_SLUG}/cell_ontology_class").json()
 
-    values_distinct = res.values_distinct
+    values_distinct = res["values_distinct"]
     assert len(values_distinct) == 37
     assert values_distinct[0] == "astrocyte"
     assert values_distinct[1] == "B cell"
 
-    values_list = res.values_ordered
+    values_list = res["values_ordered"]
     assert len(values_list) == 100
     assert values_list[0] == "epidermal cell"
     assert values_list[1] == "endothelial cell"
 
-    with pytest.raises(HTTPException):
-        res = api.get_annotation_values(BUCKET_SLUG_DOES_NOT_EXIST, "XXX")
+    path = f"/annotation/{BUCKET_SLUG}/cell_ontology_class"
+    res = client.get(path, params={"format": "codes"}).json()
+    assert res["categories"] == values_distinct
+    assert res["dtype"] == "uint8"
+    assert len(res["codes"]) == 100
+    assert [res["categories"][code] for code in res["codes"]] == values_list
+    assert client.get(path, params={"format": "xml"}).status_code == 422
 
-    with pytest.raises(HTTPException):
-        res = api.get_annotation_values(BUCKET_SLUG, "XXXX")
+    res = client.get(f"/annotation/{BUCKET_SLUG_DOES_NOT_EXIST}/XXX")
+    assert res.status_code == 404
+
+    res = client.get(f"/annotation/{BUCKET_SLUG}/XXXX")
+    assert res.status_code == 404
 
 
 def _verify_expression_data():
-    res = api.get_expression_values(BUCKET_SLUG, "Egfr")
+    res = client.get(f"/expression/{BUCKET_SLUG}/Egfr").json()
 
-    assert res.max_expression == 7.354609
+    assert res["max_expression"] == pytest.approx(7.354609)
 
-    values_list = res.values_ordered
+    values_list = res["values_ordered"]
     assert len(values_list) == 100
-    assert values_list[0] == 0.6931472
-    assert values_list[1] == 0.6931472
+    assert values_list[0] == pytest.approx(0.6931472)
+    assert values_list[1] == pytest.approx(0.6931472)
+
+    res = client.get(f"/expression/{BUCKET_SLUG_DOES_NOT_EXIST}/Egfr")
+    assert res.status_code == 404
 
-    with pytest.raises(HTTPException):
-        res = api.get_expression_values(BUCKET_SLUG_DOES_NOT_EXIST, "Egfr")
+    res = client.get(f"/expression/{BUCKET_SLUG}/Pten")
+    assert res.status_code == 404
 
-    with pytest.raises(HTTPException):
-        res = api.get_expression_values(BUCKET_SLUG, "Pten")
+    res = client.get(f"/expression/{BUCKET_SLUG}/Egfr/stats").json()
+    assert res["gene"] == "egfr"
+    assert res["num_cells"] == 100
+    assert res["max"] == pytest.approx(7.354609)
+    assert res["min"] <= res["q25"] <= res["q50"] <= res["q75"] <= res["max"]
+    assert 0.0 < res["fraction_nonzero"] <= 1.0
+    res = client.get(f"/expression/{BUCKET_SLUG}/Pten/stats")
+    assert res.status_code == 404
 
 
 def _verify_umap():
-    res = api.get_umap_coordinates("tabula_muris_mini")
+    res = client.get("/umap/tabula_muris_mini").json()
     assert len(res) == 100
-    assert res[0].x == -0.437479
-    assert res[0].y == 13.087562
+    assert np.float32(res[0]["x"]) == np.float32(-0.437479)
+    assert np.float32(res[0]["y"]) == np.float32(13.087562)
 
-    with pytest.raises(HTTPException):
-        res = api.get_umap_coordinates("hello")
+    assert client.get("/umap/hello").status_code == 404
 
 
 def _verify_tsne():
-    res = api.get_tsne_coordinates(BUCKET_SLUG)
+    res = client.get(f"/tsne/{BUCKET_SLUG}").json()
     assert len(res) == 100
-    assert res[0].x == -43.720875
-    assert res[0].y == -48.974918
+    assert np.float32(res[0]["x"]) == np.float32(-43.720875)
+    assert np.float32(res[0]["y"]) == np.float32(-48.974918)
 
-    with pytest.raises(HTTPException):
-        res = api.get_tsne_coordinates(BUCKET_SLUG_DOES_NOT_EXIST)
+    res = client.get(f"/tsne/{BUCKET_SLUG_DOES_NOT_EXIST}")
+    assert res.status_code == 404
 
 
 def _verify_vignettes():
-    res = api.get_vignettes(BUCKET_SLUG)
-    assert res.body.startswith(b'{"bucket_slug":')
+    res = client.get(f"/vignettes/{BUCKET_SLUG}")
+    assert res.content.startswith(b'{"bucket_slug":')
 
-    with pytest.raises(HTTPException):
-        res = api.get_vignettes(BUCKET_SLUG_DOES_NOT_EXIST)
+    res = client.get(f"/vignettes/{BUCKET_SLUG_DOES_NOT_EXIST}")
+    assert res.status_code == 404
@@ -0,0 +1,18 @@
+"""Tests for Bitmap Indexes."""
+import numpy as np
+from luna.db.bitmap import build_bitmaps, decode_bitmaps, get_indices
+
+
+def test_bitmaps():
+    """Test that each bitmap holds exactly the cells in its category."""
+    codes = np.array([0, 2, 1, 2, 0, 0, 2, 1, 1, 2], dtype=np.uint8)
+    bitmaps = build_bitmaps(codes, 4)
+    assert bitmaps.shape == (4, 2)
+    assert get_indices(bitmaps[0]).tolist() == [0, 4, 5]
+    assert get_indices(bitmaps[2]).tolist() == [1, 3, 6, 9]
+    assert get_indices(bitmaps[3]).tolist() == []
+
+    decoded = decode_bitmaps(bitmaps.tobytes(), 4)
+    assert np.array_equal(decoded, bitmaps)
+    union = bitmaps[0] | bitmaps[1]
+    assert get_indices(union).tolist() == [0, 2, 4, 5, 7, 8]
@@ -0,0 +1,88 @@
+"""Tests for Bulk Insert."""
+import os
+import pytest
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import OperationalError
+from luna.db.bulk_insert import BulkInsert
+from luna.db.bucket import Bucket
+from luna.db.db_util import DbConnection
+from luna.db.gene_statistics import GeneStatistics
+from luna.db import cellular_annotation as ann
+
+
+@pytest.fixture()
+def postgres_db():
+    """Fixture for a clean PostgreSQL database, or skip if not available."""
+    db_connect_str = os.getenv(
+        "LUNA_DB_CONNECT", DbConnection.DEFAULT_DB_CONNECT_STR
+    )
+    if make_url(db_connect_str).get_backend_name() != "postgresql":
+        pytest.skip("LUNA_DB_CONNECT is not a PostgreSQL database.")
+    try:
+        db_connection = DbConnection()
+        db_connection.reset_database()
+    except (ImportError, OperationalError) as error:
+        pytest.skip(f"PostgreSQL is not available:  {error}")
+    yield db_connection
+    db_connection.session.close()
+
+
+def test_copy_fields():
+    """Test encoding of values in the PostgreSQL COPY text format."""
+    bulk_insert = BulkInsert(None, ann.CellularAnnotation.__table__)
+    assert "id" not in bulk_insert.column_list
+    assert bulk_insert._to_copy_field(None) == "\\N"
+    assert bulk_insert._to_copy_field(42) == "42"
+    assert bulk_insert._to_copy_field(b"\x00\xff") == "\\\\x00ff"
+    target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+    assert bulk_insert._to_copy_field(target_type) == "GENE_EXPRESSION"
+    assert bulk_insert._to_copy_field("a\tb\nc\\d") == "a\\tb\\nc\\\\d"
+
+
+def test_copy_round_trip(postgres_db):
+    """Test that rows copied into PostgreSQL read back unchanged."""
+    session = postgres_db.session
+    bucket = Bucket("copy", "Copy")
+    session.add(bucket)
+    session.commit()
+    bucket_id = bucket.id
+
+    gene_type = ann.CellularAnnotationType.GENE_EXPRESSION
+    other_type = ann.CellularAnnotationType.OTHER
+    annotation_list = [
+        ann.CellularAnnotation("Egfr", gene_type, [0.0, 1.5, 1e-7], bucket_id),
+        ann.CellularAnnotation("a\tb", other_type, ["x\ny", "z\\"], bucket_id),
+    ]
+    stats_list = [
+        GeneStatistics("Egfr", [0.0, 1.5, 1e-7], bucket_id, correlation=True),
+        GeneStatistics("Pten", [0.1, 0.2, 1 / 3], bucket_id),
+    ]
+    BulkInsert(postgres_db.engine, ann.CellularAnnotation.__table__).insert(
+        annotation_list
+    )
+    BulkInsert(postgres_db.engine, GeneStatistics.__table__).insert(
+        stats_list
+    )
+
+    for table, expected_list in [
+        (ann.CellularAnnotation.__table__, annotation_list),
+        (GeneStatistics.__table__, stats_list),
+    ]:
+        bulk_insert = BulkInsert(postgres_db.engine, table)
+        with postgres_db.engine.connect() as connection:
+            row_list = connection.execute(
+                table.select().order_by(table.c.id)
+            ).all()
+        assert len(row_list) == len(expected_list)
+        for row, expected in zip(row_list, expected_list):
+            for name in bulk_insert.column_list:
+                value = row._mapping[name]
+                if isinstance(value, memoryview):
+                    value = bytes(value)
+                assert value == getattr(expected, name), name
+
+    record = session.query(GeneStatistics).filter_by(slug="pten").one()
+    assert record.pearson_blob is None
+    assert record.q99 == stats_list[1].q99
+    record = session.query(ann.CellularAnnotation).filter_by(type=other_type)
+    assert record.one().get_categories() == ["x\ny", "z\\"]
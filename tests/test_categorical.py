@@ -0,0 +1,24 @@
+"""Tests for Categorical Encoding."""
+import numpy as np
+from luna.db.categorical import encode_categories, decode_codes
+
+
+def test_encode_categories():
+    """Test natural sort order of categories, and round trip of codes."""
+    value_list = ["cluster 10", "B cell", "cluster 2", "B cell", "b cell"]
+    category_list, codes = encode_categories(value_list)
+    assert category_list == ["B cell", "b cell", "cluster 2", "cluster 10"]
+    assert codes.dtype == np.uint8
+    assert [category_list[code] for code in codes] == value_list
+
+    decoded = decode_codes(codes.tobytes(), len(category_list))
+    assert np.array_equal(decoded, codes)
+
+
+def test_encode_many_categories():
+    """Test that codes widen when there are more than 256 categories."""
+    category_list, codes = encode_categories(range(300))
+    assert len(category_list) == 300
+    assert category_list[0:3] == ["0", "1", "2"]
+    assert codes.dtype == np.dtype("<u2")
+    assert codes[299] == 299
@@ -0,0 +1,49 @@
+"""Tests for Cell Filters."""
+import numpy as np
+import pytest
+from luna.api.cell_filter import CellFilter
+from luna.db.bitmap import build_bitmaps
+
+TISSUE_LIST = ["Liver", "Lung", "Skin"]
+CELL_TYPE_LIST = ["B cell", "T cell"]
+
+
+def get_bitmap_map():
+    """Get bitmaps for 6 cells, over two annotations."""
+    tissue_codes = np.array([0, 1, 1, 2, 0, 1])
+    cell_type_codes = np.array([0, 0, 1, 0, 1, 0])
+    return {
+        "tissue": (TISSUE_LIST, build_bitmaps(tissue_codes, 3)),
+        "cell_type": (CELL_TYPE_LIST, build_bitmaps(cell_type_codes, 2)),
+    }
+
+
+def test_cell_filter():
+    """Test OR within a clause, and AND across clauses."""
+    bitmap_map = get_bitmap_map()
+    cell_filter = CellFilter("tissue:Lung")
+    assert cell_filter.get_slug_list() == ["tissue"]
+    assert cell_filter.get_indices(bitmap_map).tolist() == [1, 2, 5]
+
+    cell_filter = CellFilter("tissue:Lung|Liver")
+    assert cell_filter.get_indices(bitmap_map).tolist() == [0, 1, 2, 4, 5]
+
+    cell_filter = CellFilter("Tissue:Lung|Liver;cell_type:B cell")
+    assert cell_filter.get_slug_list() == ["tissue", "cell_type"]
+    assert cell_filter.get_indices(bitmap_map).tolist() == [0, 1, 5]
+
+    cell_filter = CellFilter("tissue:Skin;cell_type:T cell")
+    assert cell_filter.get_indices(bitmap_map).tolist() == []
+
+
+def test_cell_filter_errors():
+    """Test malformed filters, and unknown annotations or categories."""
+    for filter_str in ["", "tissue", "tissue:", ":Lung", "tissue:Lung|"]:
+        with pytest.raises(ValueError):
+            CellFilter(filter_str)
+
+    bitmap_map = get_bitmap_map()
+    with pytest.raises(ValueError):
+        CellFilter("organ:Lung").get_indices(bitmap_map)
+    with pytest.raises(ValueError):
+        CellFilter("tissue:lung").get_indices(bitmap_map)
@@ -0,0 +1,53 @@
+"""Tests for Column Reader."""
+import warnings
+import anndata
+import numpy as np
+from scipy import sparse
+from luna.h5ad.column_reader import ColumnReader
+
+
+def test_dense_and_sparse_columns():
+    """Test that sparse and dense matrices yield identical columns."""
+    dense = np.array(
+        [[0.0, 1.5, 0.0], [2.5, 0.0, 0.0], [0.0, 3.5, 0.0], [4.5, 0.0, 0.0]],
+        dtype=np.float32,
+    )
+    dense_reader = ColumnReader(dense)
+    assert not dense_reader.is_sparse
+
+    for matrix in [sparse.csr_matrix(dense), sparse.csc_matrix(dense)]:
+        sparse_reader = ColumnReader(matrix)
+        assert sparse_reader.is_sparse
+        for index in range(dense.shape[1]):
+            dense_column = dense_reader.get_column(index)
+            sparse_column = sparse_reader.get_column(index)
+            assert sparse_column.dtype == dense_column.dtype
+            assert sparse_column.tobytes() == dense_column.tobytes()
+
+
+def test_backed_columns(tmp_path, monkeypatch):
+    """Test that backed matrices, read in chunks, yield identical columns."""
+    warnings.simplefilter(action="ignore", category=FutureWarning)
+    adata = anndata.read_h5ad("examples/tabula-muris-mini.h5ad")
+    dense_reader = ColumnReader(adata.X)
+
+    # Force several row blocks for on-disk CSR matrices
+    monkeypatch.setattr(ColumnReader, "ROW_BLOCK_SIZE", 7)
+
+    dense_x = adata.X
+    for format_str in ["dense", "csr", "csc"]:
+        if format_str == "csr":
+            adata.X = sparse.csr_matrix(dense_x)
+        elif format_str == "csc":
+            adata.X = sparse.csc_matrix(dense_x)
+        file_name = str(tmp_path / f"mini-{format_str}.h5ad")
+        adata.write_h5ad(file_name)
+
+        backed = anndata.read_h5ad(file_name, backed="r")
+        backed_reader = ColumnReader(backed.X, chunk_size=2)
+        assert backed_reader.is_backed
+        for index in [0, 2, 1]:
+            dense_column = dense_reader.get_column(index)
+            backed_column = backed_reader.get_column(index)
+            assert backed_column.tobytes() == dense_column.tobytes()
+        backed.file.close()
@@ -0,0 +1,46 @@
+"""Tests for Standardized Correlation Scores."""
+import numpy as np
+import pytest
+from scipy.stats import spearmanr
+from luna.db.correlation import (
+    PEARSON,
+    SPEARMAN,
+    get_scores,
+    encode_scores,
+    decode_scores,
+)
+
+
+def test_correlation_scores():
+    """Test that the mean product of scores is the correlation."""
+    rng = np.random.default_rng(0)
+    values1 = rng.gamma(1.0, size=500)
+    values2 = values1 + rng.normal(size=500)
+    values2[values2 < 0] = 0
+
+    scores1 = get_scores(values1, PEARSON)
+    scores2 = get_scores(values2, PEARSON)
+    target = np.corrcoef(values1, values2)[0, 1]
+    assert np.mean(scores1 * scores2) == pytest.approx(target)
+
+    scores1 = get_scores(values1, SPEARMAN)
+    scores2 = get_scores(values2, SPEARMAN)
+    target = spearmanr(values1, values2).correlation
+    assert np.mean(scores1 * scores2) == pytest.approx(target)
+
+    # Half precision keeps about three decimal places.
+    decoded1 = decode_scores(encode_scores(values1, PEARSON))
+    decoded2 = decode_scores(encode_scores(values2, PEARSON))
+    assert decoded1.dtype == np.float16
+    target = np.corrcoef(values1, values2)[0, 1]
+    product = decoded1.astype(np.float32) * decoded2.astype(np.float32)
+    assert np.mean(product) == pytest.approx(target, abs=1e-3)
+
+
+def test_correlation_scores_constant():
+    """Test that constant and empty vectors have zero scores."""
+    assert get_scores([0, 0, 0], PEARSON).tolist() == [0, 0, 0]
+    assert get_scores([2, 2], SPEARMAN).tolist() == [0, 0]
+    assert len(get_scores([], PEARSON)) == 0
+    with pytest.raises(ValueError):
+        get_scores([1, 2], "kendall")
@@ -0,0 +1,96 @@
+"""Tests for the Correlation Index."""
+import os
+import numpy as np
+import pytest
+from luna.api.correlation_index import CorrelationIndex
+from luna.api.correlation_index import CorrelationIndexCache
+from luna.api.correlation_index import CorrelationIndexWriter
+from luna.api.correlation_index import INDEX_DTYPE
+from luna.db.correlation import PEARSON, get_scores
+
+
+def _write_index(file_name, value_list):
+    writer = CorrelationIndexWriter(file_name, len(value_list))
+    writer.append([get_scores(v, PEARSON) for v in value_list])
+    writer.close()
+
+
+def test_correlation_index_search(tmp_path):
+    """Test ranking, limits and self exclusion of correlated genes."""
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=200)
+    value_map = {
+        "a": base,
+        "b": base + rng.normal(scale=0.1, size=200),
+        "c": base + rng.normal(scale=1.0, size=200),
+        "d": -base,
+        "e": np.ones(200),
+    }
+    gene_list = sorted(value_map)
+    file_name = str(tmp_path / "1-v1-pearson.npy")
+    _write_index(file_name, [value_map[g] for g in gene_list])
+    assert os.listdir(tmp_path) == ["1-v1-pearson.npy"]
+    correlation_index = CorrelationIndex(file_name, gene_list)
+    assert correlation_index.matrix.dtype == INDEX_DTYPE
+    assert len(correlation_index) == 5
+    assert "a" in correlation_index
+    assert "z" not in correlation_index
+
+    top_list, correlations = correlation_index.search("a", 10)
+    assert top_list == ["b", "c", "e", "d"]
+    target = np.corrcoef(value_map["a"], value_map["b"])[0, 1]
+    assert correlations[0] == pytest.approx(target, abs=1e-5)
+    assert correlations[2] == 0
+    assert correlations[3] == pytest.approx(-1, abs=1e-5)
+
+    top_list, correlations = correlation_index.search("a", 1)
+    assert top_list == ["b"]
+    assert len(correlations) == 1
+
+
+def test_correlation_index_single_gene(tmp_path):
+    """Test that a lone gene has no correlated genes."""
+    file_name = str(tmp_path / "1-v1-pearson.npy")
+    _write_index(file_name, [[1, 2, 3]])
+    correlation_index = CorrelationIndex(file_name, ["a"])
+    top_list, correlations = correlation_index.search("a", 5)
+    assert top_list == []
+    assert len(correlations) == 0
+
+
+def test_correlation_index_stale(tmp_path):
+    """Test that files without one row per gene are rejected."""
+    file_name = str(tmp_path / "1-v1-pearson.npy")
+    _write_index(file_name, [[1, 2, 3], [3, 2, 1]])
+    with pytest.raises(ValueError):
+        CorrelationIndex(file_name, ["a", "b", "c"])
+
+    # Files written at half precision, by earlier versions, are rebuilt.
+    np.save(file_name, np.zeros((2, 3), dtype=np.float16))
+    with pytest.raises(ValueError):
+        CorrelationIndex(file_name, ["a", "b"])
+
+    writer = CorrelationIndexWriter(file_name, 3)
+    writer.append([get_scores([1, 2, 3], PEARSON)])
+    with pytest.raises(ValueError):
+        writer.close()
+    assert os.listdir(tmp_path) == ["1-v1-pearson.npy"]
+
+
+def test_correlation_index_cache(tmp_path):
+    """Test that new bucket versions replace earlier entries and files."""
+    cache = CorrelationIndexCache(str(tmp_path))
+    for bucket_id, version in [(1, "v1"), (1, "v2"), (11, "v1")]:
+        file_name = cache.get_file_name(bucket_id, version, PEARSON)
+        _write_index(file_name, [[1, 2, 3], [3, 2, 1]])
+        correlation_index = CorrelationIndex(file_name, ["a", "b"])
+        cache.put(bucket_id, version, PEARSON, correlation_index)
+    assert cache.get(1, "v1", PEARSON) is None
+    assert cache.get(1, "v2", PEARSON) is not None
+    assert cache.get(11, "v1", PEARSON) is not None
+
+    cache.remove_stale_files(1, "v2", PEARSON)
+    assert sorted(os.listdir(tmp_path)) == [
+        "1-v2-pearson.npy",
+        "11-v1-pearson.npy",
+    ]
@@ -0,0 +1,146 @@
+"""Tests for Database Migration."""
+import pytest
+import numpy as np
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from luna.db.bucket import Bucket
+from luna.db.db_util import DbConnection
+from luna.db.db_migrate import DbMigration
+from luna.db.gene_statistics import GeneStatistics
+from luna.db.correlation import PEARSON, get_scores, decode_scores
+from luna.db.bitmap import get_indices
+from luna.db.vector import decode_vector
+from luna.db import cellular_annotation as ann
+from luna.db import scatter_plot as sca
+
+
+@pytest.fixture()
+def reset_db():
+    """Fixture to ensure each test starts with a clean slate database."""
+    db_connection = DbConnection()
+    db_connection.reset_database()
+
+
+def test_migrate_expression_vectors(reset_db):
+    """Test conversion of legacy text vectors to binary float32."""
+    db_connection = DbConnection()
+    session = db_connection.session
+    bucket = Bucket("bucket1", "bucket_description", "http://bucket.com")
+    session.add(bucket)
+    session.commit()
+
+    # Simulate a gene expression vector written by an earlier version.
+    target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+    legacy = ann.CellularAnnotation("Egfr", target_type, [], bucket.id)
+    legacy.value_list = "0.6931472|4.1136827|0.0"
+    legacy.value_blob = None
+    session.add(legacy)
+    session.commit()
+    session.close()
+
+    # Run twice to verify that migration is safe to re-run.
+    DbMigration().migrate()
+    DbMigration().migrate()
+
+    session = DbConnection().session
+    record = session.query(ann.CellularAnnotation).filter_by(slug="egfr")
+    record = record.first()
+    assert record.value_list is None
+    values = decode_vector(record.value_blob)
+    target = np.array([0.6931472, 4.1136827, 0.0], dtype=np.float32)
+    assert np.array_equal(values, target)
+
+    # Statistics are computed for genes loaded without them.
+    stats = session.query(GeneStatistics).filter_by(slug="egfr").one()
+    assert stats.max_value == pytest.approx(4.1136827)
+    assert stats.num_cells == 3
+    assert stats.pearson_blob is None
+
+    # Correlation scores are computed only on request.
+    session.close()
+    DbMigration(correlation=True).migrate()
+    session = DbConnection().session
+    stats = session.query(GeneStatistics).filter_by(slug="egfr").one()
+    scores = decode_scores(stats.pearson_blob)
+    assert np.allclose(scores, get_scores(target, PEARSON), atol=1e-3)
+    session.close()
+
+
+def test_migrate_categorical_annotations(reset_db):
+    """Test conversion of legacy text annotations to categories and codes."""
+    session = DbConnection().session
+    bucket = Bucket("bucket1", "bucket_description", "http://bucket.com")
+    session.add(bucket)
+    session.commit()
+    target_type = ann.CellularAnnotationType.OTHER
+    legacy = ann.CellularAnnotation("Tissue", target_type, [], bucket.id)
+    legacy.value_list = "Lung|Kidney|Lung"
+    legacy.category_list = None
+    legacy.code_blob = None
+    legacy.bitmap_blob = None
+    session.add(legacy)
+    session.commit()
+    session.close()
+
+    DbMigration().migrate()
+
+    session = DbConnection().session
+    record = session.query(ann.CellularAnnotation).first()
+    assert record.value_list is None
+    assert record.get_categories() == ["Kidney", "Lung"]
+    assert record.get_codes().tolist() == [1, 0, 1]
+
+    # Bitmap indexes are built for annotations loaded without them.
+    bitmaps = record.get_bitmaps()
+    assert get_indices(bitmaps[0]).tolist() == [1]
+    assert get_indices(bitmaps[1]).tolist() == [0, 2]
+    session.close()
+
+
+def test_migrate_lod_indexes(reset_db):
+    """Test building of LOD indexes for legacy scatter plots."""
+    session = DbConnection().session
+    bucket = Bucket("bucket1", "bucket_description", "http://bucket.com")
+    session.add(bucket)
+    session.commit()
+    coordinates = [[0.0, 1.0], [2.0, 3.0], [4.0, 5.0]]
+    legacy = sca.ScatterPlot(sca.ScatterPlotType.UMAP, coordinates, bucket.id)
+    legacy.lod_order = None
+    legacy.lod_coordinates = None
+    session.add(legacy)
+    session.commit()
+    session.close()
+
+    DbMigration().migrate()
+
+    session = DbConnection().session
+    record = session.query(sca.ScatterPlot).first()
+    lod_order = np.frombuffer(record.lod_order, dtype="<i4")
+    assert sorted(lod_order.tolist()) == [0, 1, 2]
+    session.close()
+
+
+def test_migrate_indexes(reset_db):
+    """Test creation of composite indexes on an existing database."""
+    engine = DbConnection().engine
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_scatter_plot_bucket_type"))
+
+    DbMigration().migrate()
+
+    index_list = inspect(engine).get_indexes("scatter_plot")
+    index_map = {index["name"]: index for index in index_list}
+    index = index_map["ix_scatter_plot_bucket_type"]
+    assert index["column_names"] == ["bucket_id", "type"]
+    assert index["unique"]
+
+
+def test_unique_annotations(reset_db):
+    """Test that each bucket holds at most one annotation per slug."""
+    session = DbConnection().session
+    target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+    session.add(ann.CellularAnnotation("Egfr", target_type, [1.0], 1))
+    session.add(ann.CellularAnnotation("EGFR", target_type, [2.0], 1))
+    with pytest.raises(IntegrityError):
+        session.commit()
+    session.close()
@@ -0,0 +1,49 @@
+"""Tests for the shared DB Pool."""
+import asyncio
+from sqlalchemy import func, select
+from luna.db.bucket import Bucket
+from luna.db.db_util import DbConnection, DbPool
+
+
+def test_db_pool(monkeypatch):
+    """Test the shared engine, pool settings and sessions."""
+    DbConnection().drop_database()
+    monkeypatch.setenv("LUNA_DB_POOL_PRE_PING", "false")
+    monkeypatch.setenv("LUNA_DB_POOL_RECYCLE", "60")
+    db_pool = DbPool()
+    pool_args = db_pool._pool_args()
+    assert pool_args["pool_pre_ping"] is False
+    assert pool_args["pool_recycle"] == 60
+
+    # The database and tables are created once, then sessions are cheap.
+    db_pool.prepare_database()
+    db_pool.prepare_database()
+    asyncio.run(_verify_sessions(db_pool))
+
+
+def test_db_pool_async_url(monkeypatch):
+    """Test the async driver derived from the connection string."""
+    monkeypatch.delenv("LUNA_DB_CONNECT_ASYNC", raising=False)
+    monkeypatch.setenv("LUNA_DB_CONNECT", "postgresql+psycopg2://@host/luna")
+    db_pool = DbPool()
+    assert db_pool.async_db_url.drivername == "postgresql+asyncpg"
+    assert db_pool.async_db_url.database == "luna"
+
+    monkeypatch.setenv("LUNA_DB_CONNECT", "sqlite:////tmp/luna.db")
+    assert DbPool().async_db_url.drivername == "sqlite+aiosqlite"
+
+    async_url = "postgresql+asyncpg://@other/luna"
+    monkeypatch.setenv("LUNA_DB_CONNECT_ASYNC", async_url)
+    assert DbPool().async_db_url.host == "other"
+
+
+async def _verify_sessions(db_pool):
+    async with db_pool.create_session() as session:
+        session.add(Bucket("bucket1", "bucket_description", "http://a.com"))
+        await session.commit()
+
+    async with db_pool.create_session() as session:
+        result = await session.execute(select(func.count(Bucket.id)))
+        assert result.scalar() == 1
+        assert session.bind is db_pool.engine
+    await db_pool.dispose()
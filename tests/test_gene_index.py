@@ -0,0 +1,25 @@
+"""Tests for the Gene Index."""
+from luna.api.gene_index import GeneIndex
+
+
+def test_gene_index_contains():
+    """Test membership checks."""
+    gene_index = GeneIndex(["serpina1c", "egfr", "p2ry12"])
+    assert len(gene_index) == 3
+    assert "egfr" in gene_index
+    assert "egf" not in gene_index
+    assert "zzz" not in gene_index
+    assert "egfr" not in GeneIndex([])
+
+
+def test_gene_index_search():
+    """Test ranking and limits of search results."""
+    gene_list = ["cd4", "cd44", "cd8a", "acd", "ccd4", "egfr", "abcd4"]
+    gene_index = GeneIndex(gene_list)
+    assert gene_index.search("cd4") == ["cd4", "cd44", "ccd4", "abcd4"]
+    target = ["cd4", "cd44", "cd8a", "acd", "ccd4", "abcd4"]
+    assert gene_index.search("CD") == target
+    assert gene_index.search("cd", limit=2) == ["cd4", "cd44"]
+    assert gene_index.search("cd4", limit=3) == ["cd4", "cd44", "ccd4"]
+    assert gene_index.search(" ") == []
+    assert gene_index.search("xyz") == []
@@ -0,0 +1,27 @@
+"""Tests for Gene Statistics."""
+import pytest
+from luna.db.gene_statistics import GeneStatistics
+
+
+def test_gene_statistics():
+    """Test numeric statistics over a vector of expression values."""
+    values = [0.0, 10.2, 9.5, 0.0, 4.0]
+    stats = GeneStatistics("Egfr", values, 1)
+    assert stats.slug == "egfr"
+    assert stats.num_cells == 5
+    assert stats.min_value == 0.0
+    assert stats.max_value == 10.2
+    assert stats.mean == pytest.approx(4.74)
+    assert stats.fraction_nonzero == 0.6
+    assert stats.q50 == 4.0
+    assert stats.q25 == 0.0
+    assert stats.q75 == 9.5
+    assert repr(stats).startswith("<GeneStatistics(egfr, min=0, max=10.2")
+
+
+def test_gene_statistics_empty():
+    """Test statistics over an empty vector."""
+    stats = GeneStatistics("Egfr", [], 1)
+    assert stats.num_cells == 0
+    assert stats.max_value == 0.0
+    assert stats.fraction_nonzero == 0.0
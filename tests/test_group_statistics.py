@@ -0,0 +1,80 @@
+"""Tests for Grouped Expression Statistics."""
+import numpy as np
+import pytest
+from luna.db.gene_statistics import GeneStatistics
+from luna.db.group_statistics import get_group_statistics, get_group_means
+
+
+def test_group_statistics():
+    """Test that grouped statistics match per-group NumPy statistics."""
+    rng = np.random.default_rng(0)
+    values = rng.gamma(1.0, size=1000).astype(np.float32)
+    values[rng.random(1000) < 0.4] = 0
+    codes = rng.integers(0, 5, size=1000).astype(np.uint8)
+
+    # Group 5 has no cells.
+    group_stats = get_group_statistics(values, codes, 6)
+    for group in range(5):
+        group_values = values[codes == group].astype(np.float64)
+        assert group_stats["num_cells"][group] == len(group_values)
+        assert group_stats["min"][group] == group_values.min()
+        assert group_stats["max"][group] == group_values.max()
+        assert group_stats["mean"][group] == pytest.approx(group_values.mean())
+        assert group_stats["fraction_nonzero"][group] == pytest.approx(
+            np.count_nonzero(group_values) / len(group_values)
+        )
+        for name, quantile in GeneStatistics.QUANTILE_MAP.items():
+            assert group_stats[name][group] == pytest.approx(
+                np.quantile(group_values, quantile)
+            )
+
+    assert group_stats["num_cells"][5] == 0
+    assert group_stats["mean"][5] == 0
+    assert group_stats["q99"][5] == 0
+
+
+def test_group_statistics_small():
+    """Test single cell groups, and mismatched lengths."""
+    group_stats = get_group_statistics([3.0, 1.0, 2.0], [1, 0, 1], 2)
+    assert group_stats["num_cells"].tolist() == [1, 2]
+    assert group_stats["q50"].tolist() == [1.0, 2.5]
+    assert group_stats["fraction_nonzero"].tolist() == [1.0, 1.0]
+
+    empty_stats = get_group_statistics([], [], 2)
+    assert empty_stats["max"].tolist() == [0.0, 0.0]
+
+    with pytest.raises(ValueError):
+        get_group_statistics([1.0], [0, 1], 2)
+
+
+def test_group_means():
+    """Test that one-hot products match per-gene grouped statistics."""
+    rng = np.random.default_rng(1)
+    matrix = rng.gamma(1.0, size=(4, 300)).astype(np.float32)
+    matrix[rng.random((4, 300)) < 0.5] = 0
+    codes = rng.integers(0, 3, size=300).astype(np.uint8)
+
+    num_cells, mean, fraction_nonzero = get_group_means(matrix, codes, 4)
+    assert num_cells.tolist() == np.bincount(codes, minlength=4).tolist()
+    assert mean.shape == fraction_nonzero.shape == (4, 4)
+    for gene in range(4):
+        group_stats = get_group_statistics(matrix[gene], codes, 4)
+        assert np.allclose(mean[gene], group_stats["mean"])
+        assert np.allclose(
+            fraction_nonzero[gene], group_stats["fraction_nonzero"]
+        )
+
+    num_cells, mean, _ = get_group_means(np.zeros((0, 3)), [0, 1, 1], 2)
+    assert num_cells.tolist() == [1, 2]
+    assert mean.shape == (0, 2)
+    with pytest.raises(ValueError):
+        get_group_means(np.zeros((1, 2)), [0, 1, 1], 2)
+
+
+def test_group_means_precision():
+    """Test that means over millions of cells are summed in float64."""
+    matrix = np.full((1, 3000000), 1.1, dtype=np.float32)
+    codes = np.zeros(3000000, dtype=np.uint8)
+    _, mean, fraction_nonzero = get_group_means(matrix, codes, 1)
+    assert mean[0, 0] == pytest.approx(np.float32(1.1), rel=1e-12)
+    assert fraction_nonzero[0, 0] == 1
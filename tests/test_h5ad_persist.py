@@ -1,10 +1,19 @@
 """Tests for Persisting h5ad file to the database."""
 import pytest
+import shutil
+import warnings
+import anndata
+import numpy as np
+from scipy import sparse
 from luna.db import bucket
+from luna.h5ad import h5ad_persist
 from luna.h5ad.h5ad_persist import H5adDb
+from luna.h5ad.column_reader import ColumnReader
 from luna.db import cellular_annotation as ann
 from luna.db import scatter_plot as sca
 from luna.db.db_util import DbConnection
+from luna.db.vector import decode_vector, get_max_error
+from luna.db.gene_statistics import GeneStatistics
 
 
 @pytest.fixture()
@@ -30,6 +39,7 @@ def test_h5ad_persist_select_genes(reset_db):
     verify_cell_ontology_values(session, annotation_id)
     verify_umap(session, bucket_id)
     verify_gene_expression(session, bucket_id)
+    verify_gene_statistics(session, bucket_id)
     session.close()
 
 
@@ -48,6 +58,263 @@ def test_h5ad_persist_all_genes(reset_db):
     session.close()
 
 
+def test_h5ad_persist_bulk_mode(reset_db):
+    """Test Persisting of mini h5ad file in bulk mode, with small batches."""
+    slug = "tabula_muris_mini"
+    file_name = "examples/tabula-muris-mini.h5ad"
+    description = "Mini h5ad test file"
+    url = "http://mini-h5ad-test-file.com"
+    h5ad = H5adDb(
+        slug, file_name, description, url, ingest_mode="bulk", batch_size=2
+    )
+    h5ad.persist_to_database()
+    db_connection = DbConnection()
+    session = db_connection.session
+    bucket_id = verify_bucket(session)
+    verify_gene_expression(session, bucket_id)
+    gene_count = (
+        session.query(ann.CellularAnnotation)
+        .filter_by(type=ann.CellularAnnotationType.GENE_EXPRESSION)
+        .count()
+    )
+    assert gene_count == 3
+    verify_gene_statistics(session, bucket_id)
+    session.close()
+
+
+def test_h5ad_persist_sparse(reset_db, tmp_path):
+    """Test that a sparse h5ad file persists identically to a dense one."""
+    warnings.simplefilter(action="ignore", category=FutureWarning)
+    file_name = "examples/tabula-muris-mini.h5ad"
+    sparse_file_name = str(tmp_path / "tabula-muris-mini-sparse.h5ad")
+    adata = anndata.read_h5ad(file_name)
+    adata.X = sparse.csr_matrix(adata.X)
+    adata.write_h5ad(sparse_file_name)
+
+    H5adDb("dense", file_name, "Dense", "url").persist_to_database()
+    H5adDb("sparse", sparse_file_name, "Sparse", "url").persist_to_database()
+
+    session = DbConnection().session
+    dense_blobs = get_expression_blobs(session, "dense")
+    sparse_blobs = get_expression_blobs(session, "sparse")
+    assert len(dense_blobs) == 3
+    assert dense_blobs == sparse_blobs
+    session.close()
+
+
+def test_h5ad_persist_backed(reset_db):
+    """Test that backed mode persists identically to in-memory mode."""
+    file_name = "examples/tabula-muris-mini.h5ad"
+    H5adDb("memory", file_name, "Memory", "url").persist_to_database()
+    h5ad = H5adDb(
+        "backed", file_name, "Backed", "url", backed=True, chunk_size=2
+    )
+    h5ad.persist_to_database()
+
+    session = DbConnection().session
+    memory_blobs = get_expression_blobs(session, "memory")
+    backed_blobs = get_expression_blobs(session, "backed")
+    assert len(memory_blobs) == 3
+    assert memory_blobs == backed_blobs
+    session.close()
+
+
+@pytest.mark.parametrize("ingest_mode", ["orm", "bulk"])
+def test_h5ad_persist_backed_unsorted(reset_db, monkeypatch, ingest_mode):
+    """Test that backed ingest reads each chunk once, whatever the order."""
+    read_list = []
+    read_chunk = ColumnReader._read_chunk
+
+    def record_read(column_reader, chunk_start):
+        read_list.append(chunk_start)
+        return read_chunk(column_reader, chunk_start)
+
+    monkeypatch.setattr(ColumnReader, "_read_chunk", record_read)
+    file_name = "examples/tabula-muris-mini.h5ad"
+    gene_list = ["Egfr", "Serpina1c", "P2ry12"]
+    h5ad = H5adDb(
+        "backed",
+        file_name,
+        "Backed",
+        "url",
+        gene_list,
+        ingest_mode=ingest_mode,
+        backed=True,
+        chunk_size=2,
+    )
+    h5ad.persist_to_database()
+    assert read_list == [0, 2]
+
+    session = DbConnection().session
+    assert len(get_expression_blobs(session, "backed")) == 3
+    session.close()
+
+
+def test_h5ad_persist_parallel(reset_db, monkeypatch):
+    """Test that parallel ingest persists identically to serial ingest."""
+    file_name = "examples/tabula-muris-mini.h5ad"
+    H5adDb("serial", file_name, "Serial", "url").persist_to_database()
+
+    # Only the spawned workers read X;  the parent never builds a reader.
+    def fail_reader(*args):
+        raise AssertionError("ColumnReader built in the parent process.")
+
+    monkeypatch.setattr(h5ad_persist, "ColumnReader", fail_reader)
+    h5ad = H5adDb(
+        "parallel",
+        file_name,
+        "Parallel",
+        "url",
+        ingest_mode="bulk",
+        workers=2,
+        correlation=True,
+    )
+    h5ad.persist_to_database()
+
+    session = DbConnection().session
+    serial_blobs = get_expression_blobs(session, "serial")
+    parallel_blobs = get_expression_blobs(session, "parallel")
+    assert len(serial_blobs) == 3
+    assert serial_blobs == parallel_blobs
+    record = session.query(bucket.Bucket).filter_by(slug="parallel").one()
+    assert record.status == bucket.Bucket.READY
+    assert session.query(GeneStatistics).count() == 6
+
+    # Correlation scores are only stored on request.
+    scored = GeneStatistics.pearson_blob.isnot(None)
+    record_list = session.query(bucket.Bucket.slug).join(
+        GeneStatistics, GeneStatistics.bucket_id == bucket.Bucket.id
+    )
+    assert {r.slug for r in record_list.filter(scored)} == {"parallel"}
+    session.close()
+
+
+def test_h5ad_persist_quantized(reset_db):
+    """Test storage of expression at reduced precision, with compression."""
+    file_name = "examples/tabula-muris-mini.h5ad"
+    H5adDb("full", file_name, "Full", "url").persist_to_database()
+    h5ad = H5adDb(
+        "quantized",
+        file_name,
+        "Quantized",
+        "url",
+        ingest_mode="bulk",
+        workers=2,
+        precision="uint8",
+        compression="zstd",
+    )
+    h5ad.persist_to_database()
+
+    session = DbConnection().session
+    full_blobs = get_expression_blobs(session, "full")
+    quantized_blobs = get_expression_blobs(session, "quantized")
+    record = session.query(bucket.Bucket).filter_by(slug="quantized").one()
+    record_list = session.query(ann.CellularAnnotation).filter_by(
+        bucket_id=record.id, type=ann.CellularAnnotationType.GENE_EXPRESSION
+    )
+    for record in record_list:
+        assert record.value_encoding == "uint8+zstd"
+        full_values = decode_vector(full_blobs[record.slug])
+        values = record.get_values()
+        max_error = get_max_error(full_values, record.value_encoding)
+        assert np.abs(values - full_values).max() <= max_error
+        assert len(quantized_blobs[record.slug]) < len(full_blobs[record.slug])
+    session.close()
+
+    with pytest.raises(ValueError):
+        H5adDb("bad", file_name, "Bad", "url", precision="int4")
+
+
+def test_h5ad_persist_resume(reset_db):
+    """Test that an interrupted ingest resumes from the last gene."""
+    file_name = "examples/tabula-muris-mini.h5ad"
+    h5ad = H5adDb("mini", file_name, "Mini", "url", ["Egfr", "Pten"])
+    with pytest.raises(KeyError):
+        h5ad.persist_to_database()
+
+    # The partially loaded bucket is kept, but not yet ready.
+    session = DbConnection().session
+    record = session.query(bucket.Bucket).filter_by(slug="mini").one()
+    assert record.status == bucket.Bucket.LOADING
+    assert list(get_expression_blobs(session, "mini")) == ["egfr"]
+    num_annotations = session.query(ann.CellularAnnotation).count()
+
+    # Simulate statistics left behind by an interrupted bulk batch.
+    session.add(GeneStatistics("P2ry12", [0.0], record.id))
+    session.commit()
+    session.close()
+
+    # Re-running resumes, without duplicating data already loaded.
+    h5ad = H5adDb("mini", file_name, "Mini", "url", ["Egfr", "P2ry12"])
+    h5ad.persist_to_database()
+    assert h5ad.gene_list == ["P2ry12"]
+    session = DbConnection().session
+    record = session.query(bucket.Bucket).filter_by(slug="mini").one()
+    assert record.status == bucket.Bucket.READY
+    assert sorted(get_expression_blobs(session, "mini")) == ["egfr", "p2ry12"]
+    assert session.query(ann.CellularAnnotation).count() == num_annotations + 1
+    assert session.query(sca.ScatterPlot).count() == 2
+    stats = session.query(GeneStatistics).filter_by(slug="p2ry12").one()
+    assert stats.num_cells == 100
+    session.close()
+
+
+def test_h5ad_persist_incremental(reset_db, tmp_path):
+    """Test adding new genes to a bucket that is already loaded."""
+    file_name = "examples/tabula-muris-mini.h5ad"
+    H5adDb("mini", file_name, "Mini", "url", ["Egfr"]).persist_to_database()
+    session = DbConnection().session
+    record = session.query(bucket.Bucket).filter_by(slug="mini").one()
+    version = record.version
+    session.close()
+
+    h5ad = H5adDb(
+        "mini", file_name, "Mini", "url", ["Egfr", "Serpina1c"], "bulk"
+    )
+    h5ad.persist_to_database()
+    session = DbConnection().session
+    record = session.query(bucket.Bucket).filter_by(slug="mini").one()
+    assert record.version != version
+    assert sorted(get_expression_blobs(session, "mini")) == [
+        "egfr",
+        "serpina1c",
+    ]
+    assert session.query(GeneStatistics).count() == 2
+    session.close()
+
+    # A bucket slug cannot be reused for a different file.
+    other_file_name = str(tmp_path / "tabula-muris-other.h5ad")
+    shutil.copy(file_name, other_file_name)
+    with pytest.raises(ValueError):
+        H5adDb("mini", other_file_name, "", "").persist_to_database()
+
+
+def get_expression_blobs(session, bucket_slug):
+    """Get all gene expression blobs for the specified bucket, by slug."""
+    bucket_id = session.query(bucket.Bucket).filter_by(slug=bucket_slug)
+    bucket_id = bucket_id.first().id
+    target_type = ann.CellularAnnotationType.GENE_EXPRESSION
+    record_list = (
+        session.query(ann.CellularAnnotation)
+        .filter_by(bucket_id=bucket_id, type=target_type)
+        .all()
+    )
+    return {r.slug: bytes(r.value_blob) for r in record_list}
+
+
+def test_h5ad_remove_duplicate_genes():
+    """Test that genes are unique by slug."""
+    h5ad = H5adDb("slug", "examples/tabula-muris-mini.h5ad", "", "")
+    gene_list = ["Egfr", "EGFR", "Pten", "Gm1.1", "Gm1.2"]
+    assert h5ad._remove_duplicate_genes(gene_list) == ["Egfr", "Pten", "Gm1.1"]
+
+
+def test_h5ad_invalid_ingest_mode():
+    """Test that an unknown ingest mode is rejected."""
+    with pytest.raises(ValueError):
+        H5adDb("slug", "examples/tabula-muris-mini.h5ad", "", "", [], "xxx")
+
+
 def verify_bucket(session):
     """Verify Bucket Contents."""
     bucket_list = session.query(bucket.Bucket).all()
@@ -83,23 +350,57 @@ def verify_umap(session, bucket_id):
     )
     target = "-0.437479,13.087562|-0.407288,2.570779|-1.995685,17.068936|"
     assert record.coordinate_list.startswith(target)
+    lod_order = np.frombuffer(record.lod_order, dtype="<i4")
+    assert sorted(lod_order.tolist()) == list(range(100))
     assert repr(record).startswith("<ScatterPlot(vector of 101 elements)>")
 
 
 def verify_gene_expression(session, bucket_id):
     """Verify Gene Expression Data."""
     record = (
-        session.query(ann.CellularAnnotation.value_list)
+        session.query(ann.CellularAnnotation)
+        .filter_by(bucket_id=bucket_id, slug="egfr")
+        .first()
+    )
+    assert record.value_list is None
+    values = decode_vector(record.value_blob)
+    target = [0.6931472, 0.6931472, 4.1136827, 0.6931472, 0.6931472]
+    assert np.array_equal(values[0:5], np.array(target, dtype=np.float32))
+    assert repr(record) == (
+        "<CellularAnnotation(egfr, type=CellularAnnotationType."
+        "GENE_EXPRESSION, vector of 100 elements)>"
+    )
+
+
+def verify_gene_statistics(session, bucket_id):
+    """Verify Gene Statistics, computed at ingest."""
+    assert session.query(GeneStatistics).count() == 3
+    record = (
+        session.query(ann.CellularAnnotation)
+        .filter_by(bucket_id=bucket_id, slug="egfr")
+        .first()
+    )
+    values = decode_vector(record.value_blob).astype(np.float64)
+    stats = (
+        session.query(GeneStatistics)
         .filter_by(bucket_id=bucket_id, slug="egfr")
         .first()
     )
-    target = "0.6931472|0.6931472|4.1136827|0.6931472|0.6931472|0.6931472"
-    assert record.value_list.startswith(target)
+    assert stats.num_cells == 100
+    assert stats.min_value == values.min()
+    assert stats.max_value == values.max()
+    assert stats.mean == pytest.approx(values.mean())
+    assert stats.fraction_nonzero == np.count_nonzero(values) / 100
+    assert stats.q50 == pytest.approx(np.median(values))
 
 
 def verify_cell_ontology_values(session, a_id):
     """Verify cell ontology values."""
     record = session.query(ann.CellularAnnotation).filter_by(id=a_id).first()
-    target = "epidermal cell|endothelial cell|basal cell|endothelial"
-    assert record.value_list.startswith(target)
+    assert record.value_list is None
+    category_list = record.get_categories()
+    assert category_list[0:2] == ["astrocyte", "B cell"]
+    value_list = [category_list[code] for code in record.get_codes()]
+    target = ["epidermal cell", "endothelial cell", "basal cell"]
+    assert value_list[0:3] == target
     assert repr(record).startswith("<CellularAnnotation(cell_ontology_class")
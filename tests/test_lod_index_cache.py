@@ -0,0 +1,18 @@
+"""Tests for the LOD Index Cache."""
+from luna.api.lod_index_cache import LodIndexCache
+
+
+def test_lod_index_cache():
+    """Test that new bucket versions replace earlier entries."""
+    cache = LodIndexCache()
+    assert cache.get(1, "v1", "umap") is None
+    cache.put(1, "v1", "umap", "umap-v1")
+    cache.put(1, "v1", "tsne", "tsne-v1")
+    cache.put(2, "v1", "umap", "other")
+    assert cache.get(1, "v1", "umap") == "umap-v1"
+
+    cache.put(1, "v2", "umap", "umap-v2")
+    assert cache.get(1, "v1", "umap") is None
+    assert cache.get(1, "v1", "tsne") is None
+    assert cache.get(1, "v2", "umap") == "umap-v2"
+    assert cache.get(2, "v1", "umap") == "other"
@@ -0,0 +1,92 @@
+"""Tests for the Metadata Cache."""
+import pytest
+from luna.api.metadata_cache import MetadataCache
+from luna.db.bucket import Bucket
+from luna.db.db_util import DbConnection
+from luna.db.generation import Generation
+from luna.db import cellular_annotation as ann
+
+
+@pytest.fixture()
+def reset_db():
+    """Fixture to ensure each test starts with a clean slate database."""
+    db_connection = DbConnection()
+    db_connection.reset_database()
+
+
+def test_metadata_cache(reset_db):
+    """Test caching and generation-based invalidation of metadata."""
+    session = DbConnection().session
+    bucket1 = add_bucket(session, "bucket1")
+    session.add(
+        ann.CellularAnnotation(
+            "Egfr", ann.CellularAnnotationType.GENE_EXPRESSION, [1.0], 1
+        )
+    )
+    session.add(
+        ann.CellularAnnotation(
+            "tissue", ann.CellularAnnotationType.OTHER, ["Lung"], 1
+        )
+    )
+    session.commit()
+    assert Generation.get_current(session) is None
+    assert Generation.bump(session) == 1
+
+    cache = MetadataCache(ttl=300, check_interval=0)
+    assert cache.get_bucket_id(session, "bucket1") == bucket1.id
+    assert cache.get_bucket_id(session, "bucket2") is None
+    assert cache.get_annotation_list(session, bucket1.id) == [
+        ("tissue", "tissue")
+    ]
+    assert cache.get_gene_list(session, bucket1.id) == ["egfr"]
+    gene_index = cache.get_gene_index(session, bucket1.id)
+    assert "egfr" in gene_index
+    assert cache.get_gene_index(session, bucket1.id) is gene_index
+
+    # Without a generation bump, new buckets are not yet visible.
+    add_bucket(session, "bucket2")
+    assert cache.get_bucket_id(session, "bucket2") is None
+
+    # After a generation bump, the cache is refreshed.
+    assert Generation.bump(session) == 2
+    assert cache.get_bucket_id(session, "bucket2") is not None
+
+    # Explicit invalidation also clears the cache.
+    add_bucket(session, "bucket3")
+    cache.invalidate()
+    assert cache.get_bucket_id(session, "bucket3") is not None
+    session.close()
+
+
+def test_metadata_cache_loading(reset_db):
+    """Test that buckets are hidden until all of their data is loaded."""
+    session = DbConnection().session
+    bucket1 = Bucket("bucket1", "bucket_description", "http://bucket.com")
+    session.add(bucket1)
+    session.commit()
+    cache = MetadataCache(ttl=300, check_interval=0)
+    assert cache.get_bucket_id(session, "bucket1") is None
+    bucket1.status = Bucket.READY
+    session.commit()
+    cache.invalidate()
+    assert cache.get_bucket_id(session, "bucket1") == bucket1.id
+    session.close()
+
+
+def test_metadata_cache_ttl(reset_db):
+    """Test that cached metadata expires after the TTL."""
+    session = DbConnection().session
+    cache = MetadataCache(ttl=0, check_interval=0)
+    assert cache.get_bucket_id(session, "bucket1") is None
+    add_bucket(session, "bucket1")
+    assert cache.get_bucket_id(session, "bucket1") is not None
+    session.close()
+
+
+def add_bucket(session, slug):
+    """Add a fully loaded bucket."""
+    bucket = Bucket(slug, "bucket_description", "http://bucket.com")
+    bucket.status = Bucket.READY
+    session.add(bucket)
+    session.commit()
+    return bucket
@@ -0,0 +1,51 @@
+"""Tests for the request Metrics."""
+from luna.api.metrics import Histogram, Metrics, stage, DB, DECODE
+
+
+def test_histogram_buckets():
+    """Test that histogram buckets are cumulative, with a +Inf bucket."""
+    histogram = Histogram("latency", "Latency.", ["route"], [0.1, 1])
+    for value in [0.05, 0.1, 0.5, 2]:
+        histogram.observe(("/genes",), value)
+    line_list = list(histogram.collect())
+    assert line_list == [
+        'latency_bucket{route="/genes",le="0.1"} 2',
+        'latency_bucket{route="/genes",le="1"} 3',
+        'latency_bucket{route="/genes",le="+Inf"} 4',
+        'latency_sum{route="/genes"} 2.65',
+        'latency_count{route="/genes"} 4',
+    ]
+
+
+def test_metrics_render():
+    """Test the text exposition format, including label escaping."""
+    metrics = Metrics()
+    metrics.observe_request(
+        "/expression/{bucket_slug}/{gene}",
+        'a"b',
+        "GET",
+        200,
+        0.002,
+        1000,
+        {DB: 0.001},
+    )
+    text = metrics.render()
+    assert "# TYPE luna_requests_total counter" in text
+    assert "# TYPE luna_request_duration_seconds histogram" in text
+    assert (
+        'luna_requests_total{route="/expression/{bucket_slug}/{gene}",'
+        'bucket="a\\"b",method="GET",status="200"} 1'
+    ) in text
+    assert 'luna_response_size_bytes_bucket{route="/expression' in text
+    assert 'stage="db",le="0.001"} 1' in text
+    assert text.endswith("\n")
+
+    metrics.reset()
+    assert "luna_requests_total{" not in metrics.render()
+
+
+def test_stage_outside_request():
+    """Test that stages timed outside a request are ignored."""
+    with stage(DECODE):
+        value = 1
+    assert value == 1
@@ -0,0 +1,43 @@
+"""Tests for the Response Cache."""
+from luna.api.response_cache import ResponseCache
+
+
+def test_response_cache_lru():
+    """Test LRU eviction within the byte budget."""
+    cache = ResponseCache(max_bytes=10)
+    cache.put("a", "application/json", b"1234")
+    cache.put("b", "application/json", b"5678")
+    assert cache.get("a") == ("application/json", b"1234", {})
+
+    # "b" is now least recently used, and is evicted first.
+    cache.put("c", "application/json", b"9012")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.num_bytes == 8
+
+
+def test_response_cache_oversized():
+    """Test that entries larger than the budget are never cached."""
+    cache = ResponseCache(max_bytes=4)
+    cache.put("a", "application/json", b"12345")
+    assert cache.get("a") is None
+    assert cache.num_bytes == 0
+
+    cache = ResponseCache(max_bytes=0)
+    cache.put("a", "application/json", b"1")
+    assert cache.get("a") is None
+
+
+def test_response_cache_chunks():
+    """Test that bodies of chunks count all of their bytes."""
+    cache = ResponseCache(max_bytes=10)
+    cache.put("a", "application/octet-stream", [b"1234", b"5678"])
+    assert cache.num_bytes == 8
+    cache.put("b", "application/octet-stream", [b"90", b"12"])
+    assert cache.get("a") is None
+    assert cache.get("b") == ("application/octet-stream", [b"90", b"12"], {})
+    assert cache.num_bytes == 4
+
+    cache.put("c", "application/octet-stream", [b"123456", b"78901"])
+    assert cache.get("c") is None
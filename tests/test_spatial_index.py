@@ -0,0 +1,75 @@
+"""Tests for the Level-of-Detail Spatial Index."""
+import numpy as np
+from luna.db import spatial_index
+
+
+def test_build_lod_order():
+    """Test that the LOD order is a coarse to fine permutation."""
+    rng = np.random.default_rng(42)
+    coordinates = rng.uniform(-10, 10, size=(1000, 2))
+    lod_order = spatial_index.build_lod_order(coordinates)
+    assert lod_order.dtype == spatial_index.INDEX_DTYPE
+    assert sorted(lod_order.tolist()) == list(range(1000))
+
+    # A short prefix covers all four quadrants.
+    prefix = coordinates[lod_order[0:8]]
+    quadrants = {(x > 0, y > 0) for x, y in prefix}
+    assert len(quadrants) == 4
+
+
+def test_build_lod_order_degenerate():
+    """Test empty and identical coordinates."""
+    assert len(spatial_index.build_lod_order(np.zeros((0, 2)))) == 0
+    lod_order = spatial_index.build_lod_order(np.ones((5, 2)))
+    assert sorted(lod_order.tolist()) == [0, 1, 2, 3, 4]
+
+
+def test_lod_index_query():
+    """Test viewport and point budget queries."""
+    coordinates = np.array(
+        [[0.0, 0.0], [1.0, 1.0], [2.0, 2.0], [3.0, 3.0], [4.0, 4.0]]
+    )
+    lod_order = spatial_index.build_lod_order(coordinates)
+    lod_index = spatial_index.LodIndex(lod_order, coordinates[lod_order])
+    assert len(lod_index) == 5
+
+    index_list, subset, total = lod_index.query()
+    assert total == 5
+    assert sorted(index_list.tolist()) == [0, 1, 2, 3, 4]
+
+    bbox = (0.5, 3.5, None, None)
+    index_list, subset, total = lod_index.query(bbox, limit=2)
+    assert total == 3
+    assert len(index_list) == 2
+    assert set(index_list.tolist()) <= {1, 2, 3}
+    assert np.array_equal(subset, coordinates[index_list])
+
+    bbox = (3.5, 0.5, None, None)
+    assert lod_index.query(bbox)[2] == 0
+    bbox = (float("nan"), None, None, None)
+    assert lod_index.query(bbox)[2] == 0
+
+    empty = np.zeros(0, dtype=spatial_index.INDEX_DTYPE)
+    lod_index = spatial_index.LodIndex(empty, np.zeros((0, 2)))
+    assert lod_index.query((0, 1, 0, 1))[2] == 0
+
+
+def test_lod_index_matches_scan():
+    """Test that tile pruning matches a scan of all cells, in LOD order."""
+    rng = np.random.default_rng(7)
+    coordinates = rng.normal(size=(5000, 2)).astype(np.float32)
+    lod_order = spatial_index.build_lod_order(coordinates)
+    lod_coordinates = coordinates[lod_order]
+    lod_index = spatial_index.LodIndex(lod_order, lod_coordinates)
+    x = lod_coordinates[:, 0].astype(np.float64)
+    y = lod_coordinates[:, 1].astype(np.float64)
+    for _ in range(50):
+        x_min, x_max = np.sort(rng.uniform(-4, 4, size=2))
+        y_min, y_max = np.sort(rng.uniform(-4, 4, size=2))
+        bbox = (x_min, x_max, y_min, None)
+        mask = (x >= x_min) & (x <= x_max) & (y >= y_min)
+        position_list = np.flatnonzero(mask)
+        index_list, subset, total = lod_index.query(bbox, limit=100)
+        assert total == len(position_list)
+        assert np.array_equal(index_list, lod_order[position_list[:100]])
+        assert np.array_equal(subset, lod_coordinates[position_list[:100]])
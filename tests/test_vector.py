@@ -0,0 +1,78 @@
+"""Tests for Binary Vector Encoding."""
+import numpy as np
+import pytest
+from luna.db.vector import (
+    encode_vector,
+    decode_vector,
+    get_encoding,
+    get_max_error,
+    PRECISION_LIST,
+    COMPRESSION_LIST,
+    FLOAT32,
+    FLOAT16,
+    UINT16,
+    UINT8,
+    ZSTD,
+)
+
+
+def test_encode_decode():
+    """Test round trip of values through binary encoding."""
+    value_list = [0.0, 0.6931472, 4.1136827, 7.354609]
+    blob = encode_vector(value_list)
+    assert len(blob) == 4 * len(value_list)
+    assert blob[0:4] == b"\x00\x00\x00\x00"
+
+    values = decode_vector(blob)
+    assert values.dtype == np.dtype("<f4")
+    assert np.array_equal(values, np.array(value_list, dtype=np.float32))
+
+
+def test_encode_empty():
+    """Test encoding of an empty vector."""
+    assert encode_vector([]) == b""
+    assert len(decode_vector(b"")) == 0
+
+
+def test_encodings():
+    """Test that every encoding decodes within its documented error."""
+    rng = np.random.default_rng(0)
+    values = np.log1p(rng.poisson(2.0, size=5000) * rng.random(5000) * 50)
+    values = values.astype(np.float32)
+    raw_size = len(encode_vector(values))
+    for precision in PRECISION_LIST:
+        for compression in COMPRESSION_LIST:
+            encoding = get_encoding(precision, compression)
+            blob = encode_vector(values, encoding)
+            decoded = decode_vector(blob, encoding)
+            assert decoded.dtype == np.dtype("<f4")
+            error = np.abs(decoded.astype(np.float64) - values).max()
+            assert error <= get_max_error(values, encoding)
+            assert np.all(decoded[values == 0] == 0)
+            if precision != FLOAT32:
+                assert len(blob) <= raw_size // 2 + 64
+
+    # Documented bounds, for values in [0, 10].
+    values = np.linspace(0, 10, 1001)
+    assert get_max_error(values, get_encoding(UINT8)) < 0.0197
+    assert get_max_error(values, get_encoding(UINT16)) < 0.0001
+    assert get_max_error(values, get_encoding(FLOAT16)) < 0.005
+    assert get_max_error(values) == 0
+
+
+def test_encoding_options():
+    """Test encoding strings, constant vectors and out of range values."""
+    assert get_encoding() is None
+    assert get_encoding(UINT8) == "uint8"
+    assert get_encoding(FLOAT16, ZSTD) == "float16+zstd"
+    assert decode_vector(encode_vector([], "uint8+lz4"), "uint8+lz4").size == 0
+    with pytest.raises(ValueError):
+        get_encoding("int4")
+    with pytest.raises(ValueError):
+        get_encoding(UINT8, "gzip")
+
+    encoding = get_encoding(UINT8, ZSTD)
+    decoded = decode_vector(encode_vector([3.5, 3.5], encoding), encoding)
+    assert decoded.tolist() == [3.5, 3.5]
+    with pytest.raises(ValueError):
+        encode_vector([1e6], FLOAT16)